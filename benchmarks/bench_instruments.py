@@ -0,0 +1,146 @@
+"""
+Benchmark: instrument frame memory, lookup index build, memory and lookups.
+
+Builds a synthetic instrument list shaped like kite.instruments() (equities,
+futures and options across NSE/BSE/NFO/BFO/MCX) and compares:
+  1. legacy - symbol_map via to_dict('index') + criteria_map via iterrows
+  2. index  - InstrumentIndex.build (vectorized, integer-coded, NumPy arrays)
+
+Frame memory compares the raw DataFrame(kite.instruments()) the app used to
+keep against compact_instruments (used columns, categorical / 32-bit dtypes),
+and reports how much of the compact frame is memory-mapped after a round trip
+through the on-disk cache (shared read-only between worker processes).
+
+Index memory is what the structures retain after the build (tracemalloc);
+lookups are per call, averaged over every symbol / criteria key.
+
+Usage: python benchmarks/bench_instruments.py [--rows 120000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from managers import instrument_cache
+from managers.instrument_index import InstrumentIndex, compact_instruments, frame_memory
+
+def synthetic_instruments(n, seed=1):
+    rng = random.Random(seed)
+    names = [f"STK{i}" for i in range(1500)] + ["NIFTY", "BANKNIFTY", "FINNIFTY", "SENSEX", "CRUDEOIL", "GOLD"]
+    expiries = [date(2026, 10, 20) + timedelta(days=7 * i) for i in range(12)]
+    rows = []
+    token = 1000
+    # Equities: listed on both NSE and BSE under the same tradingsymbol
+    for name in names:
+        for exchange in ('NSE', 'BSE'):
+            token += 1
+            rows.append(dict(instrument_token=token, exchange_token=token // 256, tradingsymbol=name, name=name, last_price=0.0,
+                             expiry='', strike=0.0, tick_size=0.05, lot_size=1, instrument_type='EQ', segment=exchange,
+                             exchange=exchange))
+    # Derivatives: one contract per (name, expiry, type, strike)
+    seen = set()
+    while len(rows) < n:
+        name = rng.choice(names)
+        expiry = rng.choice(expiries)
+        inst_type = rng.choice(['CE', 'PE', 'FUT'])
+        strike = 0.0 if inst_type == 'FUT' else float(rng.randrange(100, 60000, 50))
+        if (name, expiry, inst_type, strike) in seen:
+            continue
+        seen.add((name, expiry, inst_type, strike))
+        token += 1
+        exchange = 'MCX' if name in ('CRUDEOIL', 'GOLD') else ('BFO' if name == 'SENSEX' else 'NFO')
+        suffix = 'FUT' if inst_type == 'FUT' else f"{int(strike)}{inst_type}"
+        rows.append(dict(instrument_token=token, exchange_token=token // 256, tradingsymbol=f"{name}{expiry.strftime('%y%b%d').upper()}{suffix}",
+                         name=name, last_price=0.0, expiry=expiry, strike=strike, tick_size=0.05, lot_size=rng.choice([15, 25, 50, 75]),
+                         instrument_type=inst_type, segment=f"{exchange}-OPT", exchange=exchange))
+    return rows
+
+def legacy_build(df):
+    """The maps fetch_instruments used to build."""
+    temp_df = df.copy()
+    exchange_priority = {'NFO': 0, 'MCX': 1, 'CDS': 2, 'NSE': 3, 'BSE': 4, 'BFO': 5}
+    temp_df['priority'] = temp_df['exchange'].map(exchange_priority).fillna(99)
+    temp_df.sort_values('priority', inplace=True)
+    unique_symbols = temp_df.drop_duplicates(subset=['tradingsymbol'])
+    symbol_map = unique_symbols.set_index('tradingsymbol').to_dict('index')
+    criteria_map = {}
+    subset = unique_symbols.dropna(subset=['name', 'expiry_str', 'instrument_type'])
+    for _, row in subset.iterrows():
+        try:
+            s_val = float(row['strike']) if row['strike'] else 0.0
+            criteria_map[(row['name'], row['expiry_str'], row['instrument_type'], s_val)] = row['tradingsymbol']
+        except: continue
+    return symbol_map, criteria_map
+
+def measure(build, df):
+    """Build time untraced, then retained / peak memory in a second, traced build."""
+    t0 = time.perf_counter()
+    build(df)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    result = build(df)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, retained, peak
+
+def per_call_us(fn, args_list):
+    t0 = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - t0) / len(args_list) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=120000)
+    args = ap.parse_args()
+
+    instruments = synthetic_instruments(args.rows)
+    df = pd.DataFrame(instruments)
+    df['expiry_str'] = pd.to_datetime(df['expiry'], errors='coerce').dt.strftime('%Y-%m-%d')
+    df['expiry_date'] = pd.to_datetime(df['expiry'], errors='coerce').dt.date
+    print(f"{len(df)} instruments\n")
+
+    t0 = time.perf_counter()
+    compact = compact_instruments(instruments)
+    t_compact = time.perf_counter() - t0
+    cache_dir = tempfile.mkdtemp()
+    instrument_cache.save(cache_dir, "bench", compact, InstrumentIndex.build(compact))
+    mapped, _ = instrument_cache.load(cache_dir, "bench")
+    print(f"\n{'frame':<8} {'memory':>10} {'mapped':>10}")
+    print(f"{'raw':<8} {df.memory_usage(deep=True).sum() / 1e6:7.1f} MB {0:7.1f} MB")
+    for name, frame in (("compact", compact), ("cached", mapped)):
+        mem = frame_memory(frame)
+        print(f"{name:<8} {mem['bytes'] / 1e6:7.1f} MB {mem['mapped_bytes'] / 1e6:7.1f} MB")
+    print(f"(compacting took {t_compact * 1000:.0f} ms)\n")
+
+    (symbol_map, criteria_map), t_legacy, mem_legacy, peak_legacy = measure(legacy_build, df)
+    index, t_index, mem_index, peak_index = measure(InstrumentIndex.build, compact)
+    print(f"{'build':<8} {'time':>9} {'retained':>10} {'peak':>10}")
+    print(f"{'legacy':<8} {t_legacy * 1000:7.0f} ms {mem_legacy / 1e6:7.1f} MB {peak_legacy / 1e6:7.1f} MB")
+    print(f"{'index':<8} {t_index * 1000:7.0f} ms {mem_index / 1e6:7.1f} MB {peak_index / 1e6:7.1f} MB")
+
+    symbols = list(symbol_map)
+    keys = list(criteria_map)
+    mismatches = sum(index.lot_size(index.row(s)) != int(symbol_map[s]['lot_size']) for s in symbols)
+    mismatches += sum(index.find(k[0], k[1], k[2], k[3]) != ts for k, ts in criteria_map.items())
+    print(f"\nresults identical: {mismatches == 0} ({len(symbols)} symbols, {len(keys)} criteria keys)\n")
+
+    print(f"{'lookup (us/call)':<18} {'legacy':>8} {'index':>8}")
+    sym_args = [(s,) for s in symbols]
+    print(f"{'lot size':<18} {per_call_us(lambda s: int(symbol_map[s]['lot_size']), sym_args):8.2f} "
+          f"{per_call_us(lambda s: index.lot_size(index.row(s)), sym_args):8.2f}")
+    print(f"{'exchange':<18} {per_call_us(lambda s: symbol_map[s]['exchange'], sym_args):8.2f} "
+          f"{per_call_us(lambda s: index.exchange(index.row(s)), sym_args):8.2f}")
+    print(f"{'exact symbol':<18} {per_call_us(lambda *k: criteria_map[k], keys):8.2f} "
+          f"{per_call_us(lambda n, e, t, s: index.find(n, e, t, s), keys):8.2f}")
+    print(f"{'display name':<18} {'':>8} {per_call_us(lambda s: index.display_name(index.row(s)), sym_args):8.2f}")
+
+if __name__ == "__main__":
+    main()
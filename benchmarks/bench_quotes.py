@@ -0,0 +1,121 @@
+"""
+Benchmark: single-symbol kite.quote calls vs the coalescing QuoteBatcher.
+
+MockKiteConnect's quote gets an artificial round trip (--latency-ms) and a
+rolling per-second call limit (--rate-limit; Kite's quote API allows very few
+calls per second, extra calls fail with "Too many requests"). Each
+round, --callers threads ask for --symbols-per-call symbols from a small
+hot set at the same moment, like the sync route, the trade panel's
+specific_ltp, search and get_symbol_details all polling together. Compares:
+  1. direct  - every caller does its own kite.quote
+  2. batched - callers go through QuoteBatcher (merged + deduplicated)
+
+Usage: python benchmarks/bench_quotes.py [--rounds 20] [--callers 16] [--latency-ms 50]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_broker import MockKiteConnect
+from managers.quote_batcher import QuoteBatcher
+
+class SlowQuoteKite(MockKiteConnect):
+    """MockKiteConnect whose quote() costs a fixed round trip, is rate limited and counts calls."""
+    def __init__(self, latency_ms, rate_limit=0):
+        super().__init__()
+        self.quote_latency = latency_ms / 1000.0
+        self.quote_rate_limit = rate_limit
+        self.quote_calls = 0
+        self.quote_symbols = 0
+        self.quote_rejected = 0
+        self._quote_times = []
+        self._count_lock = threading.Lock()
+
+    def quote(self, instruments):
+        if isinstance(instruments, str): instruments = [instruments]
+        with self._count_lock:
+            now = time.time()
+            if self.quote_rate_limit:
+                self._quote_times = [ts for ts in self._quote_times if now - ts < 1.0]
+                if len(self._quote_times) >= self.quote_rate_limit:
+                    self.quote_rejected += 1
+                    raise Exception("Too many requests")
+                self._quote_times.append(now)
+            self.quote_calls += 1
+            self.quote_symbols += len(instruments)
+        time.sleep(self.quote_latency)
+        return super().quote(instruments)
+
+def run(fetch, kite, rounds, callers, per_call, hot, interval):
+    """Returns per-request latencies (ms) of successful requests, failures and the wall time."""
+    latencies, failed = [], []
+    lat_lock = threading.Lock()
+    rng = random.Random(7)
+    plans = [[rng.sample(hot, per_call) for _ in range(callers)] for _ in range(rounds)]
+
+    def caller(keys, start):
+        start.wait()
+        t0 = time.perf_counter()
+        try:
+            res = fetch(kite, keys)
+            assert all(k in res for k in keys), keys
+        except Exception:
+            with lat_lock: failed.append(keys)
+            return
+        with lat_lock:
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    for plan in plans:
+        start = threading.Event()
+        threads = [threading.Thread(target=caller, args=(keys, start)) for keys in plan]
+        for th in threads: th.start()
+        start.set()
+        for th in threads: th.join()
+        # Pause between polling rounds
+        time.sleep(interval)
+    return latencies, failed, time.perf_counter() - t0
+
+def report(name, kite, latencies, failed, elapsed):
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)] if latencies else 0
+    print(f"{name:<8} {elapsed * 1000:8.1f} ms total  p50 {p50:6.1f} ms  p95 {p95:6.1f} ms  "
+          f"{kite.quote_calls:4d} quote calls  {kite.quote_symbols:5d} symbols  "
+          f"{len(failed):4d} failed requests ({kite.quote_rejected} rate-limited calls)")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--callers", type=int, default=16)
+    ap.add_argument("--symbols-per-call", type=int, default=2)
+    ap.add_argument("--hot", type=int, default=12, help="distinct symbols the callers draw from")
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--rate-limit", type=int, default=10, help="quote calls per second (0 = unlimited)")
+    ap.add_argument("--interval-ms", type=float, default=200, help="pause between rounds")
+    ap.add_argument("--window-ms", type=float, default=5)
+    args = ap.parse_args()
+
+    probe = SlowQuoteKite(0)
+    hot = [f"{i['exchange']}:{i['tradingsymbol']}" for i in probe.mock_instruments][:args.hot]
+    print(f"quote latency {args.latency_ms} ms, limit {args.rate_limit or 'none'}/s, {args.rounds} rounds x "
+          f"{args.callers} concurrent callers every {args.interval_ms:g} ms, {args.symbols_per_call} of {len(hot)} hot symbols each\n")
+    interval = args.interval_ms / 1000.0
+
+    kite = SlowQuoteKite(args.latency_ms, args.rate_limit)
+    lat, failed, elapsed = run(lambda k, keys: k.quote(keys), kite, args.rounds, args.callers, args.symbols_per_call, hot, interval)
+    report("direct", kite, lat, failed, elapsed)
+
+    kite = SlowQuoteKite(args.latency_ms, args.rate_limit)
+    batcher = QuoteBatcher(window=args.window_ms / 1000.0)
+    lat, failed, elapsed = run(batcher.quote, kite, args.rounds, args.callers, args.symbols_per_call, hot, interval)
+    report("batched", kite, lat, failed, elapsed)
+    print(f"\nbatcher: {batcher.stats()}")
+
+if __name__ == "__main__":
+    main()
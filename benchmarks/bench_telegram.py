@@ -0,0 +1,125 @@
+"""
+Benchmark: Telegram send path against a local stand-in for api.telegram.org.
+
+The stand-in charges HANDSHAKE_MS per new TCP connection (standing in for the
+TLS handshake) and API_MS per request. Compares:
+  1. legacy  - one fresh requests.post per channel, channels sent one after another
+  2. pooled  - shared keep-alive session, channels still sequential
+  3. outbox  - notify_trade_event, waiting on its futures: pooled session + parallel channel lanes
+
+Usage: python benchmarks/bench_telegram.py [--trades 20] [--handshake-ms 40] [--api-ms 60]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from flask import Flask
+from database import db
+
+CHANNELS = {'channel_id': '-100', 'vip_channel_id': '-200', 'free_channel_id': '-300', 'z2h_channel_id': '-400'}
+
+def start_stand_in(handshake_ms, api_ms):
+    ids = itertools.count(1)
+    stats = {"connections": 0, "requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            stats["connections"] += 1
+            time.sleep(handshake_ms / 1000.0)
+            super().setup()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            stats["requests"] += 1
+            time.sleep(api_ms / 1000.0)
+            body = json.dumps({"ok": True, "result": {"message_id": next(ids)}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def run_sequential(post, base_url, trades):
+    """Old notify_trade_event shape: one blocking post per channel."""
+    for i in range(trades):
+        for chat_id in CHANNELS.values():
+            post(f"{base_url}X/sendMessage", json={"chat_id": chat_id, "text": f"NEW_TRADE {i}", "parse_mode": "HTML"}, timeout=5)
+
+def report(name, elapsed, trades, stats, before):
+    conns = stats["connections"] - before["connections"]
+    reqs = stats["requests"] - before["requests"]
+    print(f"{name:<8} {elapsed * 1000:9.1f} ms total  {elapsed * 1000 / trades:7.1f} ms/trade  {reqs:4d} requests  {conns:4d} connections")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trades", type=int, default=20)
+    ap.add_argument("--handshake-ms", type=float, default=40)
+    ap.add_argument("--api-ms", type=float, default=60)
+    args = ap.parse_args()
+
+    server, stats = start_stand_in(args.handshake_ms, args.api_ms)
+    base_url = f"http://127.0.0.1:{server.server_port}/bot"
+    print(f"Stand-in: handshake {args.handshake_ms} ms, request {args.api_ms} ms, {len(CHANNELS)} channels, {args.trades} trades\n")
+
+    # 1. Legacy: fresh connection per message
+    before = dict(stats); t0 = time.perf_counter()
+    run_sequential(requests.post, base_url, args.trades)
+    report("legacy", time.perf_counter() - t0, args.trades, stats, before)
+
+    # 2. Pooled session, sequential channels
+    from managers.telegram_manager import TelegramManager
+    session = TelegramManager._build_session()
+    before = dict(stats); t0 = time.perf_counter()
+    run_sequential(session.post, base_url, args.trades)
+    report("pooled", time.perf_counter() - t0, args.trades, stats, before)
+
+    # 3. Outbox: pooled + parallel fan-out (rate limits lifted, the stand-in has none)
+    import smart_trader
+    from managers.telegram_manager import bot
+    smart_trader.get_telegram_symbol = lambda s: s
+    conf = dict(CHANNELS, enable_notifications=True, bot_token="X", templates={"NEW_TRADE": "NEW_TRADE {symbol}"})
+    bot._get_config = lambda: conf
+    bot.base_url = base_url
+    app = make_app()
+    bot.outbox.start(app, workers=8, chat_rate=1000, global_rate=1000)
+
+    before = dict(stats); t0 = time.perf_counter()
+    with app.app_context():
+        for i in range(args.trades):
+            futures = bot.notify_trade_event({"id": 10_000 + i, "symbol": f"BENCH{i}", "target_channels": ["main", "vip", "free", "z2h"]}, "NEW_TRADE")
+            ids = {key: f.result(30) for key, f in futures.items()}
+            assert len(ids) == len(CHANNELS) and all(ids.values()), ids
+    report("outbox", time.perf_counter() - t0, args.trades, stats, before)
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
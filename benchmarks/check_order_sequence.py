@@ -0,0 +1,98 @@
+"""
+Regression check: a trade's exit never reaches the broker before its own entry.
+
+Each LIVE trade is activated (submit_entry: BUY + protective SL-M) and, in the
+same drain, stopped out (submit_exit: cancel SL + Market SELL) and removed from
+the store, like a PENDING -> OPEN -> SL_HIT within one tick batch. Exits have a
+higher priority than entries, so without per-trade sequencing the SELL can be
+dequeued first. MockKiteConnect(latency=...) records every order call; per
+trade, order_log must show BUY, then the SL-M, then its cancel, then the SELL.
+
+Usage: python benchmarks/check_order_sequence.py [--trades 12] [--latency-ms 30] [--workers 4]
+"""
+import os
+import sys
+import argparse
+import itertools
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database import db
+from mock_broker import MockKiteConnect
+from managers.trade_store import store as trade_store
+from managers.order_dispatcher import dispatcher as order_dispatcher
+from managers.broker_ops import submit_entry, submit_exit
+
+class TracingKite(MockKiteConnect):
+    """MockKiteConnect that also records the order id each place_order returned."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._ids = itertools.count(1)
+
+    def place_order(self, **kwargs):
+        order_id = f"ORD_{next(self._ids)}"
+        self._order_call("place_order", dict(kwargs, returned_id=order_id))
+        return order_id
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'check.db')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def sequence_errors(order_log, symbol):
+    """Order calls of one trade, checked against BUY -> SL-M -> cancel SL -> SELL."""
+    calls = [(m, kw) for _, m, kw in order_log if kw.get('tradingsymbol') == symbol or m == 'cancel_order']
+    steps = []
+    sl_id = None
+    for method, kw in calls:
+        if method == 'place_order' and kw['transaction_type'] == 'BUY':
+            steps.append('BUY')
+        elif method == 'place_order' and kw['order_type'] == 'SL-M':
+            sl_id = kw['returned_id']
+            steps.append('SL')
+        elif method == 'place_order':
+            steps.append('SELL')
+        elif method == 'cancel_order' and sl_id and kw['order_id'] == sl_id:
+            steps.append('CANCEL')
+    return [] if steps == ['BUY', 'SL', 'CANCEL', 'SELL'] else [f"{symbol}: {' -> '.join(steps)}"]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trades", type=int, default=12)
+    ap.add_argument("--latency-ms", type=float, default=30)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+
+    app = make_app()
+    trade_store.start(app, 0.2)
+    order_dispatcher.start(app, workers=args.workers, rate=100)
+    kite = TracingKite(latency=args.latency_ms / 1000.0)
+
+    futures = []
+    with app.app_context():
+        for i in range(args.trades):
+            t = {'id': 900_000 + i, 'mode': 'LIVE', 'status': 'OPEN', 'symbol': f"SEQ{i}", 'exchange': 'NFO',
+                 'entry_price': 100.0, 'quantity': 50, 'sl': 95.0, 'sl_order_id': None, 'logs': []}
+            trade_store.upsert(t)
+            futures.append(submit_entry(kite, t))
+            # Stopped out in the same drain: exit queued while the entry is still pending
+            futures.append(submit_exit(kite, t, t['quantity'], cancel_sl=True, tag="RD_EXIT"))
+            trade_store.remove(t['id'])
+
+    for fut in futures:
+        fut.result(timeout=60)
+    trade_store.shutdown()
+
+    errors = [e for i in range(args.trades) for e in sequence_errors(kite.order_log, f"SEQ{i}")]
+    print(f"\n{args.trades} trades, {len(kite.order_log)} order calls, {len(errors)} out of sequence")
+    for e in errors:
+        print(f"  {e}")
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
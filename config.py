@@ -24,6 +24,62 @@ PORT = int(os.environ.get("PORT", 5000))
 # Trade Defaults
 DEFAULT_SL_POINTS = 20
 
+# Active Trade Store: seconds between background DB flushes of dirty trades
+TRADE_FLUSH_INTERVAL = float(os.getenv("TRADE_FLUSH_INTERVAL", 1.0))
+
+# Tick Queue: max distinct tokens buffered between the ticker and the risk worker
+TICK_QUEUE_MAX_TOKENS = int(os.getenv("TICK_QUEUE_MAX_TOKENS", 5000))
+
+# Order Dispatcher: broker worker threads and max order calls per second (Kite allows 10/s)
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", 4))
+ORDER_RATE_LIMIT = float(os.getenv("ORDER_RATE_LIMIT", 10))
+
+# Broker SL Sync: trailing SL changes per order are coalesced and sent at most once per window (seconds)
+SL_SYNC_WINDOW = float(os.getenv("SL_SYNC_WINDOW", 0.5))
+SL_SYNC_RETRIES = int(os.getenv("SL_SYNC_RETRIES", 3))
+
+# Settings Cache: seconds between checks for settings saved by another worker process
+SETTINGS_WATCH_INTERVAL = float(os.getenv("SETTINGS_WATCH_INTERVAL", 2))
+
+# Dashboard Delta Sync: trades remembered in the changelog (older clients get a full snapshot)
+SYNC_LOG_SIZE = int(os.getenv("SYNC_LOG_SIZE", 5000))
+
+# Socket.IO trade updates: max messages per second per dashboard client
+SOCKET_EMIT_HZ = float(os.getenv("SOCKET_EMIT_HZ", 4))
+
+# Price Cache: seconds a REST quote for an unsubscribed symbol stays fresh; symbols read by the
+# dashboard are subscribed on the ticker until idle for WATCH_IDLE seconds (at most WATCH_MAX)
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", 2))
+PRICE_WATCH_IDLE = float(os.getenv("PRICE_WATCH_IDLE", 600))
+PRICE_WATCH_MAX = int(os.getenv("PRICE_WATCH_MAX", 200))
+
+# Instrument Cache: the day's instrument list is kept here so a restart skips the download and
+# worker processes share one memory-mapped copy ("" = off)
+INSTRUMENT_CACHE_DIR = os.getenv("INSTRUMENT_CACHE_DIR", os.path.join(basedir, "instrument_cache"))
+
+# Instrument Refresh: daily pre-open time (IST, HH:MM) at which a list from an earlier trading day
+# is replaced in the background ("" = off; Kite publishes the new list around 08:30)
+INSTRUMENT_REFRESH_TIME = os.getenv("INSTRUMENT_REFRESH_TIME", "08:45")
+
+# Market Holidays: comma-separated YYYY-MM-DD dates with no new instrument list (weekends are
+# always skipped), so the refresh does not re-download the last trading day's list
+MARKET_HOLIDAYS = os.getenv("MARKET_HOLIDAYS", "")
+
+# Quote Batcher: concurrent quote requests within this window (ms) share one kite.quote call
+QUOTE_BATCH_WINDOW_MS = float(os.getenv("QUOTE_BATCH_WINDOW_MS", 5))
+QUOTE_BATCH_MAX = int(os.getenv("QUOTE_BATCH_MAX", 500))
+
+# Telegram Outbox: sender threads, per-chat / global messages per second, retries before giving up
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", 4))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 5))
+
+# HIGH_MADE coalescing: latest high per trade sent once per window (seconds, 0 = off);
+# channels with at least DIGEST_MIN trades in a window get one digest message
+TELEGRAM_HIGH_WINDOW = float(os.getenv("TELEGRAM_HIGH_WINDOW", 5))
+TELEGRAM_DIGEST_MIN = int(os.getenv("TELEGRAM_DIGEST_MIN", 3))
+
 # Database Config
 uri = os.getenv("DATABASE_URL", "sqlite:///" + os.path.join(basedir, "algo.db"))
 if uri.startswith("postgres://"):
@@ -1,13 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 
 db = SQLAlchemy()
 
 class AppSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column(db.Text, nullable=False) # Stores JSON string
+    version = db.Column(db.Integer, default=0) # Bumped on every save (cross-process cache invalidation)
 
 class ActiveTrade(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    # Primary key is the real trade id (timestamp based), not an auto-increment
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
     data = db.Column(db.Text, nullable=False) # Stores JSON string
 
 class TradeHistory(db.Model):
@@ -15,6 +18,23 @@ class TradeHistory(db.Model):
     id = db.Column(db.BigInteger, primary_key=True)
     data = db.Column(db.Text, nullable=False) # Stores JSON string
 
+    # Queryable copies of JSON fields (kept in sync by persistence.save_to_history_db)
+    mode = db.Column(db.String(10), index=True)
+    symbol = db.Column(db.String(60), index=True)
+    instrument_token = db.Column(db.BigInteger, index=True)
+    exit_date = db.Column(db.String(10), index=True) # YYYY-MM-DD (IST), from exit_time
+    status = db.Column(db.String(20), index=True)
+    pnl = db.Column(db.Float, index=True)
+
+    __table_args__ = (db.Index('ix_trade_history_exit_date_mode', 'exit_date', 'mode'),)
+
+class DailyPnl(db.Model):
+    # Materialized realized P&L per (exit date, mode), updated incrementally on close/delete
+    date = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD (IST)
+    mode = db.Column(db.String(10), primary_key=True) # "LIVE" or "PAPER"
+    realized = db.Column(db.Float, nullable=False, default=0.0)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+
 class RiskState(db.Model):
     # Stores persistent state for Profit Locking (High PnL, Global SL)
     id = db.Column(db.String(10), primary_key=True) # "LIVE" or "PAPER"
@@ -26,3 +46,40 @@ class TelegramMessage(db.Model):
     trade_id = db.Column(db.String(50), nullable=False, index=True)
     message_id = db.Column(db.Integer, nullable=False)
     chat_id = db.Column(db.String(50), nullable=False)
+
+# Telegram Outbox: messages queued for sending (rows are removed once delivered or given up)
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    trade_id = db.Column(db.String(50), index=True)      # Thread owner (None for system/report messages)
+    chat_id = db.Column(db.String(50), nullable=False)
+    channel = db.Column(db.String(10))                    # main / vip / free / z2h
+    kind = db.Column(db.String(10), nullable=False)       # PARENT / REPLY / LAZY / PLAIN
+    text = db.Column(db.Text, nullable=False)
+    alt_text = db.Column(db.Text)                         # LAZY: text used when it starts the thread
+    reply_to = db.Column(db.Integer)                      # PLAIN: explicit reply target
+    created_at = db.Column(db.Float, nullable=False)
+
+def migrate_schema():
+    """
+    Lightweight in-place migration (create_all does not alter existing tables).
+    Adds any model column missing from its table, then creates missing indexes.
+    Must run inside an app context, after db.create_all().
+    """
+    engine = db.engine
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c['name'] for c in insp.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in present]
+        if missing:
+            with engine.begin() as conn:
+                for col in missing:
+                    col_type = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+                    print(f"🔧 Schema Migration: Added {table.name}.{col.name}")
+
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
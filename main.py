@@ -1,21 +1,31 @@
 import os
+import copy
 import json
+import hashlib
 import threading
 import time
 import gc 
 import requests
-from flask import Flask, render_template, request, redirect, flash, jsonify, url_for
+from flask import Flask, Response, render_template, request, redirect, flash, jsonify, url_for
 from kiteconnect import KiteConnect
 from flask_socketio import SocketIO
 import config
 
 # --- REFACTORED IMPORTS ---
-from managers import persistence, trade_manager, risk_engine, replay_engine, common, broker_ops
+from managers import persistence, trade_manager, risk_engine, replay_engine, common, broker_ops, instrument_cache
 from managers.telegram_manager import bot as telegram_bot
+from managers.trade_store import store as trade_store
+from managers.tick_queue import tick_queue
+from managers.order_dispatcher import dispatcher as order_dispatcher
+from managers.sl_sync import sl_sync
+from managers.sync_log import sync_log, POSITIONS, CLOSED
+from managers.emit_scheduler import emitter
+from managers.price_cache import price_cache
+from managers.quote_batcher import quote_batcher
 # --------------------------
 import smart_trader
 import settings
-from database import db, AppSetting
+from database import db, AppSetting, migrate_schema
 import auto_login 
 
 app = Flask(__name__)
@@ -30,6 +40,25 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 db.init_app(app)
 with app.app_context():
     db.create_all()
+    migrate_schema()
+    persistence.migrate_active_trade_ids()
+    persistence.backfill_history_columns()
+    persistence.ensure_daily_pnl()
+
+# Active trades are served from memory; DB writes happen on a background writer
+trade_store.start(app, config.TRADE_FLUSH_INTERVAL)
+tick_queue.max_tokens = config.TICK_QUEUE_MAX_TOKENS
+sync_log.size = config.SYNC_LOG_SIZE
+price_cache.configure(config.PRICE_CACHE_TTL, config.PRICE_WATCH_IDLE, config.PRICE_WATCH_MAX)
+quote_batcher.configure(config.QUOTE_BATCH_WINDOW_MS / 1000.0, config.QUOTE_BATCH_MAX)
+smart_trader.instrument_cache_dir = config.INSTRUMENT_CACHE_DIR
+smart_trader.refresh_time = tuple(int(x) for x in config.INSTRUMENT_REFRESH_TIME.split(":")) if config.INSTRUMENT_REFRESH_TIME else None
+instrument_cache.holidays = frozenset(d.strip() for d in config.MARKET_HOLIDAYS.split(",") if d.strip())
+order_dispatcher.start(app, config.ORDER_WORKERS, config.ORDER_RATE_LIMIT)
+sl_sync.configure(config.SL_SYNC_WINDOW, config.SL_SYNC_RETRIES)
+settings.start_version_watch(app, config.SETTINGS_WATCH_INTERVAL)
+telegram_bot.outbox.start(app, config.TELEGRAM_WORKERS, config.TELEGRAM_CHAT_RATE, config.TELEGRAM_GLOBAL_RATE, config.TELEGRAM_MAX_RETRIES)
+telegram_bot.highs.start(app, config.TELEGRAM_HIGH_WINDOW, config.TELEGRAM_DIGEST_MIN)
 
 kite = KiteConnect(api_key=config.API_KEY)
 
@@ -153,12 +182,19 @@ def background_monitor():
                         # 2. Sync Subscriptions (Handles new manual trades)
                         risk_engine.update_subscriptions()
                         
-                        # 3. Run Global Checks (Time Exit / Profit Lock)
+                        # 3. Pre-Open Instrument Refresh (built in the background, swapped in atomically)
+                        if smart_trader.refresh_due():
+                            smart_trader.start_scheduled_refresh(kite)
+                        
+                        # 4. Run Global Checks (Time Exit / Profit Lock)
                         # These run independently of the price ticker
-                        current_settings = settings.load_settings()
+                        current_settings = settings.get_settings()
                         risk_engine.check_global_exit_conditions(kite, "PAPER", current_settings['modes']['PAPER'])
                         risk_engine.check_global_exit_conditions(kite, "LIVE", current_settings['modes']['LIVE'])
                         
+                        # 5. Closed trades whose history write failed are saved again
+                        broker_ops.retry_history_writes()
+                        
                     except Exception as e:
                         err = str(e)
                         if "Token is invalid" in err or "Network" in err or "No Access Token" in err or "access_token" in err:
@@ -269,8 +305,9 @@ def api_settings_load():
         today_str = datetime.now(IST).strftime("%Y-%m-%d")
         
         # Load Trades & History to count today's trades
+        # (a trade entered today can only have exited today, so today's exits suffice)
         trades = persistence.load_trades()
-        history = persistence.load_history()
+        history = persistence.load_history_for_day(today_str)
         
         count = 0
         # Check Active Trades
@@ -346,6 +383,10 @@ def api_manage_trade():
             return jsonify({"status": "success"})
     return jsonify({"status": "error", "message": "Action Failed"})
 
+@app.route('/api/engine_stats')
+def api_engine_stats():
+    return jsonify(risk_engine.get_engine_stats())
+
 @app.route('/api/indices')
 def api_indices():
     if not bot_active:
@@ -354,7 +395,7 @@ def api_indices():
 
 @app.route('/api/search')
 def api_search():
-    current_settings = settings.load_settings()
+    current_settings = settings.get_settings()
     allowed = current_settings.get('exchanges', None)
     return jsonify(smart_trader.search_symbols(kite, request.args.get('q', ''), allowed))
 
@@ -370,6 +411,14 @@ def api_chain():
 def api_s_ltp():
     return jsonify({"ltp": smart_trader.get_specific_ltp(kite, request.args.get('symbol'), request.args.get('expiry'), request.args.get('strike'), request.args.get('type'))})
 
+@app.route('/api/instruments/refresh', methods=['POST'])
+def api_instruments_refresh():
+    """Re-downloads the instrument list, bypassing the memory and disk caches."""
+    if not bot_active:
+        return jsonify({"status": "error", "message": "Bot not connected"})
+    inst = smart_trader.fetch_instruments(kite, force=True)
+    return jsonify({"status": "success", "count": 0 if inst is None else len(inst), "diff": smart_trader.last_refresh})
+
 @app.route('/api/panic_exit', methods=['POST'])
 def api_panic_exit():
     if not bot_active:
@@ -465,77 +514,32 @@ def api_import_trade():
             target_channels=target_channels
         )
         
-        # --- SEQUENTIAL TELEGRAM SENDER (UPDATED) ---
+        # --- SEQUENTIAL TELEGRAM SENDER (OUTBOX) ---
+        # Everything is queued in order on the trade's thread; the outbox sends the
+        # NEW_TRADE parent first and writes its IDs back to the trade for the replies.
         queue = result.get('notification_queue', [])
         trade_ref = result.get('trade_ref', {})
         
         if queue and trade_ref:
-            def send_seq_notifications():
-                # Wrap thread in app_context to access DB
-                with app.app_context():
-                    # 1. Send Initial "NEW_TRADE" message -> Returns Dict of IDs
-                    msg_ids = telegram_bot.notify_trade_event(trade_ref, "NEW_TRADE")
-                    
-                    if msg_ids:
-                        from managers.persistence import load_trades, save_trades, save_to_history_db
-                        
-                        trade_id = trade_ref['id']
-                        updated_ref = False
-                        
-                        # Handle Structure: If dict, save dict. If int (legacy), wrap it.
-                        if isinstance(msg_ids, dict):
-                            ids_dict = msg_ids
-                            main_id = msg_ids.get(selected_channel) or msg_ids.get('main')
-                        else:
-                            ids_dict = {'main': msg_ids}
-                            main_id = msg_ids
-                        
-                        # Try updating Active Trades
-                        trades = load_trades()
-                        for t in trades:
-                            # Robust comparison: Convert both to strings
-                            if str(t['id']) == str(trade_id):
-                                t['telegram_msg_ids'] = ids_dict
-                                t['telegram_msg_id'] = main_id # Legacy fallback
-                                save_trades(trades)
-                                updated_ref = True
-                                break
-                        
-                        # If not active (e.g., trade closed immediately), update History
-                        if not updated_ref:
-                            trade_ref['telegram_msg_ids'] = ids_dict
-                            trade_ref['telegram_msg_id'] = main_id
-                            save_to_history_db(trade_ref)
-                            
-                        # Update local ref so subsequent events know where to reply
-                        trade_ref['telegram_msg_ids'] = ids_dict
-                        trade_ref['telegram_msg_id'] = main_id
-                    
-                    # 2. Process the rest of the queue
-                    for item in queue:
-                        evt = item['event']
-                        if evt == 'NEW_TRADE': continue # Already sent
-                        
-                        # Small delay to ensure sequence order in Telegram
-                        time.sleep(1.0)
-                        
-                        dat = item.get('data')
-                        t_obj = item.get('trade', trade_ref).copy() 
-                        
-                        # --- CRITICAL FIX: INJECT ID IF MISSING ---
-                        # The replay engine often creates snapshot objects without IDs.
-                        if 'id' not in t_obj:
-                            t_obj['id'] = trade_ref['id']
-                        
-                        # Inject IDs so manager knows where to reply for all channels
-                        t_obj['telegram_msg_ids'] = trade_ref.get('telegram_msg_ids')
-                        t_obj['telegram_msg_id'] = trade_ref.get('telegram_msg_id')
-                        
-                        telegram_bot.notify_trade_event(t_obj, evt, dat)
-
-            # Start thread
-            t = threading.Thread(target=send_seq_notifications)
-            t.start()
+            telegram_bot.notify_trade_event(trade_ref, "NEW_TRADE")
+            
+            for item in queue:
+                evt = item['event']
+                if evt == 'NEW_TRADE': continue # Already queued
+                
+                dat = item.get('data')
+                t_obj = item.get('trade', trade_ref).copy() 
+                
+                # --- CRITICAL FIX: INJECT ID IF MISSING ---
+                # The replay engine often creates snapshot objects without IDs.
+                if 'id' not in t_obj:
+                    t_obj['id'] = trade_ref['id']
+                
+                # Inject IDs so manager knows where to reply for all channels
+                t_obj['telegram_msg_ids'] = trade_ref.get('telegram_msg_ids')
+                t_obj['telegram_msg_id'] = trade_ref.get('telegram_msg_id')
+                
+                telegram_bot.notify_trade_event(t_obj, evt, dat)
         
         return jsonify(result)
     except Exception as e:
@@ -552,8 +556,50 @@ def api_simulate_scenario():
     return jsonify(result)
 
 # --- Aggregated Sync Route for High Performance ---
+def _sync_position(t):
+    t['lot_size'] = smart_trader.get_lot_size(t['symbol'])
+    t['symbol'] = smart_trader.get_display_name(t['symbol'])
+    return t
+
+def _sync_closed(t):
+    t['symbol'] = smart_trader.get_display_name(t['symbol'])
+    return t
+
+def _sync_stream(stream, epoch, since, load_all, load_one, prepare):
+    """
+    One sync stream (positions / closed trades) for a client at revision `since`.
+    Returns {"mode": "full", "added": [...]} or {"mode": "delta", "added", "changed", "removed"}.
+    """
+    delta = sync_log.since(stream, epoch, since)
+    if delta is None:
+        return {"mode": "full", "added": [prepare(t) for t in load_all()], "changed": [], "removed": []}
+
+    added, changed, removed = delta
+    out = {"mode": "delta", "added": [], "changed": [], "removed": removed}
+    for key, ids in (("added", added), ("changed", changed)):
+        for tid in ids:
+            t = load_one(tid)
+            if t: out[key].append(prepare(t))
+    return out
+
+def _load_active_one(trade_id):
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        return copy.deepcopy(t) if t else None
+
 @app.route('/api/sync', methods=['POST'])
 def api_sync():
+    """
+    Dashboard poll. The client sends the sync `epoch`/`rev` it last applied
+    (`rev` for positions, `closed_rev` for closed trades) and gets back only
+    the trades added, changed or removed since then (full lists on first call,
+    after a restart, or when it fell too far behind).
+    A client already at the current revision whose prices have not moved gets a
+    304 (ETag / If-None-Match) before any trade is loaded.
+    """
+    req = request.json or {}
+    rev = sync_log.revision
+
     # 1. Base Data (Status & Indices)
     response = {
         "status": {
@@ -562,8 +608,9 @@ def api_sync():
             "login_url": kite.login_url()
         },
         "indices": {"NIFTY": 0, "BANKNIFTY": 0, "SENSEX": 0},
-        "positions": [],
-        "closed_trades": [],
+        "sync": {"epoch": sync_log.epoch, "rev": rev},
+        "positions": None,
+        "closed_trades": None,
         "specific_ltp": 0
     }
 
@@ -573,22 +620,8 @@ def api_sync():
             response["indices"] = smart_trader.get_indices_ltp(kite)
         except: pass
 
-    # 3. Active Positions
-    trades = persistence.load_trades()
-    for t in trades:
-        t['lot_size'] = smart_trader.get_lot_size(t['symbol'])
-        t['symbol'] = smart_trader.get_display_name(t['symbol'])
-    response["positions"] = trades
-
-    # 4. Closed Trades (Only if requested to save bandwidth)
-    if request.json.get('include_closed'):
-        history = persistence.load_history()
-        for t in history:
-            t['symbol'] = smart_trader.get_display_name(t['symbol'])
-        response["closed_trades"] = history
-
-    # 5. Specific LTP (For Trade Panel)
-    req_ltp = request.json.get('ltp_req')
+    # 3. Specific LTP (For Trade Panel)
+    req_ltp = req.get('ltp_req')
     if bot_active and req_ltp and req_ltp.get('symbol'):
         try:
             response["specific_ltp"] = smart_trader.get_specific_ltp(
@@ -600,7 +633,26 @@ def api_sync():
             )
         except: pass
 
-    return jsonify(response)
+    # 4. Client already at the current revision and no price moved -> 304,
+    # before any trade is loaded or serialized. The ETag covers everything
+    # the response depends on besides the trades (their revision stands in for them).
+    include_closed = bool(req.get('include_closed'))
+    state = [response["sync"], include_closed, response["status"], response["indices"], req_ltp, response["specific_ltp"]]
+    etag = hashlib.md5(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+    up_to_date = req.get('epoch') == sync_log.epoch and req.get('rev') == rev and (not include_closed or req.get('closed_rev') == rev)
+    if up_to_date and etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    # 5. Active Positions (changes since the client's revision)
+    response["positions"] = _sync_stream(POSITIONS, req.get('epoch'), req.get('rev'), persistence.load_trades, _load_active_one, _sync_position)
+
+    # 6. Closed Trades (Only if requested to save bandwidth)
+    if include_closed:
+        response["closed_trades"] = _sync_stream(CLOSED, req.get('epoch'), req.get('closed_rev'), persistence.load_history, persistence.get_history_trade, _sync_closed)
+
+    resp = jsonify(response)
+    resp.set_etag(etag)
+    return resp
 
 @app.route('/trade', methods=['POST'])
 def place_trade():
@@ -886,6 +938,21 @@ def close_trade(trade_id):
         flash("❌ Error")
     return redirect('/')
 
+# --- SOCKET.IO: Throttled trade patches (see managers/emit_scheduler.py) ---
+@socketio.on('connect')
+def socket_connect():
+    emitter.add_client(request.sid) # First message is a full snapshot
+
+@socketio.on('disconnect')
+def socket_disconnect(*args):
+    emitter.remove_client(request.sid)
+
+@socketio.on('resync')
+def socket_resync(*args):
+    emitter.request_snapshot(request.sid)
+
+emitter.start(socketio, _sync_position, config.SOCKET_EMIT_HZ)
+
 if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
     t = threading.Thread(target=background_monitor, daemon=True)
     t.start()
@@ -1,11 +1,19 @@
+import copy
 from managers.common import log_event, get_time_str
-from managers.persistence import load_trades, save_trades, save_to_history_db
+from managers.persistence import load_trades, save_trades, save_to_history_db, get_history_trade
+from managers.trade_store import store as trade_store
+from managers.order_dispatcher import dispatcher as order_dispatcher, PRIORITY_EXIT, PRIORITY_SL_MODIFY, PRIORITY_ENTRY
+from managers.sl_sync import sl_sync
 import smart_trader
 
-def place_order(kite, symbol, transaction_type, quantity, order_type="MARKET", product="MIS", price=0, trigger_price=0, exchange=None, tag="RD_ALGO"):
+def place_order(kite, symbol, transaction_type, quantity, order_type="MARKET", product="MIS", price=0, trigger_price=0, exchange=None, tag="RD_ALGO", priority=None):
     """
     Wrapper for placing orders with automatic exchange detection if missing.
+    Takes a token from the shared order rate limiter first (SELLs ahead of BUYs).
     """
+    if priority is None:
+        priority = PRIORITY_EXIT if transaction_type == kite.TRANSACTION_TYPE_SELL else PRIORITY_ENTRY
+    order_dispatcher.limiter.acquire(priority)
     try:
         # Determine exchange if not provided
         if not exchange:
@@ -28,7 +36,8 @@ def place_order(kite, symbol, transaction_type, quantity, order_type="MARKET", p
         print(f"❌ Order Placement Failed: {e}")
         raise e
 
-def modify_order(kite, order_id, quantity=None, price=None, trigger_price=None):
+def modify_order(kite, order_id, quantity=None, price=None, trigger_price=None, priority=PRIORITY_SL_MODIFY):
+    order_dispatcher.limiter.acquire(priority)
     try:
         kite.modify_order(
             variety=kite.VARIETY_REGULAR,
@@ -45,6 +54,8 @@ def modify_order(kite, order_id, quantity=None, price=None, trigger_price=None):
 def move_to_history(trade, final_status, exit_price):
     """
     Finalizes a trade, calculates PnL, logs the closure, and moves it to the history database.
+    Returns False if the history write did not commit: the caller must keep the trade
+    in the active set (retry_history_writes saves it later).
     """
     real_pnl = 0
     was_active = trade['status'] != 'PENDING'
@@ -66,7 +77,19 @@ def move_to_history(trade, final_status, exit_price):
     if "Closed:" not in str(trade.get('logs', [])):
          log_event(trade, f"Closed: {final_status} @ {exit_price} | P/L ₹ {real_pnl:.2f}")
     
-    save_to_history_db(trade)
+    return save_to_history_db(trade)
+
+def retry_history_writes():
+    """
+    Closed trades kept in the active set after a failed history write (they carry an
+    exit_type): saves them again and drops each from the active set once it commits.
+    """
+    with trade_store.lock:
+        pending = [copy.deepcopy(t) for t in trade_store.all() if t.get('exit_type')]
+    for t in pending:
+        if save_to_history_db(t):
+            trade_store.remove(t['id'])
+            print(f"🔧 History write retried: trade {t['id']} closed.")
 
 def manage_broker_sl(kite, trade, qty_to_remove=0, cancel_completely=False):
     """
@@ -81,6 +104,8 @@ def manage_broker_sl(kite, trade, qty_to_remove=0, cancel_completely=False):
     try:
         # Scenario 1: Cancel SL completely (Full Exit or Panic)
         if cancel_completely or qty_to_remove >= trade['quantity']:
+            sl_sync.discard(sl_id) # No trailing modify may follow the cancel
+            order_dispatcher.limiter.acquire(PRIORITY_EXIT)
             kite.cancel_order(variety=kite.VARIETY_REGULAR, order_id=sl_id)
             log_event(trade, f"Broker SL Cancelled (ID: {sl_id})")
             trade['sl_order_id'] = None 
@@ -89,6 +114,7 @@ def manage_broker_sl(kite, trade, qty_to_remove=0, cancel_completely=False):
         elif qty_to_remove > 0:
             new_qty = trade['quantity'] - qty_to_remove
             if new_qty > 0:
+                order_dispatcher.limiter.acquire(PRIORITY_EXIT)
                 kite.modify_order(
                     variety=kite.VARIETY_REGULAR,
                     order_id=sl_id,
@@ -99,6 +125,128 @@ def manage_broker_sl(kite, trade, qty_to_remove=0, cancel_completely=False):
     except Exception as e:
         log_event(trade, f"⚠️ Broker SL Update Failed: {e}")
 
+# --- Asynchronous Order Jobs (Order Dispatcher) ---
+
+def log_order_event(trade_id, message):
+    """
+    Appends a broker result to the trade's log, wherever the trade lives by now
+    (still active, or already moved to history by the risk engine).
+    """
+    try:
+        with trade_store.lock:
+            live = trade_store.get(trade_id)
+            if live:
+                log_event(live, message)
+                trade_store.mark_dirty(trade_id)
+                return
+        closed = get_history_trade(trade_id)
+        if closed:
+            log_event(closed, message)
+            save_to_history_db(closed)
+        else:
+            print(f"Order Event [{trade_id}]: {message}")
+    except Exception as e:
+        print(f"Order Event Log Error: {e}")
+
+# SL orders placed for trades that had already left the store (trade_id -> order id).
+# The trade's queued exit cancels it; if none comes, the orphan job does.
+_unclaimed_sl = {}
+
+def _order_snapshot(trade):
+    """Fields a broker job needs, copied so the job never races the tick loop."""
+    return {k: trade.get(k) for k in ('id', 'mode', 'symbol', 'exchange', 'quantity', 'sl', 'sl_order_id')}
+
+def _current_sl_id(trade_id):
+    """Broker SL of a trade as of now: the live trade's, else one its entry placed after it closed."""
+    with trade_store.lock:
+        live = trade_store.get(trade_id)
+        if live:
+            return live.get('sl_order_id')
+        return _unclaimed_sl.pop(trade_id, None)
+
+def _cancel_orphan_sl(kite, snap):
+    """Cancels the SL of an exited trade unless its exit already took care of it."""
+    with trade_store.lock:
+        snap['sl_order_id'] = _unclaimed_sl.pop(snap['id'], None)
+    manage_broker_sl(kite, snap, cancel_completely=True)
+
+def submit_exit(kite, trade, quantity, cancel_sl=False, sl_qty_to_remove=0, tag="RD_EXIT"):
+    """
+    Queues an EXIT job: cancel (or shrink) the broker SL, then Market SELL `quantity`.
+    Runs after the trade's earlier jobs (its entry), so the SL id is read when the job starts.
+    Returns a Future resolving to the exit order id.
+    """
+    snap = _order_snapshot(trade)
+    snap['logs'] = []
+
+    def job():
+        if cancel_sl or sl_qty_to_remove > 0:
+            snap['sl_order_id'] = _current_sl_id(snap['id']) or snap['sl_order_id']
+            manage_broker_sl(kite, snap, sl_qty_to_remove, cancel_completely=cancel_sl)
+        return place_order(
+            kite, symbol=snap['symbol'], exchange=snap['exchange'],
+            transaction_type=kite.TRANSACTION_TYPE_SELL, quantity=quantity,
+            order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS,
+            tag=tag, priority=PRIORITY_EXIT
+        )
+
+    def done(fut):
+        for line in snap['logs']:
+            log_order_event(snap['id'], line.split('] ', 1)[-1])
+        if fut.exception():
+            log_order_event(snap['id'], f"Broker Fail (Exit): {fut.exception()}")
+
+    fut = order_dispatcher.submit(PRIORITY_EXIT, job, label=f"{tag} {snap['symbol']} x{quantity}", key=snap['id'])
+    fut.add_done_callback(done)
+    return fut
+
+def submit_entry(kite, trade, tag="RD_ENTRY"):
+    """
+    Queues an ENTRY job: Market BUY, then the protective SL-M at trade['sl'].
+    The SL order id is written back onto the active trade when it arrives.
+    """
+    snap = _order_snapshot(trade)
+
+    def job():
+        place_order(
+            kite, symbol=snap['symbol'], exchange=snap['exchange'],
+            transaction_type=kite.TRANSACTION_TYPE_BUY, quantity=snap['quantity'],
+            order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS, tag=tag, priority=PRIORITY_ENTRY
+        )
+        return place_order(
+            kite, symbol=snap['symbol'], exchange=snap['exchange'],
+            transaction_type=kite.TRANSACTION_TYPE_SELL, quantity=snap['quantity'],
+            order_type=kite.ORDER_TYPE_SL_M, product=kite.PRODUCT_MIS,
+            trigger_price=snap['sl'], tag="RD_SL", priority=PRIORITY_ENTRY
+        )
+
+    def done(fut):
+        if fut.exception():
+            log_order_event(snap['id'], f"Broker Fail (Active): {fut.exception()}")
+            return
+        with trade_store.lock:
+            live = trade_store.get(snap['id'])
+            if live:
+                live['sl_order_id'] = fut.result()
+                live['broker_sl'] = snap['sl']
+                trade_store.mark_dirty(snap['id'])
+                # SL trailed while the entry was in flight: sync the broker order to it
+                if live['sl'] != snap['sl']:
+                    sl_sync.request(kite, live, live['sl'])
+            else:
+                _unclaimed_sl[snap['id']] = fut.result()
+        log_order_event(snap['id'], f"Broker SL Placed: ID {fut.result()}")
+
+        # Trade exited while the entry was in flight: don't leave the SL behind.
+        # Queued behind the trade's exit, which normally cancels it first.
+        if not live:
+            orphan = dict(snap, logs=[])
+            order_dispatcher.submit(PRIORITY_EXIT, _cancel_orphan_sl, kite, orphan, label=f"Orphan SL {fut.result()}", key=snap['id'])
+
+    fut = order_dispatcher.submit(PRIORITY_ENTRY, job, label=f"{tag} {snap['symbol']} x{snap['quantity']}", key=snap['id'])
+    fut.add_done_callback(done)
+    return fut
+
 def panic_exit_all(kite):
     """
     Emergency Function: Immediately closes all active positions.
@@ -107,41 +255,40 @@ def panic_exit_all(kite):
     3. Moves all trades to history with status 'PANIC_EXIT'.
     """
     try:
-        trades = load_trades()
+        trades = [t for t in load_trades() if not t.get('exit_type')] # exit_type: closed, history write pending
         if not trades: 
             return True
             
         print(f"🚨 PANIC MODE TRIGGERED: Closing {len(trades)} positions.")
         
+        # Queue every LIVE square-off at once (EXIT priority): the dispatcher
+        # cancels each protection SL before its exit order and runs them in parallel.
+        pending = []
         for t in trades:
-            # Handle LIVE trades on the broker side
             if t['mode'] == "LIVE" and t['status'] != 'PENDING':
-                # First, cancel the protection SL to avoid double execution
-                manage_broker_sl(kite, t, cancel_completely=True)
-                
-                # Then place the exit order
-                try: 
-                    place_order(
-                        kite,
-                        symbol=t['symbol'], 
-                        exchange=t['exchange'], 
-                        transaction_type=kite.TRANSACTION_TYPE_SELL, 
-                        quantity=t['quantity'], 
-                        order_type=kite.ORDER_TYPE_MARKET, 
-                        product=kite.PRODUCT_MIS,
-                        tag="PANIC_EXIT"
-                    )
-                except Exception as e: 
-                    print(f"Panic Broker Fail {t['symbol']}: {e}")
+                pending.append((t, submit_exit(kite, t, t['quantity'], cancel_sl=True, tag="PANIC_EXIT")))
+        
+        for t, fut in pending:
+            try: 
+                fut.result(timeout=30)
+            except Exception as e: 
+                print(f"Panic Broker Fail {t['symbol']}: {e}")
+        
+        unsaved = []
+        for t in trades:
+            # Pick up broker results the dispatcher logged onto the live trade
+            live = trade_store.get(t['id'])
+            if live: t['logs'] = list(live.get('logs', t.get('logs', [])))
             
             # Move to internal history
             # Use current_ltp if available, else fallback to entry
             exit_p = t.get('current_ltp', t['entry_price'])
-            move_to_history(t, "PANIC_EXIT", exit_p)
+            if not move_to_history(t, "PANIC_EXIT", exit_p):
+                unsaved.append(t) # Stays active until its history row commits
         
-        # Clear active trades list
-        save_trades([])
-        return True
+        # Clear active trades list (closed trades awaiting their history write stay)
+        save_trades(unsaved + [t for t in load_trades() if t.get('exit_type')])
+        return not unsaved
     except Exception as e:
         print(f"Panic Exit Error: {e}")
         return False
@@ -0,0 +1,211 @@
+import copy
+import time
+import threading
+from managers.sync_log import sync_log, POSITIONS
+from managers.trade_store import store as trade_store
+
+# Fields sent as patches; anything else changing (e.g. a new log line) sends the whole trade
+PATCH_FIELDS = ('current_ltp', 'sl', 'status', 'quantity', 'highest_ltp', 'made_high', 'targets_hit_indices', 'broker_sl')
+CLOSED_FIELDS = ('current_ltp', 'made_high', 'virtual_sl_hit')
+
+class _Client:
+    __slots__ = ('sid', 'seq', 'inflight', 'sent_at', 'snapshot', 'patches', 'upserts', 'removed', 'closed')
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.seq = 0
+        self.inflight = False
+        self.sent_at = 0.0
+        self.snapshot = True     # first message is always a snapshot
+        self.patches = {}        # id -> {field: value}
+        self.upserts = {}        # id -> full trade
+        self.removed = set()
+        self.closed = {}         # id -> {field: value}
+
+class EmitScheduler:
+    """
+    Pushes active-trade changes to dashboards over Socket.IO.
+    - Changes come from the sync log (every trade store write), so the tick path
+      does no serialisation; closed-trade LTPs are handed in via mark_closed().
+    - Every 1/hz seconds the changes are turned into field-level patches
+      ({id, current_ltp, sl, status, ...}); new or structurally changed trades
+      are sent whole, removed trades by id.
+    - Each client has at most one message in flight (Socket.IO ack). Changes for
+      a slow client are merged, so it only ever receives the latest values.
+    - Messages carry a per-client `seq`; a client that sees a gap asks for a
+      resync. Snapshots go out on connect, on resync, or when a client falls
+      too far behind (too many pending trades or an ack timeout).
+    """
+    def __init__(self, hz=4.0, max_pending=500, ack_timeout=10.0):
+        self.hz = hz
+        self.max_pending = max_pending
+        self.ack_timeout = ack_timeout
+        self._lock = threading.Lock()
+        self._clients = {}       # sid -> _Client
+        self._closed = {}        # id -> latest closed-trade fields since last flush
+        self._last = {}          # id -> (patch field values, log count) last broadcast
+        self._rev = 0
+        self._socketio = None
+        self._prepare = None
+        self._thread = None
+        self.counters = {"flushes": 0, "messages": 0, "snapshots": 0, "patches": 0, "skipped_busy": 0}
+
+    def start(self, socketio, prepare=None, hz=None):
+        """prepare(trade) -> trade: display formatting applied to full trades (copies)."""
+        self._socketio = socketio
+        self._prepare = prepare or (lambda t: t)
+        if hz: self.hz = hz
+        if self._thread is None:
+            self._rev = sync_log.revision
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # --- Clients (Socket.IO handlers) ---
+    def add_client(self, sid):
+        with self._lock:
+            self._clients[sid] = _Client(sid)
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def request_snapshot(self, sid):
+        with self._lock:
+            c = self._clients.get(sid)
+            if c is None:
+                c = self._clients[sid] = _Client(sid)
+            c.snapshot = True
+            c.inflight = False
+
+    # --- Producers ---
+    def mark_closed(self, trades):
+        """Live LTP of virtually tracked closed trades (not persisted every tick)."""
+        with self._lock:
+            for t in trades:
+                self._closed[t['id']] = {k: t.get(k) for k in CLOSED_FIELDS}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, clients=len(self._clients), hz=self.hz)
+
+    # --- Internal ---
+    def _run(self):
+        while True:
+            time.sleep(1.0 / self.hz)
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Emit Scheduler Error: {e}")
+
+    def _collect(self):
+        """Changes since the last flush: (patches, upserts, removed) or None if too old."""
+        rev = sync_log.revision
+        delta = sync_log.since(POSITIONS, sync_log.epoch, self._rev)
+        self._rev = rev
+        if delta is None:
+            return None
+        added, changed, removed = delta
+        patches, upserts = {}, {}
+        with trade_store.lock:
+            for tid in added + changed:
+                t = trade_store.get(tid)
+                if t is None: continue
+                fields = tuple(t.get(k) for k in PATCH_FIELDS)
+                n_logs = len(t.get('logs') or ())
+                prev = self._last.get(tid)
+                if prev is None or prev[1] != n_logs or tid in added:
+                    upserts[tid] = copy.deepcopy(t)
+                elif prev[0] != fields:
+                    patch = {k: v for k, v, old in zip(PATCH_FIELDS, fields, prev[0]) if v != old}
+                    patch['id'] = tid
+                    patches[tid] = copy.deepcopy(patch)
+                self._last[tid] = (fields, n_logs)
+        for tid in removed:
+            self._last.pop(tid, None)
+        return patches, {tid: self._prepare(t) for tid, t in upserts.items()}, removed
+
+    def _flush(self):
+        if self._socketio is None:
+            return
+        with self._lock:
+            has_clients = bool(self._clients)
+            closed, self._closed = self._closed, {}
+        if sync_log.revision == self._rev and not closed and not any(c.snapshot for c in self._clients.values()):
+            return
+
+        changes = self._collect()
+        if not has_clients:
+            return
+        self.counters["flushes"] += 1
+
+        now = time.time()
+        sends = []
+        with self._lock:
+            for c in self._clients.values():
+                # Merge into the client's pending set (latest value wins)
+                if changes is None:
+                    c.snapshot = True
+                elif not c.snapshot:
+                    patches, upserts, removed = changes
+                    for tid, p in patches.items():
+                        if tid in c.upserts:
+                            c.upserts[tid].update(p)
+                        else:
+                            c.patches.setdefault(tid, {}).update(p)
+                    for tid, t in upserts.items():
+                        c.upserts[tid] = dict(t) # Own copy: later patches merge into it
+                        c.patches.pop(tid, None)
+                        c.removed.discard(tid)
+                    for tid in removed:
+                        c.upserts.pop(tid, None)
+                        c.patches.pop(tid, None)
+                        c.removed.add(tid)
+                for tid, fields in closed.items():
+                    c.closed.setdefault(tid, {}).update(fields)
+
+                if c.inflight and now - c.sent_at > self.ack_timeout:
+                    c.inflight = False
+                    c.snapshot = True   # Lost ack: its view may be stale
+                if c.inflight:
+                    self.counters["skipped_busy"] += 1
+                    continue
+                if len(c.patches) + len(c.upserts) + len(c.removed) > self.max_pending:
+                    c.snapshot = True
+                if not (c.snapshot or c.patches or c.upserts or c.removed or c.closed):
+                    continue
+
+                c.seq += 1
+                msg = {"seq": c.seq, "closed": [dict(f, id=tid) for tid, f in c.closed.items()]}
+                if c.snapshot:
+                    msg["snapshot"] = True
+                else:
+                    msg.update(patches=list(c.patches.values()), upserts=list(c.upserts.values()), removed=list(c.removed))
+                sends.append((c.sid, "trade_snapshot" if c.snapshot else "trade_patch", msg))
+                c.snapshot = False
+                c.patches, c.upserts, c.removed, c.closed = {}, {}, set(), {}
+                c.inflight = True
+                c.sent_at = now
+
+        snapshot = None
+        for sid, event, msg in sends:
+            if event == "trade_snapshot":
+                if snapshot is None:
+                    snapshot = [self._prepare(t) for t in trade_store.snapshot()]
+                    self.counters["snapshots"] += 1
+                msg["trades"] = snapshot
+            else:
+                self.counters["patches"] += 1
+            self.counters["messages"] += 1
+            try:
+                self._socketio.emit(event, msg, to=sid, callback=lambda *a, sid=sid: self._on_ack(sid))
+            except Exception as e:
+                print(f"Socket Emit Error: {e}")
+                self.request_snapshot(sid)
+
+    def _on_ack(self, sid):
+        with self._lock:
+            c = self._clients.get(sid)
+            if c: c.inflight = False
+
+# Singleton Instance
+emitter = EmitScheduler()
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import shutil
+import pytz
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from managers.instrument_index import InstrumentIndex
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Kite publishes the day's instrument list in the morning: before this (IST)
+# the previous day's list is still the current one
+LIST_PUBLISH_TIME = (8, 30)
+
+# Exchange holidays (YYYY-MM-DD, set from config). No list is published on these
+# or at weekends: the last trading day's list stays current
+holidays = frozenset()
+
+FORMAT_VERSION = 4
+INDEX_DIR = "index"
+META_FILE = "meta.json"
+
+def trading_day(now=None):
+    """Date of the instrument list Kite is serving right now (YYYY-MM-DD)."""
+    now = now or datetime.now(IST)
+    day = (now - timedelta(hours=LIST_PUBLISH_TIME[0], minutes=LIST_PUBLISH_TIME[1])).date()
+    while day.weekday() >= 5 or day.isoformat() in holidays:
+        day -= timedelta(days=1)
+    return day.isoformat()
+
+def _save_array(path, values):
+    if values.dtype == object:
+        values = values.astype(str) # Fixed-width unicode: no pickle, mmap-able
+    np.save(path, values, allow_pickle=False)
+
+def _load_array(path):
+    values = np.load(path, mmap_mode='r', allow_pickle=False)
+    if values.dtype.kind == 'U':
+        # Interned: the frame and the index share one object per tradingsymbol
+        return np.array([sys.intern(v) for v in values.tolist()], dtype=object)
+    return values
+
+def save(cache_dir, day, df, index):
+    """
+    Writes the compact instrument frame as one .npy file per column (categoricals as
+    their codes, categories in the meta file), plus the lookup index arrays.
+    Written to a temp dir and renamed into place, so a crash never leaves a half cache;
+    caches of other days are removed.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        final = os.path.join(cache_dir, day)
+        tmp = final + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        columns, categories = [], {}
+        for col in df.columns:
+            values = df[col].array
+            if isinstance(values, pd.Categorical):
+                categories[col] = [str(c) for c in values.categories]
+                values = values.codes
+            _save_array(os.path.join(tmp, f"{col}.npy"), np.asarray(values))
+            columns.append(col)
+
+        os.makedirs(os.path.join(tmp, INDEX_DIR))
+        for name, values in index.arrays().items():
+            _save_array(os.path.join(tmp, INDEX_DIR, f"{name}.npy"), np.asarray(values))
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump({"version": FORMAT_VERSION, "day": day, "rows": len(df), "columns": columns, "categories": categories,
+                       "saved_at": datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S')}, f)
+
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        for name in os.listdir(cache_dir):
+            if name != day:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        print(f"💾 Instrument cache saved for {day} ({len(df)} rows).")
+    except Exception as e:
+        print(f"⚠️ Instrument Cache Save Error: {e}")
+
+def load(cache_dir, day):
+    """Returns (df, InstrumentIndex) for `day`, or None if there is no usable cache."""
+    path = os.path.join(cache_dir, day)
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION or meta.get("day") != day:
+            return None
+
+        # Memory-mapped and read-only: numeric columns and category codes are used in place,
+        # so every worker process loading the same day shares one copy (the OS page cache)
+        data = {}
+        for col in meta["columns"]:
+            values = _load_array(os.path.join(path, f"{col}.npy"))
+            if col in meta["categories"]:
+                values = pd.Categorical.from_codes(values, categories=meta["categories"][col], validate=False)
+            data[col] = values
+        df = pd.DataFrame(data, copy=False)
+
+        index = InstrumentIndex({name: _load_array(os.path.join(path, INDEX_DIR, f"{name}.npy")) for name in InstrumentIndex.ARRAYS})
+
+        if len(df) != meta["rows"]:
+            return None
+        return df, index
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Instrument Cache Load Error: {e}")
+        return None
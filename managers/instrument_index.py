@@ -0,0 +1,424 @@
+import sys
+import mmap
+import numpy as np
+import pandas as pd
+from bisect import bisect_left
+from difflib import get_close_matches
+from datetime import date
+
+# Duplicate tradingsymbols resolve to the first exchange here: NFO > MCX > CDS > NSE > BSE > BFO
+EXCHANGE_PRIORITY = {'NFO': 0, 'MCX': 1, 'CDS': 2, 'NSE': 3, 'BSE': 4, 'BFO': 5}
+
+NO_EXPIRY = -1
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Criteria key bit layout: name | expiry day | type | strike in paise
+_STRIKE_BITS, _TYPE_BITS, _DAY_BITS = 28, 4, 16
+
+# The columns of kite.instruments() the app reads (exchange_token, last_price,
+# tick_size and segment are dropped), with their compact dtypes
+CATEGORY_COLUMNS = ('name', 'exchange', 'instrument_type', 'expiry_str')
+NUMERIC_COLUMNS = {'instrument_token': np.uint32, 'strike': np.float32, 'lot_size': np.int32}
+EXPIRY_DTYPE = 'datetime64[s]'
+
+def compact_instruments(instruments):
+    """
+    kite.instruments() -> the lean instrument frame kept in memory.
+    - name / exchange / instrument_type / expiry_str are categoricals (small integer codes)
+    - token uint32, strike float32, lot_size int32, expiry datetime64 (NaT if none)
+    - tradingsymbols are interned, so the index arrays share the same string objects
+    Dates are parsed once per distinct expiry, not per row.
+    """
+    raw = pd.DataFrame(instruments)
+    data = {'tradingsymbol': np.array([sys.intern(str(s)) for s in raw['tradingsymbol'].tolist()], dtype=object)}
+    for col, dtype in NUMERIC_COLUMNS.items():
+        data[col] = pd.to_numeric(raw[col], errors='coerce').fillna(0).to_numpy(dtype=dtype)
+    for col in ('name', 'exchange', 'instrument_type'):
+        data[col] = pd.Categorical(raw[col])
+
+    if 'expiry' in raw.columns:
+        codes, uniques = pd.factorize(raw['expiry'], use_na_sentinel=True)
+        days = pd.to_datetime(pd.Series(uniques, dtype=object), errors='coerce')
+        # Code -1 (no expiry) picks the trailing NaT / NaN
+        data['expiry'] = np.append(days.to_numpy(dtype=EXPIRY_DTYPE), np.datetime64('NaT'))[codes]
+        data['expiry_str'] = pd.Categorical(np.append(days.dt.strftime('%Y-%m-%d').to_numpy(dtype=object), np.nan)[codes])
+    return pd.DataFrame(data, copy=False)
+
+def frame_memory(df):
+    """Bytes held by the frame (deep), and how many are file-backed (mmap: shared between processes)."""
+    total = mapped = 0
+    for col in df.columns:
+        values = df[col].array
+        values = values.codes if isinstance(values, pd.Categorical) else np.asarray(values)
+        total += int(df[col].memory_usage(deep=True, index=False))
+        if _is_mapped(values):
+            mapped += values.nbytes
+    return {"rows": len(df), "bytes": total, "mapped_bytes": mapped}
+
+def _is_mapped(values):
+    while values is not None:
+        if isinstance(values, (np.memmap, mmap.mmap)):
+            return True
+        values = getattr(values, 'base', None)
+    return False
+
+def _strikes(values):
+    """Strikes as float64, rounded back to their listed precision (float32 storage: 101.05 -> 101.05000305)."""
+    return np.round(pd.to_numeric(values, errors='coerce').fillna(0.0).to_numpy(dtype=np.float64), 4)
+
+class InstrumentIndex:
+    """
+    Compact lookup tables over the instrument list, one row per unique tradingsymbol.
+
+    - Columns are NumPy arrays sharing one row number; names, exchanges and
+      instrument types are stored as integer codes into small string tables.
+    - tradingsymbol -> row is a plain dict of ints (no dict per instrument).
+    - (name, expiry, type, strike) is packed into one int64 key; the sorted keys
+      are kept as arrays (cache) and as a plain int -> tradingsymbol dict (lookups).
+    - Every listing (including a symbol's other exchanges) is kept in the all_*
+      arrays: "EXCH:SYMBOL" -> token and token -> listing are plain dicts.
+    Everything is built with column operations, no per-row Python loop.
+    """
+    ARRAYS = ('symbols', 'name_codes', 'exch_codes', 'type_codes', 'strikes', 'lot_sizes',
+              'expiry_days', 'tokens', 'names', 'exchanges', 'types', 'crit_keys', 'crit_rows',
+              'all_symbols', 'all_exch_codes', 'all_tokens', 'all_rows')
+
+    def __init__(self, arrays):
+        for k in self.ARRAYS:
+            setattr(self, k, arrays[k])
+        self._row_of = dict(zip(self.symbols.tolist(), range(len(self.symbols))))
+        exchanges = self.exchanges.tolist()
+        keys = [f"{exchanges[e]}:{s}" for e, s in zip(self.all_exch_codes.tolist(), self.all_symbols.tolist())]
+        tokens = self.all_tokens.tolist()
+        self._token_of = dict(zip(reversed(keys), reversed(tokens))) # First listing wins, like the old mask
+        self._listing_of = dict(zip(tokens, range(len(tokens))))
+        self._name_code = {n: i for i, n in enumerate(self.names.tolist())}
+        self._type_code = {t: i for i, t in enumerate(self.types.tolist())}
+        self._crit_symbol = dict(zip(self.crit_keys.tolist(), self.symbols[self.crit_rows].tolist()))
+        days = np.unique(self.expiry_days[self.expiry_days >= 0]).tolist()
+        self._day_of = {date.fromordinal(EPOCH_ORDINAL + d).isoformat(): d for d in days}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def arrays(self):
+        return {k: getattr(self, k) for k in self.ARRAYS}
+
+    # --- Build ---
+    @classmethod
+    def build(cls, df):
+        """Builds the index from the instrument frame (same rules as the old symbol/criteria maps)."""
+        # 1. Best exchange per tradingsymbol (stable sort keeps the dump order within a priority)
+        priority = df['exchange'].map(EXCHANGE_PRIORITY).fillna(99).to_numpy()
+        order = np.argsort(priority, kind='stable')
+        symbols_sorted = df['tradingsymbol'].to_numpy()[order]
+        _, first = np.unique(symbols_sorted, return_index=True)
+        rows = order[np.sort(first)] # Frame positions, in priority order
+        u = df.iloc[rows]
+
+        # Every listing -> its row above (same tradingsymbol, best exchange)
+        all_exch_codes, exchanges = pd.factorize(df['exchange'])
+        exch_codes = all_exch_codes[rows]
+        row_of_symbol = np.empty(len(first), dtype=np.int32)
+        row_of_symbol[np.argsort(first, kind='stable')] = np.arange(len(first), dtype=np.int32) # unique-sorted -> row
+        _, inverse = np.unique(df['tradingsymbol'].to_numpy(), return_inverse=True)
+        all_rows = row_of_symbol[inverse]
+
+        name_codes, names = pd.factorize(u['name'], use_na_sentinel=True)
+        type_codes, types = pd.factorize(u['instrument_type'], use_na_sentinel=True)
+
+        if 'expiry' in u.columns:
+            exp = pd.to_datetime(u['expiry'], errors='coerce').to_numpy(dtype='datetime64[D]')
+            expiry_days = np.where(np.isnat(exp), NO_EXPIRY, exp.astype(np.int64)).astype(np.int32)
+        else:
+            expiry_days = np.full(len(u), NO_EXPIRY, dtype=np.int32)
+
+        strikes = _strikes(u['strike'])
+        lot_sizes = pd.to_numeric(u['lot_size'], errors='coerce').fillna(1).to_numpy(dtype=np.int32)
+        tokens = pd.to_numeric(u['instrument_token'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+
+        # 2. Criteria keys for rows with a name, expiry and type (options / futures)
+        valid = (name_codes >= 0) & (type_codes >= 0) & (expiry_days >= 0)
+        keys = cls._pack(name_codes, expiry_days, type_codes, strikes)
+        valid &= keys >= 0
+        crit_rows = np.flatnonzero(valid)
+        crit_keys = keys[crit_rows]
+        # Stable sort: among equal keys the LAST row wins, as it did in the dict
+        o = np.argsort(crit_keys, kind='stable')
+        crit_keys, crit_rows = crit_keys[o], crit_rows[o]
+        last = np.ones(len(crit_keys), dtype=bool)
+        last[:-1] = crit_keys[1:] != crit_keys[:-1]
+        crit_keys, crit_rows = crit_keys[last], crit_rows[last].astype(np.int32)
+
+        return cls({
+            'symbols': u['tradingsymbol'].to_numpy(dtype=object),
+            'name_codes': name_codes.astype(np.int32), 'exch_codes': exch_codes.astype(np.int8),
+            'type_codes': type_codes.astype(np.int8), 'strikes': strikes, 'lot_sizes': lot_sizes,
+            'expiry_days': expiry_days, 'tokens': tokens,
+            'names': np.asarray(names, dtype=object), 'exchanges': np.asarray(exchanges, dtype=object),
+            'types': np.asarray(types, dtype=object), 'crit_keys': crit_keys, 'crit_rows': crit_rows,
+            'all_symbols': df['tradingsymbol'].to_numpy(dtype=object), 'all_exch_codes': all_exch_codes.astype(np.int8),
+            'all_tokens': pd.to_numeric(df['instrument_token'], errors='coerce').fillna(0).to_numpy(dtype=np.int64),
+            'all_rows': all_rows,
+        })
+
+    @staticmethod
+    def _pack(name_codes, expiry_days, type_codes, strikes):
+        """int64 criteria keys; -1 where a field does not fit its bits."""
+        paise = np.rint(np.asarray(strikes, dtype=np.float64) * 100).astype(np.int64)
+        name_codes = np.asarray(name_codes, dtype=np.int64)
+        expiry_days = np.asarray(expiry_days, dtype=np.int64)
+        type_codes = np.asarray(type_codes, dtype=np.int64)
+        keys = (((name_codes << _DAY_BITS | expiry_days) << _TYPE_BITS | type_codes) << _STRIKE_BITS) | paise
+        fits = ((paise >= 0) & (paise < 1 << _STRIKE_BITS) & (expiry_days < 1 << _DAY_BITS)
+                & (type_codes < 1 << _TYPE_BITS) & (name_codes < 1 << (63 - _STRIKE_BITS - _TYPE_BITS - _DAY_BITS)))
+        return np.where(fits, keys, -1)
+
+    # --- Lookups ---
+    def row(self, tradingsymbol):
+        return self._row_of.get(tradingsymbol)
+
+    def exchange(self, row):
+        return self.exchanges[self.exch_codes[row]]
+
+    def lot_size(self, row):
+        return int(self.lot_sizes[row])
+
+    def token(self, row):
+        return int(self.tokens[row])
+
+    def listing_keys(self):
+        """Every listing as "EXCH:SYMBOL" (a set-like view)."""
+        return self._token_of.keys()
+
+    def token_of(self, tradingsymbol, exchange):
+        """Instrument token of one listing, or None."""
+        return self._token_of.get(f"{exchange}:{tradingsymbol}")
+
+    def instrument(self, token):
+        """Listing for a tick's token: symbol/exchange/token of the listing itself, the
+        descriptive fields (name, type, strike, expiry, lot) of its tradingsymbol's row."""
+        i = self._listing_of.get(token)
+        if i is None:
+            return None
+        row = int(self.all_rows[i])
+        nc, tc, day = self.name_codes[row], self.type_codes[row], int(self.expiry_days[row])
+        return {
+            "instrument_token": token,
+            "tradingsymbol": self.all_symbols[i],
+            "exchange": self.exchanges[self.all_exch_codes[i]],
+            "name": self.names[nc] if nc >= 0 else None,
+            "instrument_type": self.types[tc] if tc >= 0 else None,
+            "strike": float(self.strikes[row]),
+            "expiry": date.fromordinal(EPOCH_ORDINAL + day).isoformat() if day != NO_EXPIRY else None,
+            "lot_size": int(self.lot_sizes[row]),
+        }
+
+    def find(self, name, expiry_str, inst_type, strike):
+        """Tradingsymbol for (name, 'YYYY-MM-DD', type, strike) or None."""
+        nc, tc, day = self._name_code.get(name), self._type_code.get(inst_type), self._day_of.get(expiry_str)
+        if nc is None or tc is None or day is None:
+            return None
+        try:
+            paise = round((float(strike) if strike else 0.0) * 100)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= paise < 1 << _STRIKE_BITS:
+            return None
+        return self._crit_symbol.get((((nc << _DAY_BITS | day) << _TYPE_BITS | tc) << _STRIKE_BITS) | paise)
+
+    def display_name(self, row):
+        nc, tc = self.name_codes[row], self.type_codes[row]
+        name = self.names[nc] if nc >= 0 else float('nan')
+        inst_type = self.types[tc] if tc >= 0 else float('nan')
+        day = int(self.expiry_days[row])
+        expiry_str = date.fromordinal(EPOCH_ORDINAL + day).strftime('%d %b').upper() if day != NO_EXPIRY else ""
+
+        if inst_type in ["CE", "PE"]:
+            return f"{name} {int(self.strikes[row])} {inst_type} {expiry_str}"
+        elif inst_type == "FUT":
+            return f"{name} FUT {expiry_str}"
+        return f"{name} {inst_type}"
+
+class NameSearchIndex:
+    """
+    Symbol search over unique (name, exchange) pairs, partitioned by exchange.
+
+    - Each exchange keeps its names sorted; a prefix query is a bisect plus a
+      short forward scan, so a keystroke costs microseconds, not a frame scan.
+    - Each pair carries the tradingsymbol of its first row in the dump (the
+      one whose LTP is shown next to the result).
+    - No prefix match: substring matches, then close (fuzzy) matches.
+    """
+    def __init__(self, df):
+        pairs = df[['name', 'exchange', 'tradingsymbol']].dropna(subset=['name', 'exchange'])
+        pairs = pairs[pairs['name'] != ''].drop_duplicates(subset=['name', 'exchange'])
+        pairs = pairs.sort_values('name', kind='stable')
+        self._by_exchange = {}   # exchange -> (sorted names, tradingsymbols)
+        for exchange, group in pairs.groupby('exchange', sort=False):
+            self._by_exchange[exchange] = (group['name'].tolist(), group['tradingsymbol'].tolist())
+        self._names = sorted(set(pairs['name'].tolist()))
+
+    def search(self, keyword, exchanges, limit=10):
+        """[(name, exchange, tradingsymbol)] ordered by name, at most `limit`."""
+        k = keyword.upper()
+        exchanges = [e for e in exchanges if e in self._by_exchange]
+        hits = []
+        for exchange in exchanges:
+            names, symbols = self._by_exchange[exchange]
+            i = bisect_left(names, k)
+            end = min(len(names), i + limit)
+            while i < end and names[i].startswith(k):
+                hits.append((names[i], exchange, symbols[i]))
+                i += 1
+        if not hits:
+            return self._fallback(k, exchanges, limit)
+        order = {e: n for n, e in enumerate(exchanges)}
+        hits.sort(key=lambda h: (h[0], order[h[1]]))
+        return hits[:limit]
+
+    def _fallback(self, k, exchanges, limit):
+        """Substring matches (by name), else close matches (best first)."""
+        candidates = [n for n in self._names if k in n]
+        if not candidates:
+            candidates = get_close_matches(k, self._names, n=limit, cutoff=0.6)
+        hits = []
+        for name in candidates:
+            for exchange in exchanges:
+                names, symbols = self._by_exchange[exchange]
+                i = bisect_left(names, name)
+                if i < len(names) and names[i] == name:
+                    hits.append((name, exchange, symbols[i]))
+            if len(hits) >= limit:
+                break
+        return hits[:limit]
+
+class Chain:
+    """One option chain (underlying, expiry, CE/PE): strike-sorted parallel arrays."""
+    __slots__ = ('strikes', 'symbols', 'tokens', 'lot_sizes', 'strike_list')
+
+    def __init__(self, strikes, symbols, tokens, lot_sizes):
+        self.strikes = strikes
+        self.symbols = symbols
+        self.tokens = tokens
+        self.lot_sizes = lot_sizes
+        self.strike_list = strikes.tolist() # Python floats, shared by every chain response
+
+    def atm_index(self, ltp):
+        """Position of the strike nearest to ltp (the lower one on a tie)."""
+        i = bisect_left(self.strike_list, ltp)
+        if i == 0: return 0
+        if i == len(self.strike_list): return i - 1
+        return i - 1 if ltp - self.strike_list[i - 1] <= self.strike_list[i] - ltp else i
+
+class Underlying:
+    """Per-name summary for the trade panel: exchanges, sorted expiries, futures."""
+    __slots__ = ('exchanges', 'fut_expiries', 'opt_expiries', 'futures', 'fut_lots')
+
+    def __init__(self):
+        self.exchanges = []      # exchanges listing the name, in dump order
+        self.fut_expiries = []   # sorted 'YYYY-MM-DD'
+        self.opt_expiries = []
+        self.futures = {}        # exchange -> (sorted expiries, tradingsymbols)
+        self.fut_lots = {}       # exchange -> lot size of its first future in the dump
+
+class ChainIndex:
+    """
+    Option chains and underlying summaries, precomputed from the instrument list.
+
+    - (name, expiry, CE/PE) -> Chain with sorted strikes, so the ATM strike is a bisect.
+    - name -> Underlying with pre-sorted expiries; 'YYYY-MM-DD' strings sort like
+      dates, so "expiries from today" is a bisect too.
+    Built with one sort of the frame and a pass over group boundaries.
+    """
+    def __init__(self, df):
+        self._chains = {}
+        self._underlyings = {}
+        if df is None or df.empty or 'expiry_str' not in df.columns:
+            return
+
+        named = df[df['name'].notna() & (df['name'] != '')]
+        for name, exchange in named[['name', 'exchange']].drop_duplicates().itertuples(index=False):
+            self._get(name).exchanges.append(exchange)
+
+        # Options: first row per strike (dump order), sorted by (name, expiry, type, strike)
+        opts = named[named['instrument_type'].isin(['CE', 'PE']) & named['expiry_str'].notna()]
+        opts = opts.drop_duplicates(subset=['name', 'expiry_str', 'instrument_type', 'strike'])
+        opts = opts.sort_values(['name', 'expiry_str', 'instrument_type', 'strike'], kind='stable')
+        names = opts['name'].to_numpy(dtype=object)
+        expiries = opts['expiry_str'].to_numpy(dtype=object)
+        types = opts['instrument_type'].to_numpy(dtype=object)
+        strikes = _strikes(opts['strike'])
+        symbols = opts['tradingsymbol'].to_numpy(dtype=object)
+        tokens = pd.to_numeric(opts['instrument_token'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        lots = pd.to_numeric(opts['lot_size'], errors='coerce').fillna(1).to_numpy(dtype=np.int32)
+        if len(opts):
+            change = (names[1:] != names[:-1]) | (expiries[1:] != expiries[:-1]) | (types[1:] != types[:-1])
+            bounds = np.concatenate(([0], np.flatnonzero(change) + 1, [len(opts)]))
+            for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                key = (names[start], expiries[start], types[start])
+                self._chains[key] = Chain(strikes[start:end], symbols[start:end], tokens[start:end], lots[start:end])
+            for name, group in opts[['name', 'expiry_str']].drop_duplicates().groupby('name', sort=False):
+                self._get(name).opt_expiries = sorted(group['expiry_str'].tolist())
+
+        # Futures: sorted expiries per name and per (name, exchange)
+        futs = named[(named['instrument_type'] == 'FUT') & named['expiry_str'].notna()]
+        for (name, exchange), group in futs.groupby(['name', 'exchange'], sort=False):
+            u = self._get(name)
+            u.fut_lots[exchange] = int(group['lot_size'].iloc[0])
+            group = group.sort_values('expiry_str', kind='stable')
+            u.futures[exchange] = (group['expiry_str'].tolist(), group['tradingsymbol'].tolist())
+        for name, group in futs[['name', 'expiry_str']].drop_duplicates().groupby('name', sort=False):
+            self._get(name).fut_expiries = sorted(group['expiry_str'].tolist())
+
+    def _get(self, name):
+        u = self._underlyings.get(name)
+        if u is None:
+            u = self._underlyings[name] = Underlying()
+        return u
+
+    def underlying(self, name):
+        return self._underlyings.get(name)
+
+    def chain(self, name, expiry_str, option_type):
+        return self._chains.get((name, expiry_str, option_type))
+
+    @staticmethod
+    def from_date(sorted_expiries, day_str):
+        """The expiries on or after day_str ('YYYY-MM-DD')."""
+        return sorted_expiries[bisect_left(sorted_expiries, day_str):]
+
+class InstrumentSet:
+    """
+    One trading day's instrument list with every lookup structure built over it.
+
+    Never modified after it is built: a refresh builds a whole new set off to
+    the side and publishes it with one reference assignment, so a reader that
+    picked up a set keeps a consistent view (dump, index, search, chains) and
+    never waits on the rebuild.
+    """
+    __slots__ = ('day', 'dump', 'index', 'search', 'chain')
+
+    def __init__(self, day, dump, index=None):
+        self.day = day
+        self.dump = dump
+        self.index = index if index is not None else InstrumentIndex.build(dump)
+        self.search = NameSearchIndex(dump)
+        self.chain = ChainIndex(dump)
+
+    def __len__(self):
+        return len(self.dump)
+
+    def diff(self, old, sample=10):
+        """Listings ("EXCH:SYMBOL") added and expired since `old`, and tradingsymbols whose lot size changed."""
+        new_keys, old_keys = self.index.listing_keys(), old.index.listing_keys()
+        added, expired = sorted(new_keys - old_keys), sorted(old_keys - new_keys)
+        _, i_old, i_new = np.intersect1d(old.index.symbols, self.index.symbols, assume_unique=True, return_indices=True)
+        changed = np.flatnonzero(old.index.lot_sizes[i_old] != self.index.lot_sizes[i_new])
+        lot_changes = [f"{self.index.symbols[i_new[i]]} {old.index.lot_sizes[i_old[i]]}->{self.index.lot_sizes[i_new[i]]}"
+                       for i in changed[:sample]]
+        return {
+            "from": old.day, "to": self.day, "count": len(self),
+            "added": len(added), "expired": len(expired), "lot_changed": len(changed),
+            "samples": {"added": added[:sample], "expired": expired[:sample], "lot_changed": lot_changes},
+        }
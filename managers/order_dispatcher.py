@@ -0,0 +1,154 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+# Priorities (lower runs first)
+PRIORITY_EXIT = 0
+PRIORITY_SL_MODIFY = 1
+PRIORITY_ENTRY = 2
+
+PRIORITY_NAMES = {PRIORITY_EXIT: "EXIT", PRIORITY_SL_MODIFY: "SL_MODIFY", PRIORITY_ENTRY: "ENTRY"}
+
+class RateLimiter:
+    """
+    Token bucket shared by every broker order call (sync or dispatched).
+    Waiters are served by priority, so a queued exit gets the next token
+    before an entry that has been waiting longer.
+    Kite counts requests per rolling second, so the default burst is 1
+    (calls are spaced 1/rate apart); a burst of N allows up to N + rate per second.
+    """
+    def __init__(self, rate=10.0, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []   # heap of (priority, seq)
+        self._seq = itertools.count()
+        self.throttled = 0   # acquisitions that had to wait
+
+    def configure(self, rate, burst=None):
+        with self._cond:
+            self.rate = float(rate)
+            if burst is not None: self.burst = max(1, int(burst))
+            self._tokens = min(self._tokens, float(self.burst))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self, priority=PRIORITY_ENTRY):
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiting, me)
+            waited = False
+            while True:
+                self._refill()
+                if self._waiting[0] == me and self._tokens >= 1:
+                    heapq.heappop(self._waiting)
+                    self._tokens -= 1
+                    if waited: self.throttled += 1
+                    self._cond.notify_all()
+                    return
+                waited = True
+                self._cond.wait(max(0.001, (1 - self._tokens) / self.rate))
+
+class OrderDispatcher:
+    """
+    Worker pool for broker calls. Jobs are picked by priority
+    (EXIT > SL_MODIFY > ENTRY) and each submit returns a Future,
+    so the risk engine never waits on the broker.
+    Jobs submitted with the same `key` (a trade id) run one at a time in
+    submit order: a trade's exit never overtakes or runs beside its entry.
+    Rate limiting happens inside the broker_ops wrappers via `limiter`.
+    """
+    def __init__(self, workers=4, rate=10.0):
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self._cond = threading.Condition()
+        self._queue = []     # heap of (priority, seq, future, fn, args, kwargs, label, key)
+        self._lanes = {}     # key -> deque of jobs waiting behind that key's queued / running job
+        self._seq = itertools.count()
+        self._threads = []
+        self._app = None
+        self.stats_counters = {"submitted": 0, "completed": 0, "failed": 0, "max_depth": 0}
+
+    def start(self, app=None, workers=None, rate=None):
+        if app is not None: self._app = app
+        if rate: self.limiter.configure(rate)
+        if workers: self.workers = workers
+        with self._cond:
+            while len(self._threads) < self.workers:
+                th = threading.Thread(target=self._run, daemon=True)
+                th.start()
+                self._threads.append(th)
+
+    def submit(self, priority, fn, *args, label="", key=None, **kwargs):
+        """Queues fn(*args, **kwargs). Returns a concurrent.futures.Future."""
+        if not self._threads:
+            self.start()
+        fut = Future()
+        with self._cond:
+            job = (priority, next(self._seq), fut, fn, args, kwargs, label, key)
+            self.stats_counters["submitted"] += 1
+            if key is not None and key in self._lanes:
+                self._lanes[key].append(job) # Waits for the key's earlier job
+                return fut
+            if key is not None:
+                self._lanes[key] = deque()
+            heapq.heappush(self._queue, job)
+            if len(self._queue) > self.stats_counters["max_depth"]:
+                self.stats_counters["max_depth"] = len(self._queue)
+            self._cond.notify()
+        return fut
+
+    def _release(self, key):
+        """A keyed job finished: its lane's next job (if any) becomes runnable."""
+        with self._cond:
+            lane = self._lanes.get(key)
+            if lane:
+                heapq.heappush(self._queue, lane.popleft())
+                self._cond.notify()
+            else:
+                self._lanes.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                priority, _, fut, fn, args, kwargs, label, key = heapq.heappop(self._queue)
+
+            try:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                # Done-callbacks run in this thread, inside the same app context
+                with (self._app.app_context() if self._app else nullcontext()):
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        print(f"❌ Order Job Failed [{PRIORITY_NAMES.get(priority, priority)}] {label}: {e}")
+                        with self._cond: self.stats_counters["failed"] += 1
+                        fut.set_exception(e)
+                    else:
+                        with self._cond: self.stats_counters["completed"] += 1
+                        fut.set_result(result)
+            finally:
+                if key is not None:
+                    self._release(key)
+
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for item in itertools.chain(self._queue, *self._lanes.values()):
+                depth[PRIORITY_NAMES.get(item[0], str(item[0]))] += 1
+        return dict(self.stats_counters, depth=depth, workers=len(self._threads),
+                    rate=self.limiter.rate, throttled=self.limiter.throttled)
+
+# Singleton Instance
+dispatcher = OrderDispatcher()
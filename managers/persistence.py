@@ -1,8 +1,16 @@
 import json
-from database import db, ActiveTrade, TradeHistory, RiskState, TelegramMessage
+from database import db, ActiveTrade, TradeHistory, DailyPnl, RiskState, TelegramMessage
 from datetime import datetime, timedelta
 import time
 import threading
+import pytz
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from managers.trade_store import store as trade_store
+from managers.position_book import book as position_book
+from managers.sync_log import sync_log, CLOSED
+
+IST = pytz.timezone('Asia/Kolkata')
 
 # Threading lock to prevent Database Race Conditions
 db_lock = threading.RLock()
@@ -31,45 +39,126 @@ def save_risk_state(mode, state):
         db.session.rollback()
 
 # --- Active Trades Persistence ---
+# Active trades live in the in-memory TradeStore; these functions keep the
+# old call signatures and route through it. DB writes happen in write_active_rows.
+
 def load_trades():
     """
-    Loads all currently active trades from the database.
-    INCLUDES DEBUG LOGGING AND SESSION RESET.
+    Returns a snapshot (deep copy) of all currently active trades.
+    Served from memory; the DB is only read once when the store hydrates.
+    """
+    trade_store.ensure_loaded()
+    return trade_store.snapshot()
+
+def save_trades(trades):
+    """
+    Replaces the active trade set with the provided list.
+    """
+    trade_store.ensure_loaded()
+    trade_store.replace_all(trades)
+
+def save_trade(trade):
+    """
+    Inserts or updates a single active trade, keyed by its trade id.
+    New trades are written through to the DB immediately.
+    """
+    trade_store.ensure_loaded()
+    trade_store.upsert(trade)
+
+def delete_active_trade(trade_id):
+    """
+    Removes a single trade from the active set.
+    """
+    trade_store.ensure_loaded()
+    trade_store.remove(trade_id)
+
+def save_trades_bulk(changed, deleted_ids=None):
+    """
+    Marks only the changed trades dirty and removes the given ids.
+    The background writer persists them together on its next flush.
+    """
+    trade_store.ensure_loaded()
+    for t in changed:
+        trade_store.upsert(t)
+    for tid in (deleted_ids or []):
+        trade_store.remove(tid)
+
+def write_active_rows(rows, deleted_ids=None):
     """
+    DB-level write used by the TradeStore flusher.
+    rows: list of (trade_id, json_string). Upserts rows and deletes ids in ONE transaction.
+    """
+    if not rows and not deleted_ids:
+        return True
     with db_lock:
         try:
-            # [DEBUG] Reset session to force fresh read
-            db.session.remove() 
-            
-            raw_rows = ActiveTrade.query.all()
-            trades = [json.loads(r.data) for r in raw_rows]
-            
-            return trades
+            for tid, data in rows:
+                db.session.merge(ActiveTrade(id=int(tid), data=data))
+            if deleted_ids:
+                ids = [int(x) for x in deleted_ids]
+                db.session.query(ActiveTrade).filter(ActiveTrade.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            return True
         except Exception as e:
-            print(f"[DEBUG] Load Trades Error: {e}")
-            return []
+            print(f"[DEBUG] Save Trades Error: {e}")
+            db.session.rollback()
+            return False
 
-def save_trades(trades):
+def migrate_active_trade_ids():
     """
-    Overwrites the ActiveTrade table with the provided list of trades.
+    One-time fix for rows written by the old delete/re-insert logic,
+    where ActiveTrade.id was an auto-increment instead of the trade id.
     """
     with db_lock:
         try:
-            # [DEBUG LOG] - Optional: You can comment this out too if needed
-            # ids = [t.get('id') for t in trades]
-            # modes = [t.get('mode') for t in trades]
-            # print(f"[DEBUG] DB SAVE: Saving {len(trades)} trades. IDs: {ids} | Modes: {modes}")
-
-            db.session.query(ActiveTrade).delete()
-            for t in trades: 
-                db.session.add(ActiveTrade(data=json.dumps(t)))
+            rows = ActiveTrade.query.all()
+            stale = []
+            for r in rows:
+                trade = json.loads(r.data)
+                if int(trade['id']) != r.id:
+                    stale.append((r, trade))
+            if not stale:
+                return
+            for r, _ in stale:
+                db.session.delete(r)
+            db.session.flush()
+            for _, trade in stale:
+                db.session.merge(ActiveTrade(id=int(trade['id']), data=json.dumps(trade)))
             db.session.commit()
-            # print(f"[DEBUG] DB SAVE: Commit Successful.")
+            print(f"🔧 Migrated {len(stale)} active trade rows to trade-id keys.")
         except Exception as e:
-            print(f"[DEBUG] Save Trades Error: {e}")
+            print(f"Active Trade Migration Error: {e}")
             db.session.rollback()
 
 # --- Trade History Persistence ---
+def _today_str():
+    return datetime.now(IST).strftime("%Y-%m-%d")
+
+def _history_columns(trade):
+    """
+    Extracts the indexed TradeHistory columns from a trade dict.
+    """
+    token = trade.get('instrument_token')
+    try: token = int(token) if token else None
+    except (TypeError, ValueError): token = None
+
+    exit_time = trade.get('exit_time') or ''
+    pnl = trade.get('pnl')
+    try: pnl = float(pnl) if pnl is not None else 0.0
+    except (TypeError, ValueError): pnl = 0.0
+
+    return {
+        'mode': trade.get('mode'),
+        'symbol': trade.get('symbol'),
+        'instrument_token': token,
+        'exit_date': exit_time[:10] if exit_time else None,
+        'status': trade.get('status'),
+        'pnl': pnl,
+    }
+
+def _history_row(trade):
+    return TradeHistory(id=int(trade['id']), data=json.dumps(trade), **_history_columns(trade))
+
 def load_history():
     try:
         db.session.commit() # Ensure fresh
@@ -78,25 +167,200 @@ def load_history():
         print(f"Load History Error: {e}")
         return []
 
+def load_history_for_day(day_str=None, mode=None):
+    """
+    Closed trades for one exit date (default: today, IST), optionally for one mode.
+    Uses the (exit_date, mode) index instead of scanning every JSON blob.
+    """
+    try:
+        db.session.commit() # Ensure fresh
+        q = TradeHistory.query.filter(TradeHistory.exit_date == (day_str or _today_str()))
+        if mode:
+            q = q.filter(TradeHistory.mode == mode)
+        return [json.loads(r.data) for r in q.order_by(TradeHistory.id.desc()).all()]
+    except Exception as e:
+        print(f"Load History (Day) Error: {e}")
+        return []
+
+def load_todays_closed(mode=None):
+    """Today's closed trades, optionally for a single mode (LIVE/PAPER)."""
+    return load_history_for_day(None, mode)
+
+def get_history_trade(trade_id):
+    """Single closed trade by id, or None."""
+    try:
+        row = db.session.get(TradeHistory, int(trade_id))
+        return json.loads(row.data) if row else None
+    except Exception as e:
+        print(f"Get History Trade Error: {e}")
+        return None
+
+def load_history_since_id(min_id):
+    """Closed trades with id >= min_id (ids are creation timestamps)."""
+    try:
+        rows = TradeHistory.query.filter(TradeHistory.id >= int(min_id)).all()
+        return [json.loads(r.data) for r in rows]
+    except Exception as e:
+        print(f"Load History (Since) Error: {e}")
+        return []
+
+def get_max_history_id():
+    try:
+        return db.session.query(db.func.max(TradeHistory.id)).scalar() or 0
+    except Exception as e:
+        print(f"Max History ID Error: {e}")
+        return 0
+
+def get_closed_tokens(day_str=None):
+    """Distinct instrument tokens of trades closed on the given day (default: today)."""
+    try:
+        rows = db.session.query(TradeHistory.instrument_token).filter(
+            TradeHistory.exit_date == (day_str or _today_str()),
+            TradeHistory.instrument_token.isnot(None)
+        ).distinct().all()
+        return [int(tok) for (tok,) in rows]
+    except Exception as e:
+        print(f"Closed Tokens Error: {e}")
+        return []
+
 def delete_trade(trade_id):
     from managers.telegram_manager import bot as telegram_bot
     try:
         telegram_bot.delete_trade_messages(trade_id)
-        TradeHistory.query.filter_by(id=int(trade_id)).delete()
+        row = db.session.get(TradeHistory, int(trade_id))
+        if row:
+            _apply_ledger_delta(row.exit_date, row.mode, -(row.pnl or 0.0), -1)
+            db.session.delete(row)
         db.session.commit()
+        position_book.untrack_closed(trade_id)
+        if row: sync_log.record(CLOSED, trade_id, removed=True)
         return True
     except Exception as e:
         print(f"Delete Trade Error: {e}")
         db.session.rollback()
         return False
 
-def save_to_history_db(trade_data):
+def save_to_history_db(trade_data, commit=True):
+    """
+    Upserts a closed trade, keeping the indexed columns in sync with the JSON blob.
+    The DailyPnl ledger is adjusted by the difference to the previous row (if any),
+    so re-saving a trade never double counts.
+    Pass commit=False to batch several writes and commit once.
+    Returns False if the write failed (and was rolled back).
+    """
     try:
-        db.session.merge(TradeHistory(id=trade_data['id'], data=json.dumps(trade_data)))
-        db.session.commit()
+        new_row = _history_row(trade_data)
+        old_row = db.session.get(TradeHistory, new_row.id)
+        if old_row is None:
+            _apply_ledger_delta(new_row.exit_date, new_row.mode, new_row.pnl, 1)
+        elif (old_row.exit_date, old_row.mode, old_row.pnl) != (new_row.exit_date, new_row.mode, new_row.pnl):
+            _apply_ledger_delta(old_row.exit_date, old_row.mode, -(old_row.pnl or 0.0), -1)
+            _apply_ledger_delta(new_row.exit_date, new_row.mode, new_row.pnl, 1)
+
+        db.session.merge(new_row)
+        # Published to the dashboard sync log once the row is committed (see _publish_closed)
+        db.session.info.setdefault('sync_closed', []).append((new_row.id, old_row is None))
+        if commit:
+            db.session.commit()
+        position_book.track_closed(trade_data)
+        return True
     except Exception as e:
         print(f"Save History DB Error: {e}")
         db.session.rollback()
+        return False
+
+@event.listens_for(Session, "after_commit")
+def _publish_closed(session):
+    for trade_id, added in session.info.pop('sync_closed', ()):
+        sync_log.record(CLOSED, trade_id, added=added)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_closed(session):
+    session.info.pop('sync_closed', None)
+
+# --- Daily P&L Ledger ---
+def _apply_ledger_delta(day_str, mode, pnl_delta, count_delta):
+    """
+    Adds to the (date, mode) ledger row inside the current transaction.
+    One INSERT ... ON CONFLICT DO UPDATE, so concurrent closes (risk worker, monitor,
+    routes, outbox callbacks) never overwrite each other or race on the first insert.
+    """
+    if not day_str or not mode:
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(DailyPnl).values(date=day_str, mode=mode, realized=float(pnl_delta or 0.0), trade_count=count_delta)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyPnl.date, DailyPnl.mode],
+        set_={'realized': DailyPnl.realized + stmt.excluded.realized,
+              'trade_count': DailyPnl.trade_count + stmt.excluded.trade_count}
+    ))
+
+def get_realized_pnl(mode, day_str=None):
+    """Realized P&L for a mode on a day (default: today). Single-row read."""
+    try:
+        # Column query, not session.get: the ledger is updated with Core upserts
+        realized = db.session.query(DailyPnl.realized).filter_by(date=day_str or _today_str(), mode=mode).scalar()
+        return float(realized) if realized is not None else 0.0
+    except Exception as e:
+        print(f"Ledger Read Error: {e}")
+        return 0.0
+
+def rebuild_daily_pnl():
+    """
+    Migration / repair: recomputes the whole ledger from TradeHistory.
+    """
+    try:
+        totals = db.session.query(
+            TradeHistory.exit_date, TradeHistory.mode,
+            db.func.sum(TradeHistory.pnl), db.func.count(TradeHistory.id)
+        ).filter(TradeHistory.exit_date.isnot(None)).group_by(TradeHistory.exit_date, TradeHistory.mode).all()
+
+        DailyPnl.query.delete()
+        for day_str, mode, pnl, count in totals:
+            db.session.add(DailyPnl(date=day_str, mode=mode, realized=float(pnl or 0.0), trade_count=int(count)))
+        db.session.commit()
+        print(f"🔧 Daily P&L Ledger rebuilt: {len(totals)} rows.")
+    except Exception as e:
+        print(f"Ledger Rebuild Error: {e}")
+        db.session.rollback()
+
+def ensure_daily_pnl():
+    """Builds the ledger on first run (empty ledger but existing history)."""
+    try:
+        if DailyPnl.query.first() is None and TradeHistory.query.first() is not None:
+            rebuild_daily_pnl()
+    except Exception as e:
+        print(f"Ledger Check Error: {e}")
+
+def backfill_history_columns(batch_size=500):
+    """
+    Migration: fills the indexed columns for rows written before they existed.
+    """
+    try:
+        total = 0
+        while True:
+            rows = TradeHistory.query.filter(TradeHistory.mode.is_(None)).limit(batch_size).all()
+            if not rows:
+                break
+            for r in rows:
+                try:
+                    cols = _history_columns(json.loads(r.data))
+                except Exception:
+                    cols = {'mode': 'UNKNOWN'}
+                # Never leave mode NULL, or the batch would be selected forever
+                cols['mode'] = cols.get('mode') or 'UNKNOWN'
+                for k, v in cols.items():
+                    setattr(r, k, v)
+            db.session.commit()
+            total += len(rows)
+        if total:
+            print(f"🔧 History Migration: Backfilled indexed columns for {total} rows.")
+    except Exception as e:
+        print(f"History Backfill Error: {e}")
+        db.session.rollback()
 
 def cleanup_old_data(days=7):
     """
@@ -116,8 +380,13 @@ def cleanup_old_data(days=7):
         # 2. Delete from TradeHistory
         deleted_count = TradeHistory.query.filter(TradeHistory.id < threshold_id).delete()
         
+        # 3. Drop ledger days older than the retention window
+        threshold_day = datetime.fromtimestamp(threshold_id, IST).strftime("%Y-%m-%d")
+        DailyPnl.query.filter(DailyPnl.date < threshold_day).delete()
+        
         db.session.commit()
         if deleted_count > 0:
+            sync_log.invalidate()
             print(f"🧹 Database Cleanup: Removed {deleted_count} records older than {days} days.")
         return True
     except Exception as e:
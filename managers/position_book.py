@@ -0,0 +1,161 @@
+import copy
+import threading
+from datetime import datetime
+import pytz
+from managers.trigger_index import TriggerIndex, ACTIVE, CLOSED
+
+IST = pytz.timezone('Asia/Kolkata')
+
+def _token_of(trade):
+    token = trade.get('instrument_token')
+    try: return int(token) if token else None
+    except (TypeError, ValueError): return None
+
+class PositionBook:
+    """
+    Token-indexed view of every trade the tick handler watches:
+    - active: live references owned by the trade store (maintained by its writes)
+    - closed: today's closed trades, tracked for Virtual SL / High Made
+
+    Lets on_ticks touch only the trades whose tokens are in the tick batch,
+    and (via the trigger index) only those whose price band the tick left.
+    Lock order: trade_store.lock -> book.lock (never the other way round).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._active = {}         # token -> {trade_id: trade}
+        self._active_token = {}   # trade_id -> token
+        self._closed = {}         # token -> {trade_id: trade}
+        self._closed_token = {}   # trade_id -> token
+        self._closed_day = None   # IST date the closed side was loaded for
+        self.triggers = TriggerIndex()
+
+    # --- Active Trades (called by the trade store, with its lock held) ---
+    def add_active(self, trade):
+        tid = int(trade['id'])
+        with self.lock:
+            self._drop(self._active, self._active_token, tid)
+            token = _token_of(trade)
+            if token:
+                self._active.setdefault(token, {})[tid] = trade
+                self._active_token[tid] = token
+                self.triggers.refresh((ACTIVE, tid), token, trade)
+            else:
+                self.triggers.remove((ACTIVE, tid))
+
+    def refresh_active(self, trade):
+        """Re-bands a trade after in-place changes (no-op unless SL/targets/status moved)."""
+        tid = int(trade['id'])
+        with self.lock:
+            token = self._active_token.get(tid)
+            if token:
+                self.triggers.refresh((ACTIVE, tid), token, trade)
+
+    def remove_active(self, trade_id):
+        with self.lock:
+            self._drop(self._active, self._active_token, int(trade_id))
+            self.triggers.remove((ACTIVE, int(trade_id)))
+
+    def reset_active(self, trades):
+        with self.lock:
+            self._active = {}
+            self._active_token = {}
+            self.triggers.clear(ACTIVE)
+            for t in trades:
+                self.add_active(t)
+
+    def active_for(self, token):
+        """Active trades on a token (live references, hold trade_store.lock)."""
+        return list(self._active.get(token, {}).values())
+
+    # --- Today's Closed Trades ---
+    def ensure_day(self):
+        """
+        Loads today's closed trades once per IST day (requires app context).
+        Rolls the closed side over automatically after midnight.
+        """
+        today = datetime.now(IST).strftime("%Y-%m-%d")
+        if self._closed_day == today:
+            return
+        from managers.persistence import load_todays_closed
+
+        with self.lock:
+            if self._closed_day == today:
+                return
+            self._closed = {}
+            self._closed_token = {}
+            self.triggers.clear(CLOSED)
+            for t in load_todays_closed():
+                self._index_closed(t)
+            self._closed_day = today
+
+    def track_closed(self, trade):
+        """Called after a history write. Only trades that exited today are tracked."""
+        if not self._closed_day or not str(trade.get('exit_time') or '').startswith(self._closed_day):
+            self.untrack_closed(trade['id'])
+            return
+        with self.lock:
+            token = _token_of(trade)
+            if token and self._closed.get(token, {}).get(int(trade['id'])) is trade:
+                # The tracked dict itself was updated in place (Virtual SL / High Made)
+                self.triggers.refresh((CLOSED, int(trade['id'])), token, trade)
+                return
+            self._index_closed(copy.deepcopy(trade))
+
+    def untrack_closed(self, trade_id):
+        with self.lock:
+            self._drop(self._closed, self._closed_token, int(trade_id))
+            self.triggers.remove((CLOSED, int(trade_id)))
+
+    def closed_for(self, token):
+        with self.lock:
+            return list(self._closed.get(token, {}).values())
+
+    # --- Price Triggers ---
+    def candidates(self, token, ltp):
+        """Keys (('A'|'C', trade_id)) on this token whose thresholds the price crossed."""
+        with self.lock:
+            return self.triggers.candidates(token, ltp)
+
+    # --- Tokens ---
+    def has(self, token):
+        return token in self._active or token in self._closed
+
+    def tokens(self):
+        with self.lock:
+            return list(set(self._active.keys()) | set(self._closed.keys()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active_trades": len(self._active_token),
+                "closed_trades": len(self._closed_token),
+                "tokens": len(set(self._active.keys()) | set(self._closed.keys())),
+                "trigger_bands": len(self.triggers)
+            }
+
+    # --- Internal ---
+    def _index_closed(self, trade):
+        tid = int(trade['id'])
+        self._drop(self._closed, self._closed_token, tid)
+        token = _token_of(trade)
+        if token:
+            self._closed.setdefault(token, {})[tid] = trade
+            self._closed_token[tid] = token
+            self.triggers.refresh((CLOSED, tid), token, trade)
+        else:
+            self.triggers.remove((CLOSED, tid))
+
+    @staticmethod
+    def _drop(index, reverse, tid):
+        token = reverse.pop(tid, None)
+        if token is None:
+            return
+        bucket = index.get(token)
+        if bucket is not None:
+            bucket.pop(tid, None)
+            if not bucket:
+                del index[token]
+
+# Singleton Instance
+book = PositionBook()
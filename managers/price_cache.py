@@ -0,0 +1,147 @@
+import time
+import threading
+from managers.quote_batcher import quote_batcher
+
+# Index quotes shown on every dashboard poll: always subscribed on the ticker.
+# Tokens are Kite's; the instrument list overrides them when it has the row.
+INDEX_KEYS = {"NSE:NIFTY 50": 256265, "NSE:NIFTY BANK": 260105, "BSE:SENSEX": 265}
+
+class PriceCache:
+    """
+    Last traded price per instrument, shared by the REST endpoints.
+
+    - Ticks: the ticker feeds every tick in via on_ticks(). A price for a token
+      the ticker is subscribed to is always current (quiet instruments simply
+      don't tick), so it is served without any age check.
+    - Cold symbols: everything else is fetched with ONE quote request per call
+      (through the quote batcher, which merges concurrent callers) and kept
+      for `ttl` seconds.
+    - Watch list: symbols read through the cache are handed to the ticker
+      (LTP mode), so the next dashboard poll is served from ticks. Watches
+      expire after `watch_idle` seconds without reads; at most `watch_max`.
+    """
+    def __init__(self, ttl=2.0, watch_idle=600, watch_max=200):
+        self.ttl = ttl
+        self.watch_idle = watch_idle
+        self.watch_max = watch_max
+        self._lock = threading.Lock()
+        self._ticks = {}         # token -> ltp
+        self._live = set()       # tokens the ticker is subscribed to
+        self._rest = {}          # "EXCH:SYMBOL" -> (ltp, fetched_at)
+        self._tokens = {}        # "EXCH:SYMBOL" -> token (or None if unknown)
+        self._watch = {}         # token -> last read time
+        self.counters = {"tick_hits": 0, "rest_hits": 0, "rest_calls": 0, "rest_symbols": 0, "errors": 0}
+
+    def configure(self, ttl=None, watch_idle=None, watch_max=None):
+        if ttl is not None: self.ttl = ttl
+        if watch_idle is not None: self.watch_idle = watch_idle
+        if watch_max is not None: self.watch_max = watch_max
+
+    # --- Ticker Side ---
+    def on_ticks(self, ticks):
+        """Called from the ticker thread: O(1) per tick."""
+        with self._lock:
+            for tk in ticks:
+                try: self._ticks[int(tk['instrument_token'])] = tk['last_price']
+                except (KeyError, TypeError, ValueError): continue
+
+    def set_live(self, tokens):
+        """Tokens the ticker is now subscribed to (empty on disconnect)."""
+        tokens = set(tokens)
+        with self._lock:
+            for tok in tokens - self._live:
+                self._ticks.pop(tok, None) # Last tick may predate the subscription
+            self._live = tokens
+
+    def watch_tokens(self):
+        """Index tokens + recently read symbols, for the ticker to subscribe (LTP mode)."""
+        now = time.time()
+        with self._lock:
+            for tok in [t for t, ts in self._watch.items() if now - ts > self.watch_idle]:
+                del self._watch[tok]
+            return set(self._index_tokens()) | set(self._watch)
+
+    def _index_tokens(self):
+        return [self._tokens.get(k) or tok for k, tok in INDEX_KEYS.items()]
+
+    # --- Readers ---
+    def get_many(self, kite, keys, watch=True):
+        """
+        {"EXCH:SYMBOL": ltp} for all keys (0 if unavailable). At most one REST call.
+        watch=False for one-off reads (search results) that should not be subscribed.
+        """
+        now = time.time()
+        res, cold = {}, []
+        tokens = [self._token(key) for key in keys]
+        with self._lock:
+            for key, tok in zip(keys, tokens):
+                if tok is not None:
+                    if watch and key not in INDEX_KEYS:
+                        self._remember_watch(tok, now)
+                    if tok in self._live and tok in self._ticks:
+                        res[key] = self._ticks[tok]
+                        self.counters["tick_hits"] += 1
+                        continue
+                hit = self._rest.get(key)
+                if hit and now - hit[1] < self.ttl:
+                    res[key] = hit[0]
+                    self.counters["rest_hits"] += 1
+                else:
+                    cold.append(key)
+
+        if cold and kite is not None:
+            quotes = {}
+            try:
+                quotes = quote_batcher.quote(kite, cold)
+                with self._lock:
+                    self.counters["rest_calls"] += 1
+                    self.counters["rest_symbols"] += len(cold)
+            except Exception as e:
+                print(f"⚠️ Price Cache Quote Error: {e}")
+                with self._lock: self.counters["errors"] += 1
+
+            fetched = time.time()
+            with self._lock:
+                for key in cold:
+                    q = quotes.get(key) if quotes else None
+                    if q and 'last_price' in q:
+                        self._rest[key] = (q['last_price'], fetched)
+                        res[key] = q['last_price']
+                if len(self._rest) > 5000:
+                    self._rest = {k: v for k, v in self._rest.items() if fetched - v[1] < self.ttl}
+
+        for key in keys:
+            res.setdefault(key, 0)
+        return res
+
+    def get(self, kite, key):
+        return self.get_many(kite, [key])[key]
+
+    def forget_tokens(self):
+        """Drops the memoised symbol -> token map (the instrument list was replaced)."""
+        with self._lock:
+            self._tokens = {}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, ticks=len(self._ticks), live=len(self._live), watched=len(self._watch), rest_cached=len(self._rest))
+
+    # --- Internal ---
+    def _token(self, key):
+        """Instrument token of "EXCH:SYMBOL" (memoised once the instrument list is loaded)."""
+        if key in self._tokens:
+            return self._tokens[key]
+        import smart_trader # Local import to avoid a circular import
+        exch, _, sym = key.partition(":")
+        tok = smart_trader.get_instrument_token(sym, exch) or INDEX_KEYS.get(key)
+        if smart_trader.instruments is not None:
+            self._tokens[key] = tok # Only memoise once the instrument list is loaded
+        return tok
+
+    def _remember_watch(self, tok, now):
+        if tok not in self._watch and len(self._watch) >= self.watch_max:
+            del self._watch[min(self._watch, key=self._watch.get)]
+        self._watch[tok] = now
+
+# Singleton Instance
+price_cache = PriceCache()
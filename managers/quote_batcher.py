@@ -0,0 +1,88 @@
+import time
+import threading
+from concurrent.futures import Future
+
+class QuoteBatcher:
+    """
+    Coalesces concurrent kite.quote calls.
+
+    - Requests arriving within `window` seconds of each other are merged into
+      one multi-instrument kite.quote (split at `max_batch`, Kite's per-call limit).
+    - The first caller of a window is the leader: it waits out the window and
+      makes the call for everyone; the others just wait on their futures.
+    - A symbol already queued or in flight is not requested again: the caller
+      shares the pending result.
+    - Errors are raised to every caller of the failed batch, like kite.quote.
+    """
+    def __init__(self, window=0.005, max_batch=500, timeout=10.0):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = []       # keys waiting for the current window
+        self._inflight = {}      # key -> Future (queued or being fetched)
+        self._leader = False
+        self.counters = {"requests": 0, "symbols": 0, "deduped": 0, "calls": 0, "errors": 0}
+
+    def configure(self, window=None, max_batch=None):
+        if window is not None: self.window = window
+        if max_batch: self.max_batch = max_batch
+
+    def quote(self, kite, keys):
+        """Same contract as kite.quote(keys): {"EXCH:SYMBOL": quote} for the symbols found."""
+        if isinstance(keys, str): keys = [keys]
+        futures = {}
+        lead = False
+        with self._lock:
+            self.counters["requests"] += 1
+            for key in dict.fromkeys(keys):
+                f = self._inflight.get(key)
+                if f is None:
+                    f = self._inflight[key] = Future()
+                    self._pending.append(key)
+                    self.counters["symbols"] += 1
+                else:
+                    self.counters["deduped"] += 1
+                futures[key] = f
+            if self._pending and not self._leader:
+                self._leader = lead = True
+
+        if lead:
+            if self.window: time.sleep(self.window)
+            self._dispatch(kite)
+
+        res = {}
+        for key, f in futures.items():
+            q = f.result(self.timeout)
+            if q is not None:
+                res[key] = q
+        return res
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, inflight=len(self._inflight))
+
+    # --- Internal ---
+    def _dispatch(self, kite):
+        # Hand the window over first: later callers open their own while we fetch
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._leader = False
+
+        for i in range(0, len(batch), self.max_batch):
+            chunk = batch[i:i + self.max_batch]
+            quotes, error = {}, None
+            try:
+                quotes = kite.quote(chunk) or {}
+            except Exception as e:
+                error = e
+            with self._lock:
+                self.counters["calls"] += 1
+                if error: self.counters["errors"] += 1
+                futures = [(key, self._inflight.pop(key)) for key in chunk]
+            for key, f in futures:
+                if error: f.set_exception(error)
+                else: f.set_result(quotes.get(key))
+
+# Singleton Instance
+quote_batcher = QuoteBatcher()
@@ -3,7 +3,7 @@ import time
 import smart_trader
 import settings
 from managers.common import IST, log_event, get_time_str
-from managers.persistence import load_trades, save_trades, load_history
+from managers.persistence import load_trades, save_trade, load_history_since_id, get_max_history_id, get_history_trade
 from managers.broker_ops import move_to_history
 import threading
 
@@ -25,7 +25,8 @@ def import_past_trade(kite, symbol, entry_dt_str, qty, entry_price, sl_price, ta
             current_ts = int(time.time())
             
             # Check both Active AND History to catch instant-SL trades or double clicks
-            all_trades = load_trades() + load_history()
+            # (history ids are creation timestamps, so only recent rows can match)
+            all_trades = load_trades() + load_history_since_id(current_ts - 15)
             for t in all_trades:
                 # If same symbol, same qty, and created less than 15 seconds ago -> Block
                 if t.get('symbol') == symbol and int(t.get('quantity', 0)) == int(qty) and (current_ts - int(t.get('id', 0))) < 15:
@@ -40,7 +41,7 @@ def import_past_trade(kite, symbol, entry_dt_str, qty, entry_price, sl_price, ta
                 return {"status": "error", "message": f"Date Parse Error: {e}"}
 
             try:
-                s_cfg = settings.load_settings()
+                s_cfg = settings.get_settings()
                 exit_time_conf = s_cfg['modes']['PAPER'].get('universal_exit_time', "15:25")
                 exit_H, exit_M = map(int, exit_time_conf.split(':'))
             except: exit_H, exit_M = 15, 25
@@ -253,7 +254,7 @@ def import_past_trade(kite, symbol, entry_dt_str, qty, entry_price, sl_price, ta
             trades = load_trades()
                     
             new_id = current_ts
-            existing_ids = [t['id'] for t in trades] + [t['id'] for t in load_history()]
+            existing_ids = [t['id'] for t in trades] + [get_max_history_id()]
             if existing_ids:
                 max_id = max(existing_ids)
                 if new_id <= max_id:
@@ -286,8 +287,7 @@ def import_past_trade(kite, symbol, entry_dt_str, qty, entry_price, sl_price, ta
                     "is_replay": True, "last_update_time": hist_data[-1]['date'] if hist_data else get_time_str(),
                     "target_channels": target_channels 
                 }
-                trades.append(record)
-                save_trades(trades)
+                save_trade(record)
                 
                 # FORCE Subscription Update
                 try:
@@ -320,7 +320,8 @@ def import_past_trade(kite, symbol, entry_dt_str, qty, entry_price, sl_price, ta
                     "logs": logs, "is_replay": True, "pnl": realized_pnl,
                     "target_channels": target_channels
                 }
-                move_to_history(record, exit_reason, final_exit_price)
+                if not move_to_history(record, exit_reason, final_exit_price):
+                    return {"status": "error", "message": "Simulation finished but the trade could not be saved to history"}
                 
                 try:
                     from managers import risk_engine
@@ -338,8 +339,7 @@ def simulate_trade_scenario(kite, trade_id, scenario_config):
     Does NOT affect the database or send notifications.
     """
     try:
-        trades = load_history()
-        original_trade = next((t for t in trades if str(t['id']) == str(trade_id)), None)
+        original_trade = get_history_trade(trade_id)
         if not original_trade: return {"status": "error", "message": "Trade not found"}
 
         symbol = original_trade['symbol']
@@ -1,15 +1,23 @@
-import json
 import time
 import threading
 from kiteconnect import KiteTicker
 import smart_trader
 import settings
 from datetime import datetime
-from database import db, TradeHistory
-from managers.persistence import load_trades, save_trades, load_history, get_risk_state, save_risk_state
+from database import db
+from managers.persistence import load_trades, save_trades_bulk, load_todays_closed, get_history_trade, get_realized_pnl, save_to_history_db, get_risk_state, save_risk_state
+from managers.trade_store import store as trade_store
+from managers.position_book import book as position_book
+from managers.trigger_index import ACTIVE, CLOSED
+from managers.tick_queue import tick_queue
 from managers.common import IST, log_event
-from managers.broker_ops import manage_broker_sl, move_to_history
+from managers.broker_ops import move_to_history, submit_exit, submit_entry
+from managers.sl_sync import sl_sync
+from managers.order_dispatcher import dispatcher as order_dispatcher
 from managers.telegram_manager import bot as telegram_bot
+from managers.emit_scheduler import emitter
+from managers.price_cache import price_cache
+from managers.quote_batcher import quote_batcher
 
 # --- GLOBAL OBJECTS FOR WEBSOCKET ---
 kws = None
@@ -19,6 +27,11 @@ socket_io_server = None # Reference to SocketIO Server for emitting events
 
 # Global timer for periodic subscription checks (Self-Healing)
 last_sub_check = 0
+watched_tokens = set() # LTP-only subscriptions made for the price cache
+
+# Risk worker: drains the tick queue outside the KiteTicker thread
+risk_worker = None
+worker_stats = {"processed_batches": 0, "errors": 0, "last_batch_ms": 0.0}
 
 # --- REPORTING FUNCTIONS ---
 
@@ -29,11 +42,8 @@ def send_eod_report(mode):
     2. Aggregate Summary (Total P/L, Funds, Wins/Losses)
     """
     try:
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        history = load_history()
-        
-        # Filter for Today's trades in the specific Mode (LIVE/PAPER)
-        todays_trades = [t for t in history if t.get('exit_time') and t['exit_time'].startswith(today_str) and t['mode'] == mode]
+        # Today's trades in the specific Mode (LIVE/PAPER)
+        todays_trades = load_todays_closed(mode)
         
         if not todays_trades:
             return
@@ -137,9 +147,7 @@ def send_eod_report(mode):
 
 def send_manual_trade_status(mode):
     try:
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        history = load_history()
-        todays_trades = [t for t in history if t.get('exit_time') and t['exit_time'].startswith(today_str) and t['mode'] == mode]
+        todays_trades = load_todays_closed(mode)
         
         if not todays_trades:
             return {"status": "error", "message": "No trades found for today."}
@@ -205,8 +213,7 @@ def send_manual_trade_status(mode):
 
 def send_manual_trade_report(trade_id):
     try:
-        history = load_history()
-        trade = next((t for t in history if str(t['id']) == str(trade_id)), None)
+        trade = get_history_trade(trade_id)
         if not trade:
             active = load_trades()
             trade = next((t for t in active if str(t['id']) == str(trade_id)), None)
@@ -267,9 +274,7 @@ def send_manual_trade_report(trade_id):
 
 def send_manual_summary(mode):
     try:
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        history = load_history()
-        todays_trades = [t for t in history if t.get('exit_time') and t['exit_time'].startswith(today_str) and t['mode'] == mode]
+        todays_trades = load_todays_closed(mode)
         
         if not todays_trades:
             return {"status": "error", "message": "No trades found for today."}
@@ -329,8 +334,8 @@ def check_global_exit_conditions(kite, mode, mode_settings):
     Checks and executes global risk rules:
     1. Universal Square-off Time (e.g., 15:25)
     2. Profit Locking (Global PnL Trailing)
+    Trades are only loaded when an exit actually fires.
     """
-    trades = load_trades()
     now = datetime.now(IST)
     exit_time_str = mode_settings.get('universal_exit_time', "15:25")
     today_str = now.strftime("%Y-%m-%d")
@@ -343,8 +348,9 @@ def check_global_exit_conditions(kite, mode, mode_settings):
         
         if now >= exit_dt and (now - exit_dt).seconds < 120:
              if state.get('last_eod_date') != today_str:
-                 active_mode = [t for t in trades if t['mode'] == mode]
+                 active_mode = [t for t in load_trades() if t['mode'] == mode and not t.get('exit_type')] # exit_type: closed, history write pending
                  if active_mode:
+                     closed, unsaved = [], []
                      for t in active_mode:
                          exit_reason = "TIME_EXIT"
                          exit_price = t.get('current_ltp', 0)
@@ -354,15 +360,12 @@ def check_global_exit_conditions(kite, mode, mode_settings):
                              exit_price = t['entry_price']
                          
                          if t['mode'] == "LIVE" and t['status'] != 'PENDING':
-                            manage_broker_sl(kite, t, cancel_completely=True)
-                            try: 
-                                kite.place_order(variety=kite.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'], transaction_type=kite.TRANSACTION_TYPE_SELL, quantity=t['quantity'], order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS)
-                            except: pass
+                            submit_exit(kite, t, t['quantity'], cancel_sl=True, tag="RD_TIME_EXIT")
                          
-                         move_to_history(t, exit_reason, exit_price)
+                         if move_to_history(t, exit_reason, exit_price): closed.append(t['id'])
+                         else: unsaved.append(t) # History write failed: keep it active
                      
-                     remaining = [t for t in trades if t['mode'] != mode]
-                     save_trades(remaining)
+                     save_trades_bulk(unsaved, closed)
                  
                  send_eod_report(mode)
                  state['last_eod_date'] = today_str
@@ -374,17 +377,7 @@ def check_global_exit_conditions(kite, mode, mode_settings):
     # --- 2. PROFIT LOCKING ---
     pnl_start = float(mode_settings.get('profit_lock', 0))
     if pnl_start > 0:
-        current_total_pnl = 0.0
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        history = load_history()
-        for t in history:
-            if t.get('exit_time') and t['exit_time'].startswith(today_str) and t['mode'] == mode: 
-                current_total_pnl += t.get('pnl', 0)
-        
-        active = [t for t in trades if t['mode'] == mode]
-        for t in active:
-            if t['status'] != 'PENDING':
-                current_total_pnl += (t.get('current_ltp', t['entry_price']) - t['entry_price']) * t['quantity']
+        current_total_pnl = get_realized_pnl(mode, today_str) + trade_store.unrealized_pnl(mode)
 
         if not state.get('active') and current_total_pnl >= pnl_start:
             state['active'] = True
@@ -403,18 +396,16 @@ def check_global_exit_conditions(kite, mode, mode_settings):
                      save_risk_state(mode, state)
 
             if current_total_pnl <= state['global_sl']:
-                active_mode = [t for t in trades if t['mode'] == mode]
+                active_mode = [t for t in load_trades() if t['mode'] == mode and not t.get('exit_type')] # exit_type: closed, history write pending
+                closed, unsaved = [], []
                 for t in active_mode:
                      if t['mode'] == "LIVE" and t['status'] != 'PENDING':
-                        manage_broker_sl(kite, t, cancel_completely=True)
-                        try: 
-                            kite.place_order(variety=kite.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'], transaction_type=kite.TRANSACTION_TYPE_SELL, quantity=t['quantity'], order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS)
-                        except: pass
+                        submit_exit(kite, t, t['quantity'], cancel_sl=True, tag="RD_PROFIT_LOCK")
                      
-                     move_to_history(t, "PROFIT_LOCK", t.get('current_ltp', 0))
+                     if move_to_history(t, "PROFIT_LOCK", t.get('current_ltp', 0)): closed.append(t['id'])
+                     else: unsaved.append(t) # History write failed: keep it active
                 
-                remaining = [t for t in trades if t['mode'] != mode]
-                save_trades(remaining)
+                save_trades_bulk(unsaved, closed)
                 state['active'] = False
                 save_risk_state(mode, state)
 
@@ -423,236 +414,274 @@ def check_global_exit_conditions(kite, mode, mode_settings):
 def on_ticks(ws, ticks):
     """
     Triggered whenever a price update is received from Zerodha.
+    Only hands the ticks to the conflating queue, so a slow DB write, Telegram
+    post or Socket.IO emit never stalls the feed. The risk worker does the rest.
+    Every tick also refreshes the shared price cache used by the REST endpoints.
+    """
+    price_cache.on_ticks(ticks)
+    tick_queue.put(ticks)
+
+def _risk_worker():
+    """
+    Drains the tick queue and runs the risk logic (one batch at a time).
+    Also does the periodic resubscribe check that used to run in the ticker thread.
+    """
+    global last_sub_check
+    while True:
+        batch = tick_queue.drain(timeout=1.0)
+        if not flask_app: continue
+
+        # --- 0. AUTO-RESUBSCRIBE CHECK (Every 5 Seconds) ---
+        # This ensures newly closed trades (like Replay or Live SL Hit) are watched.
+        if kws and time.time() - last_sub_check > 5:
+            try: subscribe_active_trades(kws)
+            except Exception as e: print(f"Resubscribe Error: {e}")
+            last_sub_check = time.time()
+
+        if not batch: continue
+        try:
+            started = time.time()
+            process_ticks(batch)
+            worker_stats['processed_batches'] += 1
+            worker_stats['last_batch_ms'] = round((time.time() - started) * 1000, 2)
+        except Exception as e:
+            worker_stats['errors'] += 1
+            print(f"Risk Worker Error: {e}")
+
+def start_risk_worker():
+    global risk_worker
+    if risk_worker is None:
+        risk_worker = threading.Thread(target=_risk_worker, daemon=True)
+        risk_worker.start()
+
+def get_engine_stats():
+    return {"queue": tick_queue.stats(), "worker": dict(worker_stats), "book": position_book.stats(), "orders": order_dispatcher.stats(), "sl_sync": sl_sync.stats(), "telegram": telegram_bot.outbox.stats(), "highs": telegram_bot.highs.stats(), "emits": emitter.stats(), "prices": price_cache.stats(), "quotes": quote_batcher.stats(), "instruments": smart_trader.instrument_memory()}
+
+def _price_path(tk):
+    """
+    Prices to evaluate for one conflated tick: low, then high, then last.
+    The low goes first so an SL crossing is never overtaken by a target crossing
+    (conservative when the in-between order is unknown). Plain ticks give [ltp].
+    """
+    ltp = tk['last_price']
+    path = []
+    if tk.get('low', ltp) < ltp: path.append(tk['low'])
+    if tk.get('high', ltp) > ltp: path.append(tk['high'])
+    path.append(ltp)
+    return path
+
+def process_ticks(ticks):
+    """
+    Risk logic for a batch of (conflated) ticks.
     Handles Active Trades and Closed Trades (Virtual SL & Monitoring).
     """
-    global kite_client, flask_app, socket_io_server, last_sub_check
-    
     if not flask_app: return
 
-    # --- 0. AUTO-RESUBSCRIBE CHECK (Every 5 Seconds) ---
-    # This ensures newly closed trades (like Replay or Live SL Hit) are watched.
-    if time.time() - last_sub_check > 5:
-        subscribe_active_trades(ws)
-        last_sub_check = time.time()
-
     # Use App Context for DB operations inside this thread
     with flask_app.app_context():
-        active_trades = load_trades()
-        
-        # Load Today's Closed Trades for Virtual Tracking
-        history = load_history()
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        todays_closed = [t for t in history if t.get('exit_time') and t['exit_time'].startswith(today_str)]
-        
-        if not active_trades and not todays_closed: return
+        # Today's closed trades are kept in the position book (reloaded once per day)
+        position_book.ensure_day()
 
-        # Map Ticks: {instrument_token: last_price}
-        tick_map = {t['instrument_token']: t['last_price'] for t in ticks}
-        
-        active_list = []
-        updated = False
+        # Map Ticks: {instrument_token: [prices]}, only for tokens with positions
+        tick_map = {}
+        for tk in ticks:
+            token = int(tk['instrument_token'])
+            if position_book.has(token):
+                tick_map[token] = _price_path(tk)
+
+        if not tick_map: return
+
+        changed_ids = set()   # Trades whose row must be rewritten
+        closed_ids = set()    # Trades moved to history this batch
         
         # --- 1. PROCESS ACTIVE TRADES ---
-        for t in active_trades:
-            token = t.get('instrument_token')
-            if token: token = int(token) # Force INT to match tick_map keys
+        # Trades are live references from the in-memory store: mutate under its lock,
+        # the store's background writer persists the dirty ones.
+        # The position book hands out only the trades on the ticked tokens.
+        with trade_store.lock:
+            for token, path in tick_map.items():
+                for ltp in path:
+                    # Only trades whose SL/target/trigger band this price left need the full checks
+                    crossed = position_book.candidates(token, ltp)
+                    evaluated = []
+                    for t in position_book.active_for(token):
+                        if t['id'] in closed_ids: continue # Exited earlier on this path
+                        # Update internal LTP
+                        if t.get('current_ltp') != ltp:
+                            t['current_ltp'] = ltp
+                            changed_ids.add(t['id'])
+
+                        if (ACTIVE, int(t['id'])) not in crossed:
+                            continue
+                        evaluated.append(t)
             
-            # If no update for this trade, keep as is
-            if not token or token not in tick_map:
-                active_list.append(t)
-                continue
+                        # A. PENDING ORDERS (Activation)
+                        if t['status'] == "PENDING":
+                            condition_met = False
+                            if t.get('trigger_dir') == 'BELOW':
+                                if ltp <= t['entry_price']: condition_met = True
+                            elif t.get('trigger_dir') == 'ABOVE':
+                                if ltp >= t['entry_price']: condition_met = True
                 
-            ltp = tick_map[token]
-            
-            # Update internal LTP
-            if t.get('current_ltp') != ltp:
-                t['current_ltp'] = ltp
-                updated = True
-            
-            # A. PENDING ORDERS (Activation)
-            if t['status'] == "PENDING":
-                condition_met = False
-                if t.get('trigger_dir') == 'BELOW':
-                    if ltp <= t['entry_price']: condition_met = True
-                elif t.get('trigger_dir') == 'ABOVE':
-                    if ltp >= t['entry_price']: condition_met = True
-                
-                if condition_met:
-                    t['status'] = "OPEN"
-                    t['highest_ltp'] = t['entry_price']
-                    log_event(t, f"Order ACTIVATED @ {ltp}")
-                    telegram_bot.notify_trade_event(t, "ACTIVE", ltp)
+                            if condition_met:
+                                changed_ids.add(t['id'])
+                                t['status'] = "OPEN"
+                                t['highest_ltp'] = t['entry_price']
+                                log_event(t, f"Order ACTIVATED @ {ltp}")
+                                telegram_bot.notify_trade_event(t, "ACTIVE", ltp)
                     
-                    if t['mode'] == 'LIVE' and kite_client:
-                        try:
-                            kite_client.place_order(
-                                variety=kite_client.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'],
-                                transaction_type=kite_client.TRANSACTION_TYPE_BUY, quantity=t['quantity'],
-                                order_type=kite_client.ORDER_TYPE_MARKET, product=kite_client.PRODUCT_MIS, tag="RD_ENTRY"
-                            )
-                            # Place Broker SL
-                            sl_id = kite_client.place_order(
-                                variety=kite_client.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'],
-                                transaction_type=kite_client.TRANSACTION_TYPE_SELL, quantity=t['quantity'],
-                                order_type=kite_client.ORDER_TYPE_SL_M, product=kite_client.PRODUCT_MIS,
-                                trigger_price=t['sl'], tag="RD_SL"
-                            )
-                            t['sl_order_id'] = sl_id
-                        except Exception as e:
-                            log_event(t, f"Broker Fail (Active): {e}")
-
-                    active_list.append(t)
-                else:
-                    active_list.append(t)
-                continue
+                                # Entry + Broker SL go through the order dispatcher (sl_order_id is set when placed)
+                                if t['mode'] == 'LIVE' and kite_client:
+                                    submit_entry(kite_client, t)
+
+                            continue
 
-            # B. ACTIVE ORDERS
-            if t['status'] in ['OPEN', 'PROMOTED_LIVE']:
-                current_high = t.get('highest_ltp', 0)
+                        # B. ACTIVE ORDERS
+                        if t['status'] in ['OPEN', 'PROMOTED_LIVE']:
+                            current_high = t.get('highest_ltp', 0)
                 
-                # High Made
-                if ltp > current_high:
-                    t['highest_ltp'] = ltp
-                    t['made_high'] = ltp
+                            # High Made
+                            if ltp > current_high:
+                                t['highest_ltp'] = ltp
+                                t['made_high'] = ltp
+                                changed_ids.add(t['id'])
                     
-                    has_crossed_t3 = False
-                    if 2 in t.get('targets_hit_indices', []): has_crossed_t3 = True
-                    elif t.get('targets') and len(t['targets']) > 2 and ltp >= t['targets'][2]: has_crossed_t3 = True
+                                has_crossed_t3 = False
+                                if 2 in t.get('targets_hit_indices', []): has_crossed_t3 = True
+                                elif t.get('targets') and len(t['targets']) > 2 and ltp >= t['targets'][2]: has_crossed_t3 = True
                     
-                    if has_crossed_t3:
-                        telegram_bot.notify_trade_event(t, "HIGH_MADE", ltp)
-
-                # Trailing SL
-                if t.get('trailing_sl', 0) > 0:
-                    step = t['trailing_sl']
-                    diff = ltp - (t['sl'] + step)
-                    if diff >= step:
-                        steps_to_move = int(diff / step)
-                        new_sl = t['sl'] + (steps_to_move * step)
+                                if has_crossed_t3:
+                                    telegram_bot.notify_trade_event(t, "HIGH_MADE", ltp)
+
+                            # Trailing SL
+                            if t.get('trailing_sl', 0) > 0:
+                                step = t['trailing_sl']
+                                diff = ltp - (t['sl'] + step)
+                                if diff >= step:
+                                    steps_to_move = int(diff / step)
+                                    new_sl = t['sl'] + (steps_to_move * step)
                         
-                        sl_limit = float('inf')
-                        mode = int(t.get('sl_to_entry', 0))
-                        if mode == 1: sl_limit = t['entry_price']
-                        elif mode == 2 and t.get('targets'): sl_limit = t['targets'][0]
-                        elif mode == 3 and t.get('targets') and len(t['targets']) > 1: sl_limit = t['targets'][1]
+                                    sl_limit = float('inf')
+                                    mode = int(t.get('sl_to_entry', 0))
+                                    if mode == 1: sl_limit = t['entry_price']
+                                    elif mode == 2 and t.get('targets'): sl_limit = t['targets'][0]
+                                    elif mode == 3 and t.get('targets') and len(t['targets']) > 1: sl_limit = t['targets'][1]
                         
-                        if mode > 0: new_sl = min(new_sl, sl_limit)
+                                    if mode > 0: new_sl = min(new_sl, sl_limit)
                         
-                        if new_sl > t['sl']:
-                            t['sl'] = new_sl
-                            if t['mode'] == 'LIVE' and t.get('sl_order_id') and kite_client:
-                                try: kite_client.modify_order(variety=kite_client.VARIETY_REGULAR, order_id=t['sl_order_id'], trigger_price=new_sl)
-                                except: pass
-                            log_event(t, f"Step Trailing: SL Moved to {t['sl']:.2f}")
-
-                exit_triggered = False
-                exit_reason = ""
+                                    if new_sl > t['sl']:
+                                        t['sl'] = new_sl
+                                        changed_ids.add(t['id'])
+                                        if t['mode'] == 'LIVE' and t.get('sl_order_id') and kite_client:
+                                            sl_sync.request(kite_client, t, new_sl)
+                                        log_event(t, f"Step Trailing: SL Moved to {t['sl']:.2f}")
+
+                            exit_triggered = False
+                            exit_reason = ""
                 
-                # Check SL
-                if ltp <= t['sl']:
-                    exit_triggered = True
-                    exit_reason = "SL_HIT"
+                            # Check SL
+                            if ltp <= t['sl']:
+                                exit_triggered = True
+                                exit_reason = "SL_HIT"
                 
-                # Check Targets
-                elif not exit_triggered and t.get('targets'):
-                    controls = t.get('target_controls', [{'enabled':True, 'lots':0}]*3)
-                    for i, tgt in enumerate(t['targets']):
-                        if i not in t.get('targets_hit_indices', []) and ltp >= tgt:
-                            t.setdefault('targets_hit_indices', []).append(i)
-                            conf = controls[i]
-                            telegram_bot.notify_trade_event(t, "TARGET_HIT", {'t_num': i+1, 'price': tgt})
+                            # Check Targets
+                            elif not exit_triggered and t.get('targets'):
+                                controls = t.get('target_controls', [{'enabled':True, 'lots':0}]*3)
+                                for i, tgt in enumerate(t['targets']):
+                                    if i not in t.get('targets_hit_indices', []) and ltp >= tgt:
+                                        t.setdefault('targets_hit_indices', []).append(i)
+                                        changed_ids.add(t['id'])
+                                        conf = controls[i]
+                                        telegram_bot.notify_trade_event(t, "TARGET_HIT", {'t_num': i+1, 'price': tgt})
                             
-                            # Trail to Entry Feature
-                            if conf.get('trail_to_entry') and t['sl'] < t['entry_price']:
-                                t['sl'] = t['entry_price']
-                                log_event(t, f"Target {i+1} Hit: SL Trailed to Entry")
-                                if t['mode'] == 'LIVE' and t.get('sl_order_id') and kite_client:
-                                    try: kite_client.modify_order(variety=kite_client.VARIETY_REGULAR, order_id=t['sl_order_id'], trigger_price=t['sl'])
-                                    except: pass
+                                        # Trail to Entry Feature
+                                        if conf.get('trail_to_entry') and t['sl'] < t['entry_price']:
+                                            t['sl'] = t['entry_price']
+                                            log_event(t, f"Target {i+1} Hit: SL Trailed to Entry")
+                                            if t['mode'] == 'LIVE' and t.get('sl_order_id') and kite_client:
+                                                sl_sync.request(kite_client, t, t['sl'])
                             
-                            if not conf['enabled']: continue
+                                        if not conf['enabled']: continue
                             
-                            lot_size = t.get('lot_size') or smart_trader.get_lot_size(t['symbol'])
-                            qty_to_exit = conf.get('lots', 0) * lot_size
+                                        lot_size = t.get('lot_size') or smart_trader.get_lot_size(t['symbol'])
+                                        qty_to_exit = conf.get('lots', 0) * lot_size
                             
-                            if qty_to_exit >= t['quantity']:
-                                exit_triggered = True
-                                exit_reason = "TARGET_HIT"
-                                break
-                            elif qty_to_exit > 0:
-                                if t['mode'] == 'LIVE' and kite_client: manage_broker_sl(kite_client, t, qty_to_exit)
-                                t['quantity'] -= qty_to_exit
-                                log_event(t, f"Target {i+1} Hit. Exited {qty_to_exit}")
-                                if t['mode'] == 'LIVE' and kite_client:
-                                    try: kite_client.place_order(variety=kite_client.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'], transaction_type=kite_client.TRANSACTION_TYPE_SELL, quantity=qty_to_exit, order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS)
-                                    except: pass
-
-                if exit_triggered:
-                    if t['mode'] == "LIVE" and kite_client:
-                        manage_broker_sl(kite_client, t, cancel_completely=True)
-                        try: kite_client.place_order(variety=kite_client.VARIETY_REGULAR, tradingsymbol=t['symbol'], exchange=t['exchange'], transaction_type=kite.TRANSACTION_TYPE_SELL, quantity=t['quantity'], order_type=kite.ORDER_TYPE_MARKET, product=kite.PRODUCT_MIS)
-                        except: pass
+                                        if qty_to_exit >= t['quantity']:
+                                            exit_triggered = True
+                                            exit_reason = "TARGET_HIT"
+                                            break
+                                        elif qty_to_exit > 0:
+                                            # Shrink the broker SL, then sell the lots (one EXIT job, snapshot taken before the qty change)
+                                            if t['mode'] == 'LIVE' and kite_client:
+                                                submit_exit(kite_client, t, qty_to_exit, sl_qty_to_remove=qty_to_exit, tag="RD_TARGET_PART")
+                                            t['quantity'] -= qty_to_exit
+                                            log_event(t, f"Target {i+1} Hit. Exited {qty_to_exit}")
+
+                            if exit_triggered:
+                                if t['mode'] == "LIVE" and kite_client:
+                                    submit_exit(kite_client, t, t['quantity'], cancel_sl=True, tag="RD_EXIT")
                     
-                    final_price = t['sl'] if exit_reason=="SL_HIT" else (t['targets'][-1] if exit_reason=="TARGET_HIT" else ltp)
-                    if exit_reason == "SL_HIT":
-                        t['exit_price'] = final_price
-                        telegram_bot.notify_trade_event(t, "SL_HIT", (final_price - t['entry_price']) * t['quantity'])
+                                final_price = t['sl'] if exit_reason=="SL_HIT" else (t['targets'][-1] if exit_reason=="TARGET_HIT" else ltp)
+                                if exit_reason == "SL_HIT":
+                                    t['exit_price'] = final_price
+                                    telegram_bot.notify_trade_event(t, "SL_HIT", (final_price - t['entry_price']) * t['quantity'])
                     
-                    move_to_history(t, exit_reason, final_price)
-                else:
-                    active_list.append(t)
-        
-        if updated:
-            save_trades(active_list)
-            # Emit real-time update to Frontend for Active Trades
-            if socket_io_server:
-                try:
-                    socket_io_server.emit('trade_update', active_list)
-                except Exception as e:
-                    print(f"Socket Emit Error: {e}")
+                                if move_to_history(t, exit_reason, final_price):
+                                    closed_ids.add(t['id'])
+                                else:
+                                    changed_ids.add(t['id']) # History write failed: stays active (closed status) for the retry
+
+                    # Re-band before the next price on the path (SL/targets may have moved)
+                    for t in evaluated:
+                        if t['id'] not in closed_ids: position_book.refresh_active(t)
+
+            if changed_ids or closed_ids:
+                for tid in closed_ids:
+                    trade_store.remove(tid)
+                for tid in changed_ids.difference(closed_ids):
+                    trade_store.mark_dirty(tid)
+        # Frontend updates for active trades are pushed by the emit scheduler (from the store's sync log)
 
         # --- 2. PROCESS CLOSED TRADES (Modified for Live LTP & Virtual SL) ---
         history_updated = False
-        live_closed_updates = []  # List to store live updates for frontend
+        live_closed_updates = {}  # trade_id -> trade, live updates for frontend
 
         try:
-            for t in todays_closed:
-                token = t.get('instrument_token')
-                if not token: continue
-                token = int(token) # Force INT casting
-                
-                if token not in tick_map: continue
+            for token, path in tick_map.items():
+                for ltp in path:
+                    crossed = position_book.candidates(token, ltp)
+                    for t in position_book.closed_for(token):
+                        if t['id'] in closed_ids: continue # Closed in this batch, track from the next tick
+                        t['current_ltp'] = ltp
                 
-                ltp = tick_map[token]
-                t['current_ltp'] = ltp
+                        # Always add to update list so Frontend gets the live price
+                        live_closed_updates[t['id']] = t
                 
-                # Always add to update list so Frontend gets the live price
-                live_closed_updates.append(t) 
-                
-                # Only run the "Logic" (Virtual SL / High Made) if not already dead
-                if not t.get('virtual_sl_hit', False):
+                        # Only run the "Logic" (Virtual SL / High Made) if not already dead
+                        # and the price crossed its SL or previous high
+                        if not t.get('virtual_sl_hit', False) and (CLOSED, int(t['id'])) in crossed:
                     
-                    # Check Virtual SL (Entry vs SL direction)
-                    is_dead = False
-                    if t['entry_price'] > t['sl']: # BUY
-                         if ltp <= t['sl']: is_dead = True
-                    else: # SELL
-                         if ltp >= t['sl']: is_dead = True
+                            # Check Virtual SL (Entry vs SL direction)
+                            is_dead = False
+                            if t['entry_price'] > t['sl']: # BUY
+                                 if ltp <= t['sl']: is_dead = True
+                            else: # SELL
+                                 if ltp >= t['sl']: is_dead = True
                     
-                    if is_dead:
-                        t['virtual_sl_hit'] = True
-                        db.session.merge(TradeHistory(id=t['id'], data=json.dumps(t)))
-                        history_updated = True
-                        continue # Skip High Check if just died
-
-                    # Check High Made
-                    current_high = t.get('made_high', t['entry_price'])
-                    if ltp > current_high:
-                        t['made_high'] = ltp
-                        try: telegram_bot.notify_trade_event(t, "HIGH_MADE", ltp)
-                        except: pass
-                        db.session.merge(TradeHistory(id=t['id'], data=json.dumps(t)))
-                        history_updated = True
+                            if is_dead:
+                                t['virtual_sl_hit'] = True
+                                save_to_history_db(t, commit=False)
+                                history_updated = True
+                                continue # Skip High Check if just died
+
+                            # Check High Made
+                            current_high = t.get('made_high', t['entry_price'])
+                            if ltp > current_high:
+                                t['made_high'] = ltp
+                                try: telegram_bot.notify_trade_event(t, "HIGH_MADE", ltp)
+                                except: pass
+                                save_to_history_db(t, commit=False)
+                                history_updated = True
                     
         except Exception as e:
             print(f"Error in History Tracker: {e}")
@@ -660,40 +689,45 @@ def on_ticks(ws, ticks):
         if history_updated:
             db.session.commit()
 
-        # Emit Real-Time Closed Trade Updates to Frontend
-        if socket_io_server and live_closed_updates:
-            try:
-                socket_io_server.emit('closed_trade_update', live_closed_updates)
-            except Exception as e:
-                print(f"Socket Emit Error (Closed): {e}")
+        # Real-Time Closed Trade Updates to Frontend (throttled by the emit scheduler)
+        if live_closed_updates:
+            emitter.mark_closed(live_closed_updates.values())
 
 def on_connect(ws, response):
+    global watched_tokens
     print("✅ WebSocket Connected! Resubscribing...")
+    watched_tokens = set()
     subscribe_active_trades(ws)
 
 def on_close(ws, code, reason):
     print(f"⚠️ WebSocket Closed: {code} - {reason}")
+    price_cache.set_live(()) # Cached ticks are stale until resubscribed
 
 def subscribe_active_trades(ws):
+    global watched_tokens
     with flask_app.app_context():
-        # Get Active Trade Tokens
-        trades = load_trades()
-        active_tokens = [int(t['instrument_token']) for t in trades if t.get('instrument_token')]
-        
-        # Get Closed Trade Tokens (for Today) to track Missed Opportunities
-        history = load_history()
-        today_str = datetime.now(IST).strftime("%Y-%m-%d")
-        closed_tokens = [int(t['instrument_token']) for t in history 
-                         if t.get('exit_time') and t['exit_time'].startswith(today_str) and t.get('instrument_token')]
-        
-        # Combine unique tokens
-        all_tokens = list(set(active_tokens + closed_tokens))
+        # Active + Today's Closed Trade tokens (to track Missed Opportunities),
+        # straight from the position book
+        position_book.ensure_day()
+        all_tokens = position_book.tokens()
         
         if all_tokens:
             ws.subscribe(all_tokens)
-            ws.set_mode(ws.MODE_FULL, all_tokens)
+            ws.set_mode(getattr(ws, 'MODE_FULL', 'full'), all_tokens)
             # print(f"📡 Subscribed to {len(all_tokens)} tokens (Active + Closed).") # Reduced spam
 
+        # Indices + symbols the dashboard is reading: LTP only, for the price cache
+        watch = price_cache.watch_tokens() - set(all_tokens)
+        new_watch = list(watch - watched_tokens)
+        if new_watch:
+            ws.subscribe(new_watch)
+            ws.set_mode(getattr(ws, 'MODE_LTP', 'ltp'), new_watch)
+        gone = list(watched_tokens - watch - set(all_tokens))
+        if gone and hasattr(ws, 'unsubscribe'):
+            ws.unsubscribe(gone)
+        watched_tokens = watch
+        price_cache.set_live(set(all_tokens) | watch)
+
 def start_ticker(api_key, access_token, kite_inst, app_inst, socket_inst=None):
     """
     Initializes and starts the KiteTicker (or MockTicker).
@@ -715,6 +749,7 @@ def start_ticker(api_key, access_token, kite_inst, app_inst, socket_inst=None):
     kws.on_ticks = on_ticks
     kws.on_connect = on_connect
     kws.on_close = on_close
+    start_risk_worker()
     
     # Run in a separate thread so it doesn't block Flask
     kws.connect(threaded=True)
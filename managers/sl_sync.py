@@ -0,0 +1,151 @@
+import time
+import threading
+from functools import partial
+from kiteconnect.exceptions import NetworkException
+from managers.trade_store import store as trade_store
+from managers.order_dispatcher import dispatcher as order_dispatcher, PRIORITY_SL_MODIFY
+
+def is_transient_error(e):
+    """Broker errors worth retrying (network trouble, rate limiting)."""
+    if isinstance(e, NetworkException):
+        return True
+    msg = str(e).lower()
+    return "too many requests" in msg or "timed out" in msg or "timeout" in msg or "connection" in msg
+
+class SlSync:
+    """
+    Keeps each broker SL order's trigger in step with the trade's internal SL.
+    - Coalesce: while a change for an order is waiting, newer values overwrite it
+      (only the latest trigger is ever sent).
+    - Debounce: a change is sent `window` seconds after it was first requested,
+      so a fast trailing move costs one modify per window instead of one per tick.
+    - Retry: transient failures are retried with backoff, up to `max_retries`.
+    - Confirm: a successful modify records the trigger on the trade as 'broker_sl'.
+    """
+    def __init__(self, window=0.5, max_retries=3, backoff=0.5):
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._cond = threading.Condition()
+        self._pending = {}   # sl_order_id -> entry dict
+        self._thread = None
+        self.counters = {"requested": 0, "coalesced": 0, "sent": 0, "confirmed": 0,
+                         "retried": 0, "failed": 0, "discarded": 0}
+
+    def configure(self, window=None, max_retries=None):
+        if window is not None: self.window = max(0.0, float(window))
+        if max_retries is not None: self.max_retries = max(0, int(max_retries))
+
+    def request(self, kite, trade, trigger_price):
+        """Asks for the broker SL of `trade` to move to `trigger_price`. Never blocks."""
+        order_id = trade.get('sl_order_id')
+        if not order_id:
+            return
+        with self._cond:
+            self.counters["requested"] += 1
+            entry = self._pending.get(order_id)
+            if entry:
+                entry['trigger'] = trigger_price
+                self.counters["coalesced"] += 1
+            else:
+                self._pending[order_id] = {
+                    'kite': kite, 'trade_id': trade['id'], 'symbol': trade.get('symbol'),
+                    'trigger': trigger_price, 'due': time.time() + self.window,
+                    'attempts': 0, 'inflight': False
+                }
+            self._cond.notify()
+        self._ensure_thread()
+
+    def discard(self, order_id):
+        """Drops any pending change (order being cancelled, or SL set manually)."""
+        if not order_id:
+            return
+        with self._cond:
+            if self._pending.pop(order_id, None) is not None:
+                self.counters["discarded"] += 1
+
+    def pending_trigger(self, order_id):
+        with self._cond:
+            entry = self._pending.get(order_id)
+            return entry['trigger'] if entry else None
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=len(self._pending), window=self.window)
+
+    # --- Internal ---
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            jobs = []
+            with self._cond:
+                now = time.time()
+                for order_id, e in self._pending.items():
+                    if not e['inflight'] and e['due'] <= now:
+                        e['inflight'] = True
+                        jobs.append((order_id, e['kite'], e['trigger'], e['symbol']))
+                if not jobs:
+                    waiting = [e['due'] for e in self._pending.values() if not e['inflight']]
+                    self._cond.wait(max(0.005, min(waiting) - now) if waiting else None)
+                    continue
+
+            for order_id, kite, trigger, symbol in jobs:
+                self.counters["sent"] += 1
+                fut = order_dispatcher.submit(PRIORITY_SL_MODIFY, self._send, kite, order_id, trigger, label=f"SL {symbol} -> {trigger}")
+                fut.add_done_callback(partial(self._on_done, order_id, trigger))
+
+    @staticmethod
+    def _send(kite, order_id, trigger):
+        from managers.broker_ops import modify_order
+        return modify_order(kite, order_id, trigger_price=trigger)
+
+    def _on_done(self, order_id, sent, fut):
+        error = fut.exception()
+        failed_entry = None
+        with self._cond:
+            e = self._pending.get(order_id)
+            if e is None:
+                return # Discarded while in flight
+            e['inflight'] = False
+            now = time.time()
+
+            if error is None:
+                self.counters["confirmed"] += 1
+                e['attempts'] = 0
+                if e['trigger'] == sent:
+                    del self._pending[order_id]
+                else:
+                    e['due'] = now + self.window # A newer value arrived meanwhile
+            elif is_transient_error(error) and e['attempts'] < self.max_retries:
+                e['attempts'] += 1
+                e['due'] = now + self.backoff * (2 ** (e['attempts'] - 1))
+                self.counters["retried"] += 1
+            else:
+                del self._pending[order_id]
+                self.counters["failed"] += 1
+                failed_entry = e
+            trade_id = e['trade_id']
+            self._cond.notify()
+
+        if error is None:
+            self._record_confirmed(trade_id, order_id, sent)
+        elif failed_entry:
+            from managers.broker_ops import log_order_event
+            log_order_event(trade_id, f"⚠️ Broker SL Sync Failed ({sent}): {error}")
+
+    @staticmethod
+    def _record_confirmed(trade_id, order_id, trigger):
+        with trade_store.lock:
+            live = trade_store.get(trade_id)
+            if live and live.get('sl_order_id') == order_id:
+                live['broker_sl'] = trigger
+                trade_store.mark_dirty(trade_id)
+
+# Singleton Instance
+sl_sync = SlSync()
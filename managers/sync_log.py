@@ -0,0 +1,75 @@
+import time
+import threading
+from collections import OrderedDict
+
+POSITIONS = "positions"
+CLOSED = "closed"
+
+class SyncLog:
+    """
+    Revision counter + bounded changelog for dashboard delta sync.
+
+    Every change to an active trade (position) or closed trade bumps the global
+    revision. The log keeps one entry per (stream, trade id) - its latest revision -
+    in revision order, so "what changed since rev R" walks only the newest entries.
+    Once more than `size` distinct trades changed, the oldest entries are evicted
+    and clients older than the eviction point get a full snapshot instead.
+    `epoch` changes on every process start, so a client never applies a delta
+    computed against another process's revisions.
+    """
+    def __init__(self, size=5000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.epoch = str(int(time.time() * 1000))
+        self.revision = 0
+        self._floor = 0          # deltas are only available for revisions >= floor
+        self._entries = OrderedDict()  # (stream, id) -> (rev, removed, added_rev)
+
+    def record(self, stream, item_id, removed=False, added=False):
+        key = (stream, int(item_id))
+        with self.lock:
+            self.revision += 1
+            prev = self._entries.pop(key, None)
+            added_rev = self.revision if added else (prev[2] if prev else 0)
+            self._entries[key] = (self.revision, removed, added_rev)
+            if len(self._entries) > self.size:
+                _, (old_rev, _, _) = self._entries.popitem(last=False)
+                self._floor = old_rev
+
+    def invalidate(self):
+        """Bulk change (e.g. history cleanup): every client resyncs fully."""
+        with self.lock:
+            self.revision += 1
+            self._entries.clear()
+            self._floor = self.revision
+
+    def since(self, stream, epoch, rev):
+        """
+        Changes in `stream` after `rev`: (added_ids, changed_ids, removed_ids),
+        or None if the client must take a full snapshot.
+        """
+        try: rev = int(rev)
+        except (TypeError, ValueError): return None
+        with self.lock:
+            if epoch != self.epoch or rev <= 0 or rev < self._floor or rev > self.revision:
+                return None
+            added, changed, removed = [], [], []
+            for (s, item_id), (r, is_removed, added_rev) in reversed(self._entries.items()):
+                if r <= rev:
+                    break
+                if s != stream:
+                    continue
+                if is_removed:
+                    if added_rev <= rev: removed.append(item_id) # Unknown to the client otherwise
+                elif added_rev > rev:
+                    added.append(item_id)
+                else:
+                    changed.append(item_id)
+            return added, changed, removed
+
+    def stats(self):
+        with self.lock:
+            return {"epoch": self.epoch, "revision": self.revision, "entries": len(self._entries), "floor": self._floor}
+
+# Singleton Instance
+sync_log = SyncLog()
@@ -0,0 +1,106 @@
+import time
+import threading
+from contextlib import nullcontext
+
+class HighMadeCoalescer:
+    """
+    Merges HIGH_MADE notifications so a trending market does not send one
+    message per tick per trade.
+    - Per trade, only the latest high within `window` seconds is kept.
+    - When the window closes, every pending high is sent together: channels with
+      at least `digest_min` trades get one digest message, the rest normal replies.
+    - Any other event of a trade first flushes its pending high (thread order): a
+      pending high, or its line in a digest that has not gone out yet, is sent as a
+      normal reply in the trade's own outbox lane, ahead of the event.
+      The batch is handed to the outbox under the lock, so a flush never misses it.
+    window = 0 disables coalescing (HIGH_MADE is sent immediately).
+    """
+    def __init__(self, manager, window=5.0, digest_min=3):
+        self.manager = manager
+        self.window = window
+        self.digest_min = digest_min
+        self._cond = threading.Condition()
+        self._pending = {}   # trade_id -> [trade snapshot, latest high]
+        self._due = None     # when the current window closes
+        self._thread = None
+        self._app = None
+        self.counters = {"received": 0, "coalesced": 0, "sent": 0, "flushes": 0, "pulled": 0}
+
+    def configure(self, window=None, digest_min=None):
+        if window is not None: self.window = max(0.0, float(window))
+        if digest_min is not None: self.digest_min = max(2, int(digest_min))
+
+    def start(self, app, window=None, digest_min=None):
+        self._app = app
+        self.configure(window, digest_min)
+
+    def add(self, trade, extra_data):
+        """Records a new high for a trade. Never formats or sends (tick path)."""
+        price = extra_data.get('price') if isinstance(extra_data, dict) else extra_data
+        tid = trade.get('id')
+        with self._cond:
+            self.counters["received"] += 1
+            entry = self._pending.get(tid)
+            if entry:
+                entry[0] = dict(trade)
+                entry[1] = price
+                self.counters["coalesced"] += 1
+            else:
+                self._pending[tid] = [dict(trade), price]
+                if self._due is None:
+                    self._due = time.time() + self.window
+                    self._cond.notify()
+        self._ensure_thread()
+
+    def flush_trade(self, trade_id):
+        """
+        Sends a trade's pending high right away (before its next event), in the trade's
+        own lane. Never waits on the Condition (callers may hold trade_store.lock).
+        """
+        entry = None
+        if self._pending:
+            with self._cond:
+                entry = self._pending.pop(trade_id, None)
+                if entry: self.counters["sent"] += 1
+        if entry:
+            self.manager.notify_trade_event(entry[0], "HIGH_MADE", entry[1], coalesce=False)
+
+        # Its line in a queued digest would race the event's reply (different lanes)
+        pulled = self.manager.outbox.pull_from_digests(trade_id)
+        if pulled:
+            with self._cond:
+                self.counters["pulled"] += len(pulled)
+            trade, price = pulled[-1][1] # Latest high
+            self.manager.notify_trade_event(trade, "HIGH_MADE", price, channels={ch for ch, _ in pulled}, coalesce=False)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending=len(self._pending), window=self.window)
+
+    # --- Internal ---
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._due is None or self._due > time.time():
+                    self._cond.wait(None if self._due is None else self._due - time.time())
+                batch = [tuple(e) for e in self._pending.values()]
+                self._due = None
+                if not batch:
+                    continue
+                self.counters["sent"] += len(batch)
+                self.counters["flushes"] += 1
+                # Queued while holding the lock (render + enqueue, no network): a flush_trade
+                # finds each high either still pending or already in the outbox
+                try:
+                    with (self._app.app_context() if self._app else nullcontext()):
+                        self.manager.notify_high_digest(batch, self.digest_min)
+                except Exception as e:
+                    print(f"HIGH_MADE Digest Error: {e}")
+                self._pending = {}
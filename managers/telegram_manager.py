@@ -1,31 +1,104 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
+from string import Formatter
+from types import MappingProxyType
 import threading
 import settings
 import smart_trader
 from managers.common import get_time_str
 from database import db, TelegramMessage
+from managers.telegram_outbox import TelegramOutbox, PARENT, REPLY, LAZY, PLAIN
+from managers.telegram_coalescer import HighMadeCoalescer
+
+# Keep-alive connections to api.telegram.org (>= outbox workers + delete cleanup)
+HTTP_POOL_SIZE = 16
+
+# Shared default so "no templates configured" keeps the same cache key
+_NO_TEMPLATES = MappingProxyType({})
+_CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+
+def _compile_template(raw_tpl):
+    """
+    Splits a str.format template once into (literal, field, conversion, spec) parts;
+    the returned render(ctx) only looks the fields up and joins the pieces.
+    Same output and errors as raw_tpl.format_map(ctx).
+    """
+    formatter = Formatter()
+    parts = []
+    for literal, field, spec, conversion in formatter.parse(raw_tpl):
+        if field is not None and ('{' in (spec or '') or field[:1].isdigit() or not field):
+            return raw_tpl.format_map # Nested specs / positional fields: leave them to str.format
+        simple = field is not None and field.isidentifier()
+        parts.append((literal, field, simple, _CONVERSIONS.get(conversion), spec or ''))
+
+    def render(ctx):
+        out = []
+        for literal, field, simple, convert, spec in parts:
+            if literal: out.append(literal)
+            if field is None: continue
+            value = ctx[field] if simple else formatter.get_field(field, (), ctx)[0]
+            if convert: value = convert(value)
+            out.append(format(value, spec))
+        return ''.join(out)
+    return render
 
 class TelegramManager:
     def __init__(self):
         self.base_url = "https://api.telegram.org/bot"
+        self.outbox = TelegramOutbox(self)
+        self.highs = HighMadeCoalescer(self)
+        self.session = self._build_session()
+        self._tpl_cache = None       # (templates snapshot, compiled renderers)
+        self._symbol_cache = {}      # raw symbol -> Telegram display symbol
+
+    @staticmethod
+    def _build_session():
+        """Shared session: every sender thread reuses pooled TLS connections."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def _get_config(self):
-        s = settings.load_settings()
-        return s.get('telegram', {})
+        return settings.get_settings().get('telegram', {})
 
-    def _format_msg(self, template_key, trade, extra_data=None, action_time=None):
+    # --- TEMPLATES ---
+    def _templates(self):
         """
-        Helper: Formats message strings based on settings.py templates.
-        Supports GLOBAL Placeholders for all messages.
+        Compiled renderers (template_key -> render(ctx)), rebuilt only when a
+        new settings snapshot (version) is installed.
+        """
+        templates = self._get_config().get('templates', _NO_TEMPLATES)
+        cache = self._tpl_cache
+        if cache is not None and cache[0] is templates:
+            return cache[1]
+
+        compiled = {}
+        for key, raw_tpl in templates.items():
+            if not raw_tpl: continue
+            try:
+                compiled[key] = _compile_template(raw_tpl)
+            except ValueError as e:
+                print(f"Template Error ({key}): {e}")
+                compiled[key] = lambda ctx, key=key: f"Template Error: {key}"
+        self._tpl_cache = (templates, compiled)
+        return compiled
+
+    def _display_symbol(self, raw_symbol):
+        sym = self._symbol_cache.get(raw_symbol)
+        if sym is None:
+            if len(self._symbol_cache) > 5000: self._symbol_cache.clear()
+            sym = self._symbol_cache[raw_symbol] = smart_trader.get_telegram_symbol(raw_symbol)
+        return sym
+
+    def _event_context(self, template_key, trade, extra_data=None, action_time=None):
+        """
+        Placeholder values for one event. Built once and shared by every channel
+        (and the FREE_HEADER). Supports GLOBAL Placeholders for all messages.
         """
-        conf = self._get_config()
-        templates = conf.get('templates', {})
-        raw_tpl = templates.get(template_key, "")
-        
-        if not raw_tpl: return None
-
         # --- GLOBAL PLACEHOLDERS (Available in ALL templates) ---
         raw_symbol = trade.get('symbol', 'Unknown')
         entry_price = float(trade.get('entry_price', 0) or 0)
@@ -37,7 +110,7 @@ class TelegramManager:
 
         data = {
             # Basic Trade Info
-            "symbol": smart_trader.get_telegram_symbol(raw_symbol),
+            "symbol": self._display_symbol(raw_symbol),
             "raw_symbol": raw_symbol,
             "mode": trade.get('mode', 'PAPER'),
             "order_type": trade.get('order_type', 'MARKET'),
@@ -88,31 +161,57 @@ class TelegramManager:
              data["exit_price"] = extra_data.get('exit_price', 0) if isinstance(extra_data, dict) else 0
              data["pnl"] = f"{extra_data.get('pnl', 0):.2f}" if isinstance(extra_data, dict) else "0.00"
 
+        return data
+
+    def _render(self, templates, template_key, ctx):
+        """Fills a compiled template. None if the template is not configured."""
+        tpl = templates.get(template_key)
+        if not tpl: return None
+
         # Perform Replacement safely
         try:
-            return raw_tpl.format(**data)
+            return tpl(ctx)
         except Exception as e:
             print(f"Template Error ({template_key}): {e}")
             return f"Template Error: {template_key}"
 
-    def send_message(self, text, reply_to_id=None, override_chat_id=None):
+    def _format_msg(self, template_key, trade, extra_data=None, action_time=None):
+        """
+        Helper: Formats message strings based on settings.py templates.
+        Supports GLOBAL Placeholders for all messages.
+        """
+        templates = self._templates()
+        if template_key not in templates: return None
+        return self._render(templates, template_key, self._event_context(template_key, trade, extra_data, action_time))
+
+    def send_message(self, text, reply_to_id=None, override_chat_id=None, trade_id=None):
         """
-        Sends a message to the configured Telegram Channel.
+        Queues a message for the configured Telegram Channel (never blocks on the network).
         Allows overriding the chat_id for specific alerts (like System Alerts).
-        Returns the Message ID of the sent message.
+        Returns a Future resolving to the Message ID once sent (None if disabled/failed).
         """
         conf = self._get_config()
         if not conf.get('enable_notifications', False):
             return None
         
-        token = conf.get('bot_token')
-        
         # Use the specific channel if provided, otherwise fallback to the default trade channel
         chat_id = override_chat_id if override_chat_id else conf.get('channel_id')
 
-        if not token or not chat_id:
+        if not conf.get('bot_token') or not chat_id:
             return None
 
+        return self.outbox.enqueue(chat_id, text, trade_id=trade_id, kind=PLAIN, reply_to=reply_to_id)
+
+    def post_message(self, chat_id, text, reply_to_id=None):
+        """
+        Blocking sendMessage call, used only by the outbox workers.
+        Returns (status, message_id, retry_after) where status is
+        'ok', 'retry' (network / 5xx / 429) or 'fail' (permanent 4xx).
+        """
+        token = self._get_config().get('bot_token')
+        if not token:
+            return "fail", None, None
+
         url = f"{self.base_url}{token}/sendMessage"
         payload = {
             "chat_id": chat_id,
@@ -121,16 +220,23 @@ class TelegramManager:
         }
         if reply_to_id:
             payload["reply_to_message_id"] = reply_to_id
+            payload["allow_sending_without_reply"] = True # Parent deleted -> still deliver
 
         try:
-            resp = requests.post(url, json=payload, timeout=5)
+            resp = self.session.post(url, json=payload, timeout=5)
             if resp.status_code == 200:
-                return resp.json().get('result', {}).get('message_id')
-            else:
-                print(f"❌ Telegram Error (Chat {chat_id}): {resp.text}")
+                return "ok", resp.json().get('result', {}).get('message_id'), None
+            print(f"❌ Telegram Error (Chat {chat_id}): {resp.text}")
+            if resp.status_code == 429:
+                try: retry_after = resp.json().get('parameters', {}).get('retry_after')
+                except Exception: retry_after = None
+                return "retry", None, retry_after or 1
+            if resp.status_code >= 500:
+                return "retry", None, None
+            return "fail", None, None
         except Exception as e:
             print(f"❌ Telegram Request Failed: {e}")
-        return None
+            return "retry", None, None
 
     def notify_system_event(self, event_type, message=""):
         """
@@ -153,27 +259,15 @@ class TelegramManager:
         # Format the message
         text = f"{icon} <b>SYSTEM ALERT: {event_type}</b>\n{message}\nTime: {get_time_str()}"
         
-        # Send immediately using the system channel (if configured) or default
+        # Queue for the system channel (if configured) or default
         self.send_message(text, override_chat_id=sys_channel_id)
 
-    def notify_trade_event(self, trade, event_type, extra_data=None):
+    def _channel_routes(self, conf, trade, event_type):
         """
-        Constructs and sends notifications to ALL configured channels based on rules.
+        Channel rules for one trade event.
+        Returns [(channel, kind, has_thread)] for every channel the event goes to,
+        where kind is PARENT / LAZY / REPLY (see telegram_outbox).
         """
-        conf = self._get_config()
-        if not conf.get('enable_notifications', False):
-            return {}
-
-        # --- NEW: Check Individual Event Toggle ---
-        toggles = conf.get('event_toggles', {})
-        # If key is missing, default to True (Safe Default)
-        if not toggles.get(event_type, True): 
-            return {}
-        # ------------------------------------------
-
-        raw_symbol = trade.get('symbol', 'Unknown')
-        symbol = smart_trader.get_telegram_symbol(raw_symbol)
-        
         # --- THREAD IDS ---
         if 'telegram_msg_ids' not in trade or not isinstance(trade['telegram_msg_ids'], dict):
             trade['telegram_msg_ids'] = {}
@@ -183,16 +277,6 @@ class TelegramManager:
         
         stored_ids = trade['telegram_msg_ids']
 
-        # --- DETERMINE ACTION TIME ---
-        action_time = get_time_str() 
-        if isinstance(extra_data, dict) and 'time' in extra_data:
-            action_time = extra_data['time']
-        elif event_type == "NEW_TRADE" and trade.get('entry_time'):
-            action_time = trade.get('entry_time')
-            
-        # Entry time for Header
-        entry_time_str = trade.get('entry_time', action_time)
-
         # --- DEFINE CHANNELS ---
         all_channels = [
             {'key': 'main', 'id': conf.get('channel_id'), 'allow_all': True},
@@ -208,9 +292,7 @@ class TelegramManager:
         # User Selection (e.g., ['vip'])
         target_list = trade.get('target_channels') 
 
-        new_msg_ids = {} 
-
-        # Loop through channels
+        routes = []
         for ch in all_channels:
             key = ch['key']
             chat_id = ch['id']
@@ -251,56 +333,197 @@ class TelegramManager:
                     continue
             
             # --- THREAD MANAGEMENT ---
-            reply_to = stored_ids.get(key)
-            is_new_thread_start = False
+            # Reply targets are resolved by the outbox at send time, so a reply queued
+            # right behind its NEW_TRADE parent still threads correctly.
+            has_thread = bool(stored_ids.get(key)) or self.outbox.has_thread(trade.get('id'), chat_id)
 
             # NEW_TRADE always starts a new thread
             if event_type == "NEW_TRADE":
-                reply_to = None 
+                kind = PARENT
 
             # Special Logic for FREE Channel (Lazy Threading):
             # If we are sending a message (e.g. TARGET_HIT) but have no Thread ID yet,
             # this means we skipped the Entry (Spillover mode).
             # So this message becomes the Header/Parent.
-            if key == 'free' and not reply_to:
-                is_new_thread_start = True
+            elif key == 'free':
+                kind = LAZY
 
             # If it's a reply event (not NEW_TRADE) but we don't have a thread ID 
             # AND it's not the start of the Free Channel thread -> SKIP
-            if event_type != "NEW_TRADE" and not reply_to and not is_new_thread_start:
+            elif not has_thread:
                 continue
+            else:
+                kind = REPLY
+
+            routes.append((ch, kind, has_thread))
+        return routes
+
+    def _event_enabled(self, conf, event_type):
+        if not conf.get('enable_notifications', False):
+            return False
+        # --- NEW: Check Individual Event Toggle ---
+        # If key is missing, default to True (Safe Default)
+        return conf.get('event_toggles', {}).get(event_type, True)
+
+    @staticmethod
+    def _action_time(trade, event_type, extra_data):
+        if isinstance(extra_data, dict) and 'time' in extra_data:
+            return extra_data['time']
+        if event_type == "NEW_TRADE" and trade.get('entry_time'):
+            return trade.get('entry_time')
+        return get_time_str()
+
+    def notify_trade_event(self, trade, event_type, extra_data=None, channels=None, coalesce=True):
+        """
+        Constructs and queues notifications to ALL configured channels based on rules.
+        Channels are separate outbox lanes, so they are sent in parallel.
+        Never blocks on Telegram: returns {channel_key: Future} for messages that start
+        a thread, each resolving to the sent message ID. The outbox also writes those
+        IDs back to the trade (see record_thread_id), so callers need not wait.
+        channels: optional subset of channel keys (used by the HIGH_MADE digest).
+        HIGH_MADE is handed to the coalescer (self.highs) unless coalesce=False.
+        """
+        if event_type == "HIGH_MADE" and coalesce and self.highs.window > 0:
+            self.highs.add(trade, extra_data)
+            return {}
+
+        conf = self._get_config()
+        if not self._event_enabled(conf, event_type):
+            return {}
+
+        # Keep thread order: a pending high goes out before this trade's next event
+        if event_type != "HIGH_MADE":
+            self.highs.flush_trade(trade.get('id'))
+
+        routes = self._channel_routes(conf, trade, event_type)
+        if not routes:
+            return {}
+
+        # --- DETERMINE ACTION TIME ---
+        action_time = self._action_time(trade, event_type, extra_data)
+
+        new_msg_ids = {} 
+
+        # Message text is rendered once per event and shared by all channels
+        templates = self._templates()
+        ctx = self._event_context(event_type, trade, extra_data, action_time)
+        base_msg = self._render(templates, event_type, ctx)
+        if not base_msg: return {} # Skip if template failed or empty
+
+        for ch, kind, has_thread in routes:
+            key = ch['key']
+            if channels is not None and key not in channels: continue
 
             # --- BUILD MESSAGE CONTENT (UPDATED: USES TEMPLATE) ---
-            msg = self._format_msg(event_type, trade, extra_data, action_time)
-            
-            if not msg: continue # Skip if template failed or empty
+            msg = base_msg
 
             # Add Channel Name prefix for NEW_TRADE if configured
             if event_type == "NEW_TRADE" and ch.get('custom_name'):
                 msg = f"🚀 <b>[{ch['custom_name']}]</b>\n" + msg
 
             # --- FREE CHANNEL HEADER INJECTION (TEMPLATE BASED) ---
-            # If this is the start of a thread (e.g. T1 hit in Spillover mode), inject Header.
-            if is_new_thread_start and key == 'free' and event_type != "NEW_TRADE":
-                header = self._format_msg("FREE_HEADER", trade, extra_data, action_time)
-                if header:
-                    msg = header + msg
-
-            # --- SEND & SAVE ---
-            if msg:
-                sent_id = self.send_message(msg, reply_to_id=reply_to, override_chat_id=chat_id)
-                if sent_id:
-                    self._save_msg_to_db(trade.get('id'), sent_id, chat_id)
-                    
-                    # If NEW_TRADE or First Free Msg, update stored IDs
-                    if event_type == "NEW_TRADE" or is_new_thread_start:
-                        new_msg_ids[key] = sent_id
-                        # Update trade object for persistence
-                        trade['telegram_msg_ids'][key] = sent_id
+            # Used only if this message ends up starting the thread (e.g. T1 hit in Spillover mode).
+            alt_msg = None
+            if kind == LAZY:
+                header = self._render(templates, "FREE_HEADER", ctx)
+                alt_msg = (header + msg) if header else msg
+
+            # --- QUEUE ---
+            fut = self.outbox.enqueue(ch['id'], msg, trade_id=trade.get('id'), channel=key, kind=kind, alt_text=alt_msg)
+            if kind == PARENT or (kind == LAZY and not has_thread):
+                new_msg_ids[key] = fut
 
         return new_msg_ids
 
-    def _save_msg_to_db(self, trade_id, msg_id, chat_id):
+    def notify_high_digest(self, entries, digest_min):
+        """
+        Sends coalesced HIGH_MADE updates ([(trade, price)], one per trade).
+        Per channel, threads that already exist are merged into one digest message
+        once there are at least `digest_min` of them; the rest go out as normal replies.
+        """
+        conf = self._get_config()
+        if not self._event_enabled(conf, "HIGH_MADE"):
+            return
+
+        templates = self._templates()
+        by_channel = {}   # key -> (channel, [(trade, price, ctx)])
+        singles = {}      # trade_id -> (trade, price, {channel keys})
+        for trade, price in entries:
+            ctx = None
+            for ch, kind, has_thread in self._channel_routes(conf, trade, "HIGH_MADE"):
+                if has_thread:
+                    if ctx is None:
+                        ctx = self._event_context("HIGH_MADE", trade, price, self._action_time(trade, "HIGH_MADE", price))
+                    by_channel.setdefault(ch['key'], (ch, []))[1].append((trade, price, ctx))
+                else:
+                    singles.setdefault(trade.get('id'), (trade, price, set()))[2].add(ch['key']) # Free thread start
+
+        for key, (ch, items) in by_channel.items():
+            if len(items) < digest_min:
+                for trade, price, _ in items:
+                    singles.setdefault(trade.get('id'), (trade, price, set()))[2].add(key)
+                continue
+            members = {trade.get('id'): (self._render(templates, "HIGH_DIGEST_LINE", ctx) or
+                                         f"• <b>{ctx['symbol']}</b>: {ctx['price']} (P&L {ctx['pot_pnl']})", (trade, price))
+                       for trade, price, ctx in items}
+            head = f"📈 <b>NEW HIGHS ({{count}} trades)</b>\nTime: {items[-1][2]['time']}"
+            # Trades with messages still queued in this chat go out as normal replies instead
+            for trade, price in self.outbox.enqueue_digest(ch['id'], head, members, channel=key, min_members=digest_min):
+                singles.setdefault(trade.get('id'), (trade, price, set()))[2].add(key)
+
+        for trade, price, keys in singles.values():
+            self.notify_trade_event(trade, "HIGH_MADE", price, channels=keys, coalesce=False)
+
+    # --- OUTBOX CALLBACKS (run in outbox worker threads) ---
+    def stored_thread_id(self, trade_id, channel):
+        """Thread parent for a channel as stored on the trade (active first, then history)."""
+        if not trade_id or not channel:
+            return None
+        from managers.trade_store import store as trade_store
+        from managers.persistence import get_history_trade
+
+        with trade_store.lock:
+            trade = trade_store.get(trade_id)
+            if trade:
+                return self._thread_id_of(trade, channel)
+        trade = get_history_trade(trade_id)
+        return self._thread_id_of(trade, channel) if trade else None
+
+    @staticmethod
+    def _thread_id_of(trade, channel):
+        ids = trade.get('telegram_msg_ids')
+        if isinstance(ids, dict) and ids.get(channel):
+            return ids[channel]
+        return trade.get('telegram_msg_id') if channel == 'main' else None
+
+    def record_thread_id(self, trade_id, channel, msg_id):
+        """Writes a newly started thread's message ID back to the trade (active or history)."""
+        from managers.trade_store import store as trade_store
+        from managers.persistence import get_history_trade, save_to_history_db
+
+        try:
+            with trade_store.lock:
+                trade = trade_store.get(trade_id)
+                if trade:
+                    self._set_thread_id(trade, channel, msg_id)
+                    trade_store.mark_dirty(trade['id'])
+                    return
+            trade = get_history_trade(trade_id)
+            if trade:
+                self._set_thread_id(trade, channel, msg_id)
+                save_to_history_db(trade)
+        except Exception as e:
+            print(f"⚠️ Failed to record Telegram thread ID: {e}")
+
+    @staticmethod
+    def _set_thread_id(trade, channel, msg_id):
+        if not isinstance(trade.get('telegram_msg_ids'), dict):
+            trade['telegram_msg_ids'] = {}
+        trade['telegram_msg_ids'][channel] = msg_id
+        if channel == 'main' or not trade.get('telegram_msg_id'):
+            trade['telegram_msg_id'] = msg_id # Legacy fallback
+
+    def save_msg_to_db(self, trade_id, msg_id, chat_id):
         """Helper to safely save message ID to database"""
         if not trade_id or not msg_id or not chat_id:
             return
@@ -317,10 +540,13 @@ class TelegramManager:
     def delete_trade_messages(self, trade_id):
         """
         Deletes messages associated with a trade from the database immediately,
-        then spawns a background thread to call the Telegram API for cleanup.
-        Prevents Worker Timeout on slow network calls.
+        then spawns a background thread to call the Telegram API for cleanup
+        (over the shared keep-alive session). Prevents Worker Timeout on slow network calls.
         """
         try:
+            # 0. Nothing more should go out for this trade
+            self.outbox.discard_trade(trade_id)
+
             # 1. Fetch messages
             messages = TelegramMessage.query.filter_by(trade_id=str(trade_id)).all()
             if not messages: return
@@ -340,7 +566,7 @@ class TelegramManager:
                 delete_url = f"{self.base_url}{token}/deleteMessage"
                 for item in items:
                     try:
-                        requests.post(delete_url, json=item, timeout=5)
+                        self.session.post(delete_url, json=item, timeout=5)
                         # Small sleep to prevent rate limiting if many messages
                         time.sleep(0.1) 
                     except Exception as req_err:
@@ -0,0 +1,399 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from database import db, OutboxMessage
+
+# Item kinds
+PARENT = "PARENT"   # Starts a thread (NEW_TRADE): its message id becomes the reply target
+REPLY = "REPLY"     # Needs the thread parent; skipped if the thread never started
+LAZY = "LAZY"       # Free channel: reply if a thread exists, else send alt_text and start it
+PLAIN = "PLAIN"     # Standalone message (system alerts, reports)
+DIGEST = "DIGEST"   # Standalone message merging one line per trade (HIGH_MADE digest)
+
+class OutboxItem:
+    __slots__ = ('trade_id', 'chat_id', 'channel', 'kind', 'text', 'alt_text', 'reply_to',
+                 'created_at', 'row_id', 'attempts', 'due', 'done', 'future', 'sending', 'head', 'members')
+
+    def __init__(self, trade_id, chat_id, channel, kind, text, alt_text=None, reply_to=None, created_at=None, row_id=None):
+        self.trade_id = str(trade_id) if trade_id else None
+        self.chat_id = str(chat_id)
+        self.channel = channel
+        self.kind = kind
+        self.text = text
+        self.alt_text = alt_text
+        self.reply_to = reply_to
+        self.created_at = created_at or time.time()
+        self.row_id = row_id
+        self.attempts = 0
+        self.due = 0.0
+        self.done = False
+        self.future = Future()
+        self.sending = False
+        self.head = None     # DIGEST: header format string with {count}
+        self.members = None  # DIGEST: trade_id -> (line, payload), until the digest goes out
+
+    def render_digest(self):
+        lines = [line for line, _ in self.members.values()]
+        self.text = self.head.format(count=len(lines)) + "\n" + "\n".join(lines)
+
+class Lane:
+    """FIFO of one thread in one chat. Only its head is ever in flight."""
+    __slots__ = ('items', 'busy', 'parent_id')
+
+    def __init__(self):
+        self.items = deque()
+        self.busy = False
+        self.parent_id = None
+
+class TelegramOutbox:
+    """
+    Persistent, rate-limited Telegram send queue.
+
+    - Lanes: one per (trade thread, chat). Items in a lane go out strictly in
+      order, so replies always land after their NEW_TRADE parent; different
+      lanes are sent in parallel by the worker pool.
+    - Rate limits: at most `chat_rate` msgs/sec per chat and `global_rate`
+      msgs/sec overall; a 429 pauses the chat for Telegram's retry_after.
+    - Retries: network errors, 5xx and 429 are retried with exponential backoff.
+    - Persistence: undelivered items are written to the OutboxMessage table by a
+      background flusher and reloaded on start, so a restart does not lose them.
+    - Parents: reply targets are resolved when the item is sent (lane parent, else
+      the ids stored on the trade), never when it is queued.
+    - Digests: a DIGEST item merges lines of several trades into one chat message.
+      Until it goes out, a trade's line can be pulled back (pull_from_digests) and
+      sent in the trade's own lane; once it is being sent, that trade's lane in the
+      same chat waits for it, so the trade's next reply never lands before its line.
+    """
+    def __init__(self, manager, workers=4, chat_rate=1.0, global_rate=30.0, max_retries=5):
+        self.manager = manager
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._lanes = {}          # (trade_id or chat_id, chat_id) -> Lane
+        self._digests = {}        # (trade_id, chat_id) lane key -> unsent DIGEST items with a line of that trade
+        self._chat_next = {}      # chat_id -> earliest next send time
+        self._global_tokens = global_rate
+        self._global_stamp = time.monotonic()
+        self._unsaved = []        # items not yet written to the outbox table
+        self._finished = []       # persisted items whose rows can be deleted
+        self._retext = []         # persisted digests whose text changed (lines pulled)
+        self._threads = []
+        self._app = None
+        self.counters = {"queued": 0, "sent": 0, "skipped": 0, "failed": 0, "retried": 0, "rate_limited": 0}
+
+    # --- Lifecycle ---
+    def start(self, app, workers=None, chat_rate=None, global_rate=None, max_retries=None):
+        """Reloads undelivered rows and starts the sender pool + flusher (call once)."""
+        self._app = app
+        if workers: self.workers = workers
+        if chat_rate: self.chat_rate = chat_rate
+        if global_rate: self.global_rate = global_rate
+        if max_retries is not None: self.max_retries = max_retries
+        if self._threads:
+            return
+
+        with app.app_context():
+            try:
+                rows = OutboxMessage.query.order_by(OutboxMessage.id).all()
+                with self._cond:
+                    for r in rows:
+                        self._add(OutboxItem(r.trade_id, r.chat_id, r.channel, r.kind, r.text,
+                                             r.alt_text, r.reply_to, r.created_at, row_id=r.id))
+                if rows:
+                    print(f"📨 Telegram Outbox: Resuming {len(rows)} undelivered messages.")
+            except Exception as e:
+                print(f"Telegram Outbox Load Error: {e}")
+
+        for _ in range(self.workers):
+            th = threading.Thread(target=self._run_sender, daemon=True)
+            th.start()
+            self._threads.append(th)
+        th = threading.Thread(target=self._run_flusher, daemon=True)
+        th.start()
+        self._threads.append(th)
+
+    # --- Producer Side (never blocks on the network) ---
+    def enqueue(self, chat_id, text, trade_id=None, channel=None, kind=PLAIN, alt_text=None, reply_to=None):
+        """Queues a message. Returns a Future resolving to the sent message id (or None)."""
+        item = OutboxItem(trade_id, chat_id, channel, kind, text, alt_text, reply_to)
+        with self._cond:
+            self._add(item)
+            self._unsaved.append(item)
+            self.counters["queued"] += 1
+            self._cond.notify()
+        if not self._threads:
+            print("⚠️ Telegram Outbox not started: message queued until start().")
+        return item.future
+
+    def enqueue_digest(self, chat_id, head, members, channel=None, min_members=2):
+        """
+        Queues one DIGEST message from members {trade_id: (line, payload)}.
+        Trades with messages still queued in this chat are left out (their line would
+        overtake them); they are returned as [payload] for the caller to send normally.
+        If fewer than min_members remain, nothing is queued and every payload is returned.
+        """
+        with self._cond:
+            keep, rest = {}, []
+            for tid, (line, payload) in members.items():
+                if self._lanes.get(self._lane_key(tid, chat_id)):
+                    rest.append(payload)
+                else:
+                    keep[str(tid)] = (line, payload)
+            if len(keep) < min_members:
+                return rest + [payload for _, payload in keep.values()]
+
+            item = OutboxItem(None, chat_id, channel, DIGEST, None)
+            item.head, item.members = head, keep
+            item.render_digest()
+            for tid in keep:
+                self._digests.setdefault(self._lane_key(tid, chat_id), set()).add(item)
+            self._add(item)
+            self._unsaved.append(item)
+            self.counters["queued"] += 1
+            self._cond.notify()
+        return rest
+
+    def pull_from_digests(self, trade_id):
+        """
+        Takes a trade's lines out of digests that have not started sending.
+        Returns [(channel, payload)], oldest digest first, for the caller to send
+        in the trade's own lane.
+        """
+        if not self._digests:
+            return []
+        pulled, emptied = [], []
+        with self._cond:
+            for key in [k for k in self._digests if k[0] == str(trade_id)]:
+                for item in list(self._digests[key]):
+                    if item.sending:
+                        continue # Already going out: the trade's lane waits for it instead
+                    _, payload = item.members.pop(key[0])
+                    pulled.append((item.created_at, item.channel, payload))
+                    self._unhold(key, item)
+                    if item.members:
+                        item.render_digest()
+                        if item.row_id is not None:
+                            self._retext.append(item)
+                    else:
+                        emptied.append(item)
+            for item in emptied:
+                key = self._lane_key(None, item.chat_id)
+                lane = self._lanes.get(key)
+                if lane and item in lane.items:
+                    lane.items.remove(item)
+                    if not lane.items and not lane.busy:
+                        del self._lanes[key]
+                item.done = True
+                if item.row_id is not None:
+                    self._finished.append(item)
+            self._cond.notify_all()
+        for item in emptied:
+            item.future.set_result(None)
+        return [(ch, payload) for _, ch, payload in sorted(pulled, key=lambda p: p[0])]
+
+    def has_thread(self, trade_id, chat_id):
+        """True if a thread parent for this trade/chat is queued or just went out."""
+        with self._cond:
+            lane = self._lanes.get(self._lane_key(trade_id, chat_id))
+            if not lane: return False
+            return bool(lane.parent_id) or any(i.kind in (PARENT, LAZY) for i in lane.items)
+
+    def discard_trade(self, trade_id):
+        """Drops queued (not in-flight) messages of a deleted trade."""
+        dropped = []
+        with self._cond:
+            for key in [k for k in self._lanes if k[0] == str(trade_id)]:
+                lane = self._lanes[key]
+                keep = deque([lane.items[0]]) if lane.busy and lane.items else deque()
+                dropped.extend(i for i in lane.items if i not in keep)
+                lane.items = keep
+                if not keep:
+                    del self._lanes[key]
+            for i in dropped:
+                i.done = True
+                if i.row_id is not None:
+                    self._finished.append(i)
+        for i in dropped:
+            i.future.set_result(None)
+        return len(dropped)
+
+    def stats(self):
+        with self._cond:
+            depth = sum(len(l.items) for l in self._lanes.values())
+            return dict(self.counters, depth=depth, lanes=len(self._lanes), unsaved=len(self._unsaved))
+
+    # --- Internal: Scheduling ---
+    @staticmethod
+    def _lane_key(trade_id, chat_id):
+        return (str(trade_id) if trade_id else f"chat:{chat_id}", str(chat_id))
+
+    def _add(self, item):
+        key = self._lane_key(item.trade_id, item.chat_id)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = Lane()
+        lane.items.append(item)
+
+    def _unhold(self, key, item):
+        """Called with the lock held: the digest no longer blocks the lane `key`."""
+        held = self._digests.get(key)
+        if held:
+            held.discard(item)
+            if not held:
+                del self._digests[key]
+
+    def _take_global_token(self, now_mono):
+        self._global_tokens = min(self.global_rate, self._global_tokens + (now_mono - self._global_stamp) * self.global_rate)
+        self._global_stamp = now_mono
+        if self._global_tokens >= 1:
+            self._global_tokens -= 1
+            return 0.0
+        return (1 - self._global_tokens) / self.global_rate
+
+    def _next_ready(self):
+        """Called with the lock held. Returns (key, lane, item) or the seconds to wait."""
+        now = time.time()
+        wake = None
+        for key, lane in self._lanes.items():
+            if lane.busy or not lane.items or key in self._digests:
+                continue # key in _digests: a digest holding this trade's line goes first
+            item = lane.items[0]
+            ready_at = max(item.due, self._chat_next.get(item.chat_id, 0.0))
+            if ready_at <= now:
+                wait = self._take_global_token(time.monotonic())
+                if wait > 0:
+                    return wait
+                lane.busy = True
+                item.sending = True
+                self._chat_next[item.chat_id] = now + 1.0 / self.chat_rate
+                return (key, lane, item)
+            wake = ready_at - now if wake is None else min(wake, ready_at - now)
+        return wake
+
+    def _run_sender(self):
+        while True:
+            with self._cond:
+                while True:
+                    nxt = self._next_ready()
+                    if isinstance(nxt, tuple):
+                        break
+                    self._cond.wait(nxt)
+                key, lane, item = nxt
+                parent_id = lane.parent_id
+
+            try:
+                with self._app.app_context():
+                    self._deliver(key, lane, item, parent_id)
+            except Exception as e:
+                print(f"Telegram Outbox Worker Error: {e}")
+                self._finish(key, lane, item, None, "failed")
+
+    # --- Internal: Delivery ---
+    def _deliver(self, key, lane, item, parent_id):
+        text, reply_to, starts_thread = item.text, item.reply_to, False
+
+        if item.kind in (REPLY, LAZY):
+            parent_id = parent_id or self.manager.stored_thread_id(item.trade_id, item.channel)
+            if parent_id:
+                reply_to = parent_id
+            elif item.kind == LAZY:
+                text, starts_thread = (item.alt_text or item.text), True
+            else:
+                return self._finish(key, lane, item, None, "skipped") # Parent never made it
+        elif item.kind == PARENT:
+            starts_thread = True
+
+        status, msg_id, retry_after = self.manager.post_message(item.chat_id, text, reply_to)
+
+        if status == "ok":
+            if starts_thread:
+                lane.parent_id = msg_id
+                if item.trade_id and item.channel:
+                    self.manager.record_thread_id(item.trade_id, item.channel, msg_id)
+            if item.trade_id:
+                self.manager.save_msg_to_db(item.trade_id, msg_id, item.chat_id)
+            return self._finish(key, lane, item, msg_id, "sent")
+
+        if status == "retry" and item.attempts < self.max_retries:
+            with self._cond:
+                item.attempts += 1
+                item.due = time.time() + (retry_after or min(60, 2 ** item.attempts))
+                if retry_after:
+                    # Telegram asked this chat to slow down
+                    self._chat_next[item.chat_id] = max(self._chat_next.get(item.chat_id, 0.0), item.due)
+                    self.counters["rate_limited"] += 1
+                self.counters["retried"] += 1
+                lane.busy = False
+                item.sending = False
+                self._cond.notify_all()
+            return
+
+        self._finish(key, lane, item, None, "failed")
+
+    def _finish(self, key, lane, item, msg_id, outcome):
+        with self._cond:
+            if lane.items and lane.items[0] is item:
+                lane.items.popleft()
+            lane.busy = False
+            item.done = True
+            if item.row_id is not None:
+                self._finished.append(item)
+            for tid in (item.members or ()):
+                self._unhold(self._lane_key(tid, item.chat_id), item)
+            self.counters[outcome] += 1
+            if not lane.items and self._lanes.get(key) is lane:
+                del self._lanes[key] # Parent is on the trade now (record_thread_id)
+            self._cond.notify_all()
+        item.future.set_result(msg_id)
+
+    # --- Internal: Persistence ---
+    def _run_flusher(self):
+        while True:
+            time.sleep(0.5)
+            try:
+                with self._app.app_context():
+                    self._flush()
+                    db.session.remove()
+            except Exception as e:
+                print(f"Telegram Outbox Flush Error: {e}")
+
+    def _flush(self):
+        with self._cond:
+            new = [i for i in self._unsaved if not i.done]
+            self._unsaved = []
+            finished, self._finished = self._finished, []
+            retext = [(i, i.text) for i in self._retext if not i.done]
+            self._retext = []
+        if not new and not finished and not retext:
+            return
+        try:
+            rows = []
+            for i in new:
+                r = OutboxMessage(trade_id=i.trade_id, chat_id=i.chat_id, channel=i.channel, kind=i.kind,
+                                   text=i.text, alt_text=i.alt_text, reply_to=i.reply_to, created_at=i.created_at)
+                db.session.add(r)
+                rows.append((i, r))
+            ids = [i.row_id for i in finished]
+            if ids:
+                OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).delete(synchronize_session=False)
+            for i, text in retext:
+                OutboxMessage.query.filter_by(id=i.row_id).update({'text': text}, synchronize_session=False)
+            db.session.commit()
+
+            # Items that finished while being written: delete on the next flush
+            with self._cond:
+                for i, r in rows:
+                    i.row_id = r.id
+                    if i.done:
+                        self._finished.append(i)
+        except Exception as e:
+            print(f"Telegram Outbox Persist Error: {e}")
+            db.session.rollback()
+            with self._cond:
+                self._unsaved = new + self._unsaved
+                self._finished = finished + self._finished
+                self._retext = [i for i, _ in retext] + self._retext
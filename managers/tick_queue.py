@@ -0,0 +1,86 @@
+import time
+import threading
+
+class TickQueue:
+    """
+    Bounded, per-token conflating buffer between the KiteTicker callback
+    thread (producer) and the risk worker (consumer).
+
+    While a token waits to be drained, newer ticks overwrite its last price
+    but the high/low seen since the last drain are kept, so the worker can
+    still see every SL or target the price crossed in between.
+    The bound is on distinct tokens; ticks for a new token beyond it are dropped.
+    """
+    def __init__(self, max_tokens=5000):
+        self.max_tokens = max_tokens
+        self._cond = threading.Condition()
+        self._pending = {}     # token -> {'instrument_token', 'last_price', 'high', 'low', 'ts'}
+
+        # Counters (monotonic since start)
+        self.received = 0      # raw ticks handed in by the ticker
+        self.conflated = 0     # ticks merged into an entry already waiting
+        self.dropped = 0       # ticks rejected because the buffer was full
+        self.delivered = 0     # entries handed to the worker
+        self.batches = 0
+        self.max_depth = 0
+        self.last_wait_ms = 0.0  # age of the oldest entry in the last batch
+
+    def put(self, ticks):
+        """Producer side: O(1) per tick, never blocks on processing."""
+        now = time.time()
+        with self._cond:
+            for tk in ticks:
+                self.received += 1
+                try:
+                    token = int(tk['instrument_token'])
+                    ltp = tk['last_price']
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+                cur = self._pending.get(token)
+                if cur is not None:
+                    cur['last_price'] = ltp
+                    if ltp > cur['high']: cur['high'] = ltp
+                    if ltp < cur['low']: cur['low'] = ltp
+                    self.conflated += 1
+                elif len(self._pending) >= self.max_tokens:
+                    self.dropped += 1
+                else:
+                    self._pending[token] = {'instrument_token': token, 'last_price': ltp, 'high': ltp, 'low': ltp, 'ts': now}
+
+            depth = len(self._pending)
+            if depth > self.max_depth: self.max_depth = depth
+            self._cond.notify()
+
+    def drain(self, timeout=1.0):
+        """Consumer side: waits up to `timeout` for ticks, then takes everything pending."""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            if not self._pending:
+                return []
+            batch, self._pending = list(self._pending.values()), {}
+            self.delivered += len(batch)
+            self.batches += 1
+
+        self.last_wait_ms = round((time.time() - min(e['ts'] for e in batch)) * 1000, 2)
+        return batch
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._pending)
+        return {
+            "depth": depth,
+            "max_depth": self.max_depth,
+            "capacity": self.max_tokens,
+            "received": self.received,
+            "delivered": self.delivered,
+            "conflated": self.conflated,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "conflation_ratio": round(self.received / self.delivered, 2) if self.delivered else 0.0,
+            "last_wait_ms": self.last_wait_ms
+        }
+
+# Singleton Instance
+tick_queue = TickQueue()
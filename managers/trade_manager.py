@@ -1,9 +1,11 @@
 import time
 import copy
 import smart_trader
-from managers.persistence import load_trades, save_trades
+from managers.persistence import load_trades, save_trade, delete_active_trade, save_to_history_db
+from managers.trade_store import store as trade_store
 from managers.common import get_time_str, log_event
 from managers import broker_ops
+from managers.sl_sync import sl_sync
 from managers.telegram_manager import bot as telegram_bot
 
 def create_trade_direct(kite, mode, specific_symbol, quantity, sl_points, custom_targets, order_type, limit_price=0, target_controls=None, trailing_sl=0, sl_to_entry=0, exit_multiplier=1, target_channels=None, risk_ratios=None):
@@ -194,19 +196,15 @@ def create_trade_direct(kite, mode, specific_symbol, quantity, sl_points, custom
             "logs": logs
         }
         
+        print(f"[DEBUG] Saving new trade. Active count: {len(trades) + 1}")
+        save_trade(record)
+        # `record` is now the live trade: the risk engine may change it from here on
+        with trade_store.lock:
+            record = copy.deepcopy(record)
+
         # --- SEND TELEGRAM NOTIFICATION ---
-        msg_ids = telegram_bot.notify_trade_event(record, "NEW_TRADE")
-        if msg_ids:
-            record['telegram_msg_ids'] = msg_ids
-            if isinstance(msg_ids, dict):
-                record['telegram_msg_id'] = msg_ids.get('main')
-            else:
-                record['telegram_msg_id'] = msg_ids
-        
-        print(f"[DEBUG] Appending trade to list. Previous count: {len(trades)}")
-        trades.append(record)
-        print(f"[DEBUG] Saving list. New count: {len(trades)}")
-        save_trades(trades)
+        # Queued after the save: the outbox writes the thread IDs back to the stored trade
+        telegram_bot.notify_trade_event(record, "NEW_TRADE")
         print(f"[DEBUG] Trade Creation Successful.")
         return {"status": "success", "trade": record}
             
@@ -218,220 +216,229 @@ def update_trade_protection(kite, trade_id, sl, targets, trailing_sl=0, entry_pr
     """
     Updates the protection parameters (SL, Targets, Trailing) for an existing trade.
     Also syncs the changes to the broker if the trade is LIVE.
+    The live trade is edited in place under the store lock (the broker call runs
+    outside it), so changes the risk engine made meanwhile are kept.
     """
-    trades = load_trades()
-    updated = False
-    
-    for t in trades:
-        if str(t['id']) == str(trade_id):
-            entry_msg = ""
-            
-            # Update Entry Price (Only allowed if PENDING)
-            if entry_price is not None:
-                if t['status'] == 'PENDING':
-                    new_entry = float(entry_price)
-                    if new_entry != t['entry_price']:
-                        t['entry_price'] = new_entry
-                        entry_msg = f" | Entry Updated to {new_entry}"
-            
-            final_trailing_sl = float(trailing_sl) if trailing_sl else 0
-            if final_trailing_sl == -1.0:
-                calc_diff = t['entry_price'] - float(sl)
-                final_trailing_sl = max(0.0, calc_diff)
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t: return False
+        is_live, sl_order_id = t['mode'] == 'LIVE', t.get('sl_order_id')
 
-            t['sl'] = float(sl)
-            t['trailing_sl'] = final_trailing_sl
-            t['sl_to_entry'] = int(sl_to_entry)
-            t['exit_multiplier'] = int(exit_multiplier) 
-            
-            # Modify Broker SL if Live
-            if t['mode'] == 'LIVE' and t.get('sl_order_id'):
-                try:
-                    broker_ops.modify_order(
-                        kite, 
-                        order_id=t['sl_order_id'], 
-                        trigger_price=t['sl']
-                    )
-                    entry_msg += " [Broker SL Updated]"
-                except Exception as e: 
-                    entry_msg += f" [Broker SL Fail: {e}]"
+    # Modify Broker SL if Live
+    broker_msg, broker_ok = "", False
+    if is_live and sl_order_id:
+        # A manual SL wins over any trailing change still waiting to be sent
+        sl_sync.discard(sl_order_id)
+        try:
+            broker_ops.modify_order(
+                kite, 
+                order_id=sl_order_id, 
+                trigger_price=float(sl)
+            )
+            broker_ok = True
+            broker_msg = " [Broker SL Updated]"
+        except Exception as e: 
+            broker_msg = f" [Broker SL Fail: {e}]"
 
-            # Recalculate Targets if Exit Multiplier Changed
-            if exit_multiplier > 1:
-                eff_entry = t['entry_price']
-                eff_sl_points = eff_entry - float(sl)
-                
-                valid_custom = [x for x in targets if x > 0]
-                final_goal = max(valid_custom) if valid_custom else (eff_entry + (eff_sl_points * 2))
-                
-                dist = final_goal - eff_entry
-                new_targets = []
-                new_controls = []
-                
-                lot_size = t.get('lot_size') or smart_trader.get_lot_size(t['symbol'])
-                total_lots = t['quantity'] // lot_size
-                base_lots = total_lots // exit_multiplier
-                remainder = total_lots % exit_multiplier
-                
-                for i in range(1, exit_multiplier + 1):
-                    fraction = i / exit_multiplier
-                    t_price = eff_entry + (dist * fraction)
-                    new_targets.append(round(t_price, 2))
-                    
-                    lots_here = base_lots + (remainder if i == exit_multiplier else 0)
-                    new_controls.append({'enabled': True, 'lots': int(lots_here), 'trail_to_entry': False})
-                
-                while len(new_targets) < 3: 
-                    new_targets.append(0)
-                    new_controls.append({'enabled': False, 'lots': 0, 'trail_to_entry': False})
-                    
-                t['targets'] = new_targets
-                t['target_controls'] = new_controls
-            else:
-                t['targets'] = [float(x) for x in targets]
-                if target_controls: 
-                    t['target_controls'] = target_controls
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t: return False # Closed while the broker call was in flight
+        entry_msg = ""
+        
+        # Update Entry Price (Only allowed if PENDING)
+        if entry_price is not None:
+            if t['status'] == 'PENDING':
+                new_entry = float(entry_price)
+                if new_entry != t['entry_price']:
+                    t['entry_price'] = new_entry
+                    entry_msg = f" | Entry Updated to {new_entry}"
+        
+        final_trailing_sl = float(trailing_sl) if trailing_sl else 0
+        if final_trailing_sl == -1.0:
+            calc_diff = t['entry_price'] - float(sl)
+            final_trailing_sl = max(0.0, calc_diff)
+
+        t['sl'] = float(sl)
+        t['trailing_sl'] = final_trailing_sl
+        t['sl_to_entry'] = int(sl_to_entry)
+        t['exit_multiplier'] = int(exit_multiplier) 
+        if broker_ok and t.get('sl_order_id') == sl_order_id:
+            t['broker_sl'] = t['sl']
+        entry_msg += broker_msg
+
+        # Recalculate Targets if Exit Multiplier Changed
+        if exit_multiplier > 1:
+            eff_entry = t['entry_price']
+            eff_sl_points = eff_entry - float(sl)
+            
+            valid_custom = [x for x in targets if x > 0]
+            final_goal = max(valid_custom) if valid_custom else (eff_entry + (eff_sl_points * 2))
             
-            log_event(t, f"Manual Update: SL {t['sl']}{entry_msg}. Trailing: {t['trailing_sl']} pts. Multiplier: {exit_multiplier}x")
+            dist = final_goal - eff_entry
+            new_targets = []
+            new_controls = []
             
-            # --- TELEGRAM UPDATE ---
-            telegram_bot.notify_trade_event(t, "UPDATE")
+            lot_size = t.get('lot_size') or smart_trader.get_lot_size(t['symbol'])
+            total_lots = t['quantity'] // lot_size
+            base_lots = total_lots // exit_multiplier
+            remainder = total_lots % exit_multiplier
             
-            updated = True
-            break
+            for i in range(1, exit_multiplier + 1):
+                fraction = i / exit_multiplier
+                t_price = eff_entry + (dist * fraction)
+                new_targets.append(round(t_price, 2))
+                
+                lots_here = base_lots + (remainder if i == exit_multiplier else 0)
+                new_controls.append({'enabled': True, 'lots': int(lots_here), 'trail_to_entry': False})
+            
+            while len(new_targets) < 3: 
+                new_targets.append(0)
+                new_controls.append({'enabled': False, 'lots': 0, 'trail_to_entry': False})
+                
+            t['targets'] = new_targets
+            t['target_controls'] = new_controls
+        else:
+            t['targets'] = [float(x) for x in targets]
+            if target_controls: 
+                t['target_controls'] = target_controls
+        
+        log_event(t, f"Manual Update: SL {t['sl']}{entry_msg}. Trailing: {t['trailing_sl']} pts. Multiplier: {exit_multiplier}x")
+        trade_store.mark_dirty(trade_id)
+        notify_copy = copy.deepcopy(t)
             
-    if updated:
-        save_trades(trades)
-        return True
-    return False
+    # --- TELEGRAM UPDATE ---
+    telegram_bot.notify_trade_event(notify_copy, "UPDATE")
+    return True
 
 def manage_trade_position(kite, trade_id, action, lot_size, lots_count):
     """
     Manages position sizing: Adding lots (Averaging) or Partial Exits.
+    The live trade is edited in place under the store lock; broker orders run outside it.
     """
-    trades = load_trades()
-    updated = False
-    
-    for t in trades:
-        if str(t['id']) == str(trade_id):
-            qty_delta = lots_count * lot_size
-            ltp = smart_trader.get_ltp(kite, t['symbol'])
-            
-            # --- ADD LOTS ---
-            if action == 'ADD':
-                new_total = t['quantity'] + qty_delta
-                avg_entry = ((t['quantity'] * t['entry_price']) + (qty_delta * ltp)) / new_total
-                t['quantity'] = new_total
-                t['entry_price'] = avg_entry
-                log_event(t, f"Added {qty_delta} Qty. New Avg: {avg_entry:.2f}")
-                
-                if t['mode'] == 'LIVE':
-                    try:
-                        # Place Market Buy
-                        broker_ops.place_order(
-                            kite, 
-                            symbol=t['symbol'], 
-                            exchange=t['exchange'], 
-                            transaction_type=kite.TRANSACTION_TYPE_BUY, 
-                            quantity=qty_delta, 
-                            order_type=kite.ORDER_TYPE_MARKET, 
-                            product=kite.PRODUCT_MIS,
-                            tag="RD_ADD"
-                        )
-                        # Update Broker SL Quantity
-                        if t.get('sl_order_id'): 
-                            broker_ops.modify_order(
-                                kite, 
-                                order_id=t['sl_order_id'], 
-                                quantity=new_total
-                            )
-                    except Exception as e: 
-                        log_event(t, f"Broker Fail (Add): {e}")
-                updated = True
-                
-            # --- EXIT LOTS ---
-            elif action == 'EXIT':
-                if t['quantity'] > qty_delta:
-                    # 1. Reduce Broker SL Qty First
-                    if t['mode'] == 'LIVE': 
-                        broker_ops.manage_broker_sl(kite, t, qty_delta)
-                    
-                    t['quantity'] -= qty_delta
-                    log_event(t, f"Partial Exit {qty_delta} Qty @ {ltp}")
-                    
-                    # 2. Place Sell Order
-                    if t['mode'] == 'LIVE':
-                        try: 
-                            broker_ops.place_order(
-                                kite, 
-                                symbol=t['symbol'], 
-                                exchange=t['exchange'], 
-                                transaction_type=kite.TRANSACTION_TYPE_SELL, 
-                                quantity=qty_delta, 
-                                order_type=kite.ORDER_TYPE_MARKET, 
-                                product=kite.PRODUCT_MIS,
-                                tag="RD_EXIT_PART"
-                            )
-                        except Exception as e: 
-                            log_event(t, f"Broker Fail (Exit): {e}")
-                    updated = True
-                else: 
-                    return False 
-            break
-            
-    if updated: 
-        save_trades(trades)
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t: return True
+        symbol = t['symbol']
+
+    qty_delta = lots_count * lot_size
+    ltp = smart_trader.get_ltp(kite, symbol)
+
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t: return True
+
+        # --- ADD LOTS ---
+        if action == 'ADD':
+            new_total = t['quantity'] + qty_delta
+            avg_entry = ((t['quantity'] * t['entry_price']) + (qty_delta * ltp)) / new_total
+            t['quantity'] = new_total
+            t['entry_price'] = avg_entry
+            log_event(t, f"Added {qty_delta} Qty. New Avg: {avg_entry:.2f}")
+            trade_store.mark_dirty(trade_id)
+            order = dict(t, logs=[]) if t['mode'] == 'LIVE' else None
+
+        # --- EXIT LOTS ---
+        elif action == 'EXIT':
+            if t['quantity'] <= qty_delta:
+                return False
+            # Broker SL is reduced first, then the Market SELL (queued, see submit_exit)
+            if t['mode'] == 'LIVE':
+                broker_ops.submit_exit(kite, t, qty_delta, sl_qty_to_remove=qty_delta, tag="RD_EXIT_PART")
+            t['quantity'] -= qty_delta
+            log_event(t, f"Partial Exit {qty_delta} Qty @ {ltp}")
+            trade_store.mark_dirty(trade_id)
+            return True
+        else:
+            return True
+
+    if order:
+        try:
+            # Place Market Buy
+            broker_ops.place_order(
+                kite, 
+                symbol=order['symbol'], 
+                exchange=order['exchange'], 
+                transaction_type=kite.TRANSACTION_TYPE_BUY, 
+                quantity=qty_delta, 
+                order_type=kite.ORDER_TYPE_MARKET, 
+                product=kite.PRODUCT_MIS,
+                tag="RD_ADD"
+            )
+            # Update Broker SL Quantity
+            if order.get('sl_order_id'): 
+                broker_ops.modify_order(
+                    kite, 
+                    order_id=order['sl_order_id'], 
+                    quantity=new_total
+                )
+        except Exception as e: 
+            broker_ops.log_order_event(trade_id, f"Broker Fail (Add): {e}")
     return True
 
 def promote_to_live(kite, trade_id):
     """
     Promotes a PAPER trade to LIVE execution.
-    Places a Market Buy order and a Stop Loss order immediately.
+    Places a Market Buy order and a Stop Loss order immediately, then flips the
+    live trade to LIVE in place (under the store lock).
     """
-    trades = load_trades()
-    for t in trades:
-        if t['id'] == int(trade_id) and t['mode'] == "PAPER":
-            try:
-                # 1. Place Buy Order
-                broker_ops.place_order(
-                    kite, 
-                    symbol=t['symbol'], 
-                    exchange=t['exchange'], 
-                    transaction_type=kite.TRANSACTION_TYPE_BUY, 
-                    quantity=t['quantity'], 
-                    order_type=kite.ORDER_TYPE_MARKET, 
-                    product=kite.PRODUCT_MIS,
-                    tag="RD_PROMOTE"
-                )
-                
-                # 2. Place SL Order
-                try:
-                    sl_id = broker_ops.place_order(
-                        kite, 
-                        symbol=t['symbol'], 
-                        exchange=t['exchange'], 
-                        transaction_type=kite.TRANSACTION_TYPE_SELL, 
-                        quantity=t['quantity'], 
-                        order_type=kite.ORDER_TYPE_SL_M, 
-                        product=kite.PRODUCT_MIS, 
-                        trigger_price=t['sl'],
-                        tag="RD_SL"
-                    )
-                    t['sl_order_id'] = sl_id
-                except: 
-                    log_event(t, "Promote: Broker SL Failed")
-                    
-                t['mode'] = "LIVE"
-                t['status'] = "PROMOTED_LIVE"
-                
-                # Notify Promotion
-                telegram_bot.notify_trade_event(t, "UPDATE", "Promoted to LIVE")
-                
-                save_trades(trades)
-                return True
-            except: 
-                return False
-    return False
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t or t['mode'] != "PAPER": return False
+        order = {k: t.get(k) for k in ('symbol', 'exchange', 'quantity', 'sl')}
+
+    try:
+        # 1. Place Buy Order
+        broker_ops.place_order(
+            kite, 
+            symbol=order['symbol'], 
+            exchange=order['exchange'], 
+            transaction_type=kite.TRANSACTION_TYPE_BUY, 
+            quantity=order['quantity'], 
+            order_type=kite.ORDER_TYPE_MARKET, 
+            product=kite.PRODUCT_MIS,
+            tag="RD_PROMOTE"
+        )
+    except: 
+        return False
+
+    # 2. Place SL Order
+    sl_id, sl_msg = None, None
+    try:
+        sl_id = broker_ops.place_order(
+            kite, 
+            symbol=order['symbol'], 
+            exchange=order['exchange'], 
+            transaction_type=kite.TRANSACTION_TYPE_SELL, 
+            quantity=order['quantity'], 
+            order_type=kite.ORDER_TYPE_SL_M, 
+            product=kite.PRODUCT_MIS, 
+            trigger_price=order['sl'],
+            tag="RD_SL"
+        )
+    except: 
+        sl_msg = "Promote: Broker SL Failed"
+
+    with trade_store.lock:
+        t = trade_store.get(trade_id)
+        if not t:
+            print(f"⚠️ Promote: trade {trade_id} closed while its LIVE orders were placed")
+            return False
+        if sl_id:
+            t['sl_order_id'] = sl_id
+            t['broker_sl'] = order['sl']
+            # SL trailed while the orders were in flight: sync the broker order to it
+            if t['sl'] != order['sl']:
+                sl_sync.request(kite, t, t['sl'])
+        if sl_msg:
+            log_event(t, sl_msg)
+        t['mode'] = "LIVE"
+        t['status'] = "PROMOTED_LIVE"
+        trade_store.mark_dirty(trade_id)
+        notify_copy = copy.deepcopy(t)
+        
+    # Notify Promotion
+    telegram_bot.notify_trade_event(notify_copy, "UPDATE", "Promoted to LIVE")
+    return True
 
 def close_trade_manual(kite, trade_id):
     """
@@ -439,12 +446,15 @@ def close_trade_manual(kite, trade_id):
     Squares off position (if Live), cancels SL, and moves to history.
     """
     trades = load_trades()
-    active_list = []
-    found = False
+    found = saved = False
     
     for t in trades:
         if t['id'] == int(trade_id):
             found = True
+            if t.get('exit_type'):
+                # Already closed, only its history write failed: no second exit order
+                saved = save_to_history_db(t)
+                break
             
             # Default Exit Reason
             exit_reason = "MANUAL_EXIT"
@@ -478,10 +488,11 @@ def close_trade_manual(kite, trade_id):
                     )
                 except: pass
             
-            broker_ops.move_to_history(t, exit_reason, exit_p)
-        else:
-            active_list.append(t)
+            saved = broker_ops.move_to_history(t, exit_reason, exit_p)
+            break
     
-    if found: 
-        save_trades(active_list)
-    return found
+    if saved:
+        delete_active_trade(trade_id)
+    elif found:
+        save_trade(t) # History write failed: keep it active (closed) until the retry saves it
+    return saved
@@ -0,0 +1,225 @@
+import copy
+import json
+import atexit
+import threading
+from database import db, ActiveTrade, TradeHistory
+from managers.position_book import book as position_book
+from managers.sync_log import sync_log, POSITIONS
+
+class TradeStore:
+    """
+    Process-wide in-memory store for ACTIVE trades (single source of truth).
+    The tick path mutates trades in place under `lock` and marks them dirty;
+    a background writer flushes dirty rows to the ActiveTrade table.
+
+    Crash-safe ordering:
+    - A trade id seen for the first time is written through immediately,
+      so a live order is never only in memory.
+    - Closing a trade commits the TradeHistory row first (move_to_history),
+      the ActiveTrade delete follows on the next flush. On restart, any
+      active row that already exists in history is dropped (reconcile).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._trades = {}          # trade_id -> trade dict (live reference)
+        self._dirty = set()
+        self._deleted = set()
+        self._unrealized = {}      # trade_id -> (mode, unrealized pnl)
+        self._unrealized_total = {} # mode -> running sum of the above
+        self._unrealized_count = {} # mode -> number of trades in the sum
+        self._loaded = False
+        self._app = None
+        self._writer = None
+        self._stop = threading.Event()
+        self.flush_interval = 1.0
+
+    # --- Lifecycle ---
+    def start(self, app, interval=1.0):
+        """
+        Hydrates the store from the DB and starts the background writer.
+        """
+        self._app = app
+        self.flush_interval = max(0.1, float(interval))
+        with app.app_context():
+            self.ensure_loaded()
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run_writer, daemon=True)
+            self._writer.start()
+            atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """Stops the writer and flushes whatever is still pending."""
+        self._stop.set()
+        if self._app:
+            with self._app.app_context():
+                self.flush()
+
+    def ensure_loaded(self):
+        """Loads active trades from the DB once (requires app context)."""
+        if self._loaded:
+            return
+        with self.lock:
+            if self._loaded:
+                return
+            try:
+                rows = ActiveTrade.query.all()
+                trades = {}
+                for r in rows:
+                    t = json.loads(r.data)
+                    trades[int(t['id'])] = t
+
+                # Reconcile: trade already closed but its active row survived a crash
+                if trades:
+                    closed = {row_id for (row_id,) in db.session.query(TradeHistory.id).filter(TradeHistory.id.in_(list(trades.keys()))).all()}
+                    for tid in closed:
+                        trades.pop(tid, None)
+                        self._deleted.add(tid)
+                    if closed:
+                        print(f"🔧 Trade Store: Dropped {len(closed)} active rows already in history.")
+
+                self._trades = trades
+                position_book.reset_active(trades.values())
+                for t in trades.values():
+                    self._track_pnl(t)
+                self._loaded = True
+            except Exception as e:
+                print(f"Trade Store Load Error: {e}")
+
+    # --- Reads ---
+    def all(self):
+        """Live references. Hold `lock` while iterating or mutating."""
+        with self.lock:
+            return list(self._trades.values())
+
+    def snapshot(self):
+        """Deep copies, safe to mutate or serialize outside the lock."""
+        with self.lock:
+            return copy.deepcopy(list(self._trades.values()))
+
+    def get(self, trade_id):
+        with self.lock:
+            return self._trades.get(int(trade_id))
+
+    def __len__(self):
+        return len(self._trades)
+
+    def unrealized_pnl(self, mode):
+        """Running unrealized P&L of open trades in a mode. O(1)."""
+        return self._unrealized_total.get(mode, 0.0)
+
+    # --- Unrealized P&L Accumulator (call with lock held) ---
+    def _track_pnl(self, trade):
+        tid = int(trade['id'])
+        self._untrack_pnl(tid)
+        if trade.get('status') == 'PENDING':
+            return
+        entry = trade.get('entry_price') or 0
+        value = (trade.get('current_ltp', entry) - entry) * (trade.get('quantity') or 0)
+        mode = trade.get('mode')
+        self._unrealized[tid] = (mode, value)
+        self._unrealized_total[mode] = self._unrealized_total.get(mode, 0.0) + value
+        self._unrealized_count[mode] = self._unrealized_count.get(mode, 0) + 1
+
+    def _untrack_pnl(self, tid):
+        prev = self._unrealized.pop(tid, None)
+        if prev:
+            mode, value = prev
+            self._unrealized_total[mode] = self._unrealized_total.get(mode, 0.0) - value
+            self._unrealized_count[mode] = self._unrealized_count.get(mode, 1) - 1
+            # Reset exactly when a mode has no open trades (no float drift)
+            if self._unrealized_count[mode] <= 0:
+                self._unrealized_total[mode] = 0.0
+
+    # --- Writes ---
+    def upsert(self, trade):
+        tid = int(trade['id'])
+        with self.lock:
+            is_new = tid not in self._trades
+            self._trades[tid] = trade
+            position_book.add_active(trade)
+            self._track_pnl(trade)
+            self._dirty.add(tid)
+            self._deleted.discard(tid)
+            sync_log.record(POSITIONS, tid, added=is_new)
+        if is_new or self._writer is None:
+            self.flush()
+
+    def mark_dirty(self, trade_id):
+        with self.lock:
+            tid = int(trade_id)
+            if tid in self._trades:
+                self._track_pnl(self._trades[tid])
+                position_book.refresh_active(self._trades[tid])
+                self._dirty.add(tid)
+                sync_log.record(POSITIONS, tid)
+        if self._writer is None:
+            self.flush()
+
+    def remove(self, trade_id):
+        tid = int(trade_id)
+        with self.lock:
+            if self._trades.pop(tid, None) is not None:
+                sync_log.record(POSITIONS, tid, removed=True)
+            position_book.remove_active(tid)
+            self._untrack_pnl(tid)
+            self._dirty.discard(tid)
+            self._deleted.add(tid)
+        if self._writer is None:
+            self.flush()
+
+    def replace_all(self, trades):
+        with self.lock:
+            new_ids = {int(t['id']) for t in trades}
+            for tid in list(self._trades.keys()):
+                if tid not in new_ids:
+                    self._trades.pop(tid)
+                    position_book.remove_active(tid)
+                    self._untrack_pnl(tid)
+                    self._dirty.discard(tid)
+                    self._deleted.add(tid)
+                    sync_log.record(POSITIONS, tid, removed=True)
+            for t in trades:
+                tid = int(t['id'])
+                sync_log.record(POSITIONS, tid, added=tid not in self._trades)
+                self._trades[tid] = t
+                position_book.add_active(t)
+                self._track_pnl(t)
+                self._dirty.add(tid)
+        self.flush()
+
+    # --- Write-Behind ---
+    def flush(self):
+        """
+        Writes dirty rows and pending deletes in one transaction.
+        Rows are serialized under `lock` so a half-applied tick is never persisted.
+        """
+        from managers.persistence import write_active_rows
+
+        with self._flush_lock:
+            with self.lock:
+                if not self._dirty and not self._deleted:
+                    return True
+                dirty, self._dirty = self._dirty, set()
+                deleted, self._deleted = self._deleted, set()
+                rows = [(tid, json.dumps(self._trades[tid])) for tid in dirty if tid in self._trades]
+
+            ok = write_active_rows(rows, deleted)
+            if not ok:
+                # Re-queue without clobbering anything that changed meanwhile
+                with self.lock:
+                    self._dirty.update(tid for tid in dirty if tid in self._trades)
+                    self._deleted.update(tid for tid in deleted if tid not in self._trades)
+            return ok
+
+    def _run_writer(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                with self._app.app_context():
+                    self.flush()
+                    db.session.remove()
+            except Exception as e:
+                print(f"Trade Store Writer Error: {e}")
+
+# Singleton Instance
+store = TradeStore()
@@ -0,0 +1,145 @@
+from bisect import bisect_left, bisect_right
+
+INF = float('inf')
+EPS = 1e-9  # keeps float rounding from hiding a real crossing
+
+# Key kinds: ('A', trade_id) for active trades, ('C', trade_id) for tracked closed trades
+ACTIVE = 'A'
+CLOSED = 'C'
+
+# --- Band Calculation ---
+def active_signature(t):
+    """Everything the band of an active trade depends on."""
+    return (
+        t.get('status'), t.get('trigger_dir'), t.get('entry_price'), t.get('sl'),
+        tuple(t.get('targets') or ()), tuple(t.get('targets_hit_indices') or ()),
+        t.get('highest_ltp'), t.get('trailing_sl')
+    )
+
+def active_band(t):
+    """
+    (lower, upper) for an active trade: nothing in on_ticks can fire
+    while lower < ltp < upper.
+    - PENDING: activation price in the trigger_dir direction
+    - OPEN: SL below; next new high, next trailing step or next unhit target above
+    """
+    status = t.get('status')
+    entry = t.get('entry_price') or 0
+
+    if status == 'PENDING':
+        if t.get('trigger_dir') == 'BELOW': return (entry, INF)
+        if t.get('trigger_dir') == 'ABOVE': return (-INF, entry)
+        return (-INF, INF)
+
+    if status in ['OPEN', 'PROMOTED_LIVE']:
+        sl = t.get('sl') or 0
+        upper = t.get('highest_ltp', 0)
+
+        step = t.get('trailing_sl', 0) or 0
+        if step > 0:
+            upper = min(upper, sl + 2 * step - EPS)
+
+        # Zero-padded / below-entry targets are placeholders, not levels above the market
+        hits = t.get('targets_hit_indices', [])
+        for i, tgt in enumerate(t.get('targets') or []):
+            if i not in hits and tgt and tgt > entry:
+                upper = min(upper, tgt)
+        return (sl, upper)
+
+    return (-INF, INF)
+
+def closed_signature(t):
+    return (t.get('virtual_sl_hit', False), t.get('entry_price'), t.get('sl'), t.get('made_high'))
+
+def closed_band(t):
+    """Virtual SL and High Made thresholds of a tracked closed trade."""
+    if t.get('virtual_sl_hit', False):
+        return (-INF, INF)
+    entry = t.get('entry_price') or 0
+    sl = t.get('sl') or 0
+    high = t.get('made_high', entry)
+    if entry > sl: # BUY
+        return (sl, high)
+    return (-INF, min(sl, high)) # SELL
+
+class TriggerIndex:
+    """
+    Per-token sorted price bands ("next price of interest" in both directions).
+    candidates(token, ltp) returns only the trades whose band the price left,
+    with two bisects per token. Bands are recomputed only when the trade's
+    signature (SL, targets, status, ...) changes.
+    Not thread-safe on its own: the position book guards it with its lock.
+    """
+    def __init__(self):
+        self._lower = {}   # token -> ([lower values], [keys]) sorted by value
+        self._upper = {}   # token -> ([upper values], [keys]) sorted by value
+        self._bands = {}   # key -> (token, lower, upper, signature)
+
+    def refresh(self, key, token, trade):
+        """Re-bands a trade if its signature changed. Returns True if it moved."""
+        if key[0] == ACTIVE:
+            sig = active_signature(trade)
+        else:
+            sig = closed_signature(trade)
+
+        cur = self._bands.get(key)
+        if cur and cur[0] == token and cur[3] == sig:
+            return False
+        if cur:
+            self._unplace(key, cur)
+
+        lower, upper = active_band(trade) if key[0] == ACTIVE else closed_band(trade)
+        self._bands[key] = (token, lower, upper, sig)
+        self._place(self._lower.setdefault(token, ([], [])), lower, key)
+        self._place(self._upper.setdefault(token, ([], [])), upper, key)
+        return True
+
+    def remove(self, key):
+        cur = self._bands.pop(key, None)
+        if cur:
+            self._unplace(key, cur)
+
+    def clear(self, kind):
+        for key in [k for k in self._bands if k[0] == kind]:
+            self.remove(key)
+
+    def candidates(self, token, ltp):
+        """Keys on this token whose band was crossed (ltp <= lower or ltp >= upper)."""
+        hits = set()
+        side = self._lower.get(token)
+        if side:
+            hits.update(side[1][bisect_left(side[0], ltp):])
+        side = self._upper.get(token)
+        if side:
+            hits.update(side[1][:bisect_right(side[0], ltp)])
+        return hits
+
+    def band(self, key):
+        cur = self._bands.get(key)
+        return (cur[1], cur[2]) if cur else None
+
+    def __len__(self):
+        return len(self._bands)
+
+    # --- Internal ---
+    @staticmethod
+    def _place(side, value, key):
+        values, keys = side
+        i = bisect_right(values, value)
+        values.insert(i, value)
+        keys.insert(i, key)
+
+    def _unplace(self, key, cur):
+        token, lower, upper, _ = cur
+        for index, value in ((self._lower, lower), (self._upper, upper)):
+            side = index.get(token)
+            if not side: continue
+            values, keys = side
+            i = bisect_left(values, value)
+            while i < len(keys) and keys[i] != key:
+                i += 1
+            if i < len(keys):
+                del values[i]
+                del keys[i]
+            if not keys:
+                del index[token]
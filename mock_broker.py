@@ -85,9 +85,45 @@ t.start()
 
 # --- Mock Kite Class ---
 class MockKiteConnect:
-    def __init__(self, api_key=None, **kwargs):
+    # Same constants as kiteconnect.KiteConnect
+    VARIETY_REGULAR = "regular"
+    TRANSACTION_TYPE_BUY = "BUY"
+    TRANSACTION_TYPE_SELL = "SELL"
+    ORDER_TYPE_MARKET = "MARKET"
+    ORDER_TYPE_LIMIT = "LIMIT"
+    ORDER_TYPE_SL = "SL"
+    ORDER_TYPE_SL_M = "SL-M"
+    PRODUCT_MIS = "MIS"
+    PRODUCT_NRML = "NRML"
+
+    def __init__(self, api_key=None, latency=0.0, order_rate_limit=None, **kwargs):
+        """
+        latency: seconds each order call takes (simulated round trip)
+        order_rate_limit: max order calls per rolling second, like Kite's limit;
+                          extra calls fail with "Too many requests"
+        """
         print(f"⚠️ [MOCK BROKER] Initialized.", flush=True)
         self.mock_instruments = self._generate_instruments()
+        self.latency = latency
+        self.order_rate_limit = order_rate_limit
+        self.order_log = []   # (timestamp, method, kwargs) of every order call that went through
+        self.rejected = 0
+        self._order_lock = threading.Lock()
+        self._order_times = []
+
+    def _order_call(self, method, kwargs):
+        """Applies the simulated latency / rate limit and records the call."""
+        with self._order_lock:
+            now = time.time()
+            if self.order_rate_limit:
+                self._order_times = [ts for ts in self._order_times if now - ts < 1.0]
+                if len(self._order_times) >= self.order_rate_limit:
+                    self.rejected += 1
+                    raise Exception("Too many requests")
+                self._order_times.append(now)
+            self.order_log.append((now, method, dict(kwargs)))
+        if self.latency:
+            time.sleep(self.latency)
 
     def _generate_instruments(self):
         inst_list = []
@@ -146,16 +182,19 @@ class MockKiteConnect:
     def ltp(self, instruments): return self.quote(instruments)
 
     def place_order(self, **kwargs): 
+        self._order_call("place_order", kwargs)
         print(f"✅ [MOCK] Order Placed: {kwargs.get('tradingsymbol')}")
         return f"ORD_{random.randint(10000,99999)}"
         
     def modify_order(self, **kwargs):
+        self._order_call("modify_order", kwargs)
         print(f"✅ [MOCK] Order Modified: {kwargs.get('order_id')}")
-        return True
+        return kwargs.get('order_id')
         
     def cancel_order(self, **kwargs):
+        self._order_call("cancel_order", kwargs)
         print(f"✅ [MOCK] Order Cancelled: {kwargs.get('order_id')}")
-        return True
+        return kwargs.get('order_id')
 
     def historical_data(self, *args, **kwargs): 
         data = []
@@ -1,4 +1,8 @@
 import json
+import copy
+import time
+import threading
+from types import MappingProxyType
 from database import db, AppSetting
 
 def get_defaults():
@@ -54,61 +58,148 @@ def get_defaults():
         }
     }
 
-def load_settings():
+# --- SETTINGS CACHE ---
+# Settings change only when saved from the UI, but are read on every notification,
+# order check and monitor cycle. Reads are served from a process-wide snapshot;
+# AppSetting.version tells other worker processes when to reload.
+_lock = threading.Lock()
+_cache = None            # (version, merged dict, frozen snapshot)
+_watcher = None
+
+def _merge_defaults(saved):
     defaults = get_defaults()
-    try:
-        setting = AppSetting.query.first()
-        if setting:
-            saved = json.loads(setting.data)
-            
-            # Integrity Check
-            if "modes" not in saved:
-                old_mult = saved.get("qty_mult", 1)
-                old_ratios = saved.get("ratios", [0.5, 1.0, 1.5])
-                old_sl = saved.get("symbol_sl", {})
-                saved["modes"] = {
-                    "LIVE": {"qty_mult": old_mult, "ratios": old_ratios, "symbol_sl": old_sl.copy()},
-                    "PAPER": {"qty_mult": old_mult, "ratios": old_ratios, "symbol_sl": old_sl.copy()}
-                }
-
-            # Merge Defaults (Only LIVE and PAPER)
-            for m in ["LIVE", "PAPER"]:
-                if m in saved["modes"]:
-                    for key, val in defaults["modes"][m].items():
-                        if key not in saved["modes"][m]: saved["modes"][m][key] = val
-                    if "symbol_sl" not in saved["modes"][m]: saved["modes"][m]["symbol_sl"] = {}
-                else: saved["modes"][m] = defaults["modes"][m].copy()
-
-            if "exchanges" not in saved: saved["exchanges"] = defaults["exchanges"]
-            if "watchlist" not in saved: saved["watchlist"] = []
-            
-            # --- MERGE NEW KEY ---
-            if "broadcast_defaults" not in saved: saved["broadcast_defaults"] = defaults["broadcast_defaults"]
-            
-            if "import_config" not in saved: saved["import_config"] = defaults["import_config"]
 
-            # Merge Telegram (Recursive merge for new keys)
-            if "telegram" not in saved: 
-                saved["telegram"] = defaults["telegram"]
-            else:
-                for k, v in defaults["telegram"].items():
-                    if k not in saved["telegram"]:
-                        saved["telegram"][k] = v
+    # Integrity Check
+    if "modes" not in saved:
+        old_mult = saved.get("qty_mult", 1)
+        old_ratios = saved.get("ratios", [0.5, 1.0, 1.5])
+        old_sl = saved.get("symbol_sl", {})
+        saved["modes"] = {
+            "LIVE": {"qty_mult": old_mult, "ratios": old_ratios, "symbol_sl": old_sl.copy()},
+            "PAPER": {"qty_mult": old_mult, "ratios": old_ratios, "symbol_sl": old_sl.copy()}
+        }
+
+    # Merge Defaults (Only LIVE and PAPER)
+    for m in ["LIVE", "PAPER"]:
+        if m in saved["modes"]:
+            for key, val in defaults["modes"][m].items():
+                if key not in saved["modes"][m]: saved["modes"][m][key] = val
+            if "symbol_sl" not in saved["modes"][m]: saved["modes"][m]["symbol_sl"] = {}
+        else: saved["modes"][m] = defaults["modes"][m].copy()
+
+    if "exchanges" not in saved: saved["exchanges"] = defaults["exchanges"]
+    if "watchlist" not in saved: saved["watchlist"] = []
+    
+    # --- MERGE NEW KEY ---
+    if "broadcast_defaults" not in saved: saved["broadcast_defaults"] = defaults["broadcast_defaults"]
+    
+    if "import_config" not in saved: saved["import_config"] = defaults["import_config"]
+
+    # Merge Telegram (Recursive merge for new keys)
+    if "telegram" not in saved: 
+        saved["telegram"] = defaults["telegram"]
+    else:
+        for k, v in defaults["telegram"].items():
+            if k not in saved["telegram"]:
+                saved["telegram"][k] = v
+
+    return saved
+
+def _freeze(obj):
+    """Read-only view: dicts become MappingProxyType, lists become tuples."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    return obj
 
-            return saved
-    except Exception as e: print(f"Error loading settings: {e}")
-    return defaults
+def _install(version, data):
+    global _cache
+    _cache = (version, data, _freeze(data))
+    return _cache
+
+def _read_db():
+    """Loads (version, merged settings) from the DB (requires app context)."""
+    setting = AppSetting.query.first()
+    if not setting:
+        return 0, get_defaults()
+    return (setting.version or 0), _merge_defaults(json.loads(setting.data))
+
+def _ensure_loaded():
+    cache = _cache
+    if cache is not None:
+        return cache
+    with _lock:
+        if _cache is not None:
+            return _cache
+        try:
+            return _install(*_read_db())
+        except Exception as e:
+            print(f"Error loading settings: {e}")
+            return (None, get_defaults(), _freeze(get_defaults())) # Not cached: retried next call
+
+def get_settings():
+    """Immutable snapshot of the current settings. No DB access once loaded."""
+    return _ensure_loaded()[2]
+
+def load_settings():
+    """Mutable deep copy of the current settings (for callers that edit or serialise it)."""
+    return copy.deepcopy(_ensure_loaded()[1])
+
+def get_version():
+    return _ensure_loaded()[0]
+
+def invalidate():
+    """Drops the cached snapshot; the next read reloads from the DB."""
+    global _cache
+    with _lock:
+        _cache = None
 
 def save_settings_file(data):
     try:
         setting = AppSetting.query.first()
         if not setting:
-            setting = AppSetting(data=json.dumps(data))
+            setting = AppSetting(data=json.dumps(data), version=1)
             db.session.add(setting)
-        else: setting.data = json.dumps(data)
+        else:
+            setting.data = json.dumps(data)
+            setting.version = db.func.coalesce(AppSetting.version, 0) + 1 # Atomic across workers
         db.session.commit()
+        with _lock:
+            _install(setting.version, _merge_defaults(json.loads(setting.data)))
         return True
     except Exception as e:
         print(f"Settings Save Error: {e}")
         db.session.rollback()
         return False
+
+def check_version():
+    """Reloads the snapshot if another process saved newer settings (requires app context)."""
+    try:
+        row = db.session.query(AppSetting.version).first()
+        db_version = (row[0] or 0) if row else 0
+        if _cache is not None and _cache[0] == db_version:
+            return False
+        with _lock:
+            _install(*_read_db())
+        print(f"⚙️ Settings reloaded (version {db_version})")
+        return True
+    except Exception as e:
+        print(f"Settings Version Check Error: {e}")
+        return False
+
+def start_version_watch(app, interval=2.0):
+    """Background poll of AppSetting.version for multi-worker deployments (call once)."""
+    global _watcher
+    if _watcher is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                check_version()
+                db.session.remove()
+
+    _watcher = threading.Thread(target=run, daemon=True)
+    _watcher.start()
@@ -1,96 +1,134 @@
-import pandas as pd
 from datetime import datetime, timedelta
 import pytz
 import re
+import time
+import threading
+from bisect import bisect_left
+from managers.price_cache import price_cache
+from managers import instrument_cache
+from managers.instrument_index import InstrumentSet, ChainIndex, compact_instruments, frame_memory
 
 # Global IST Timezone
 IST = pytz.timezone('Asia/Kolkata')
 
-instrument_dump = None 
-symbol_map = {} 
-criteria_map = {} # <--- NEW GLOBAL CACHE
+# Current InstrumentSet (dump + index + search + chains of one trading day). Replaced as a
+# whole on refresh: readers take the reference once and use that set for the whole call.
+instruments = None
+instrument_cache_dir = None # On-disk copy of the day's list (set from config; None = off)
+refresh_time = (8, 45) # Daily pre-open refresh (IST, set from config; None = off)
+last_refresh = None # Diff report of the last refresh that replaced an older list
+_refresh_lock = threading.Lock() # One builder at a time; readers never take it
+_next_attempt = 0.0 # Scheduled refresh retry after a failed download
 
-def fetch_instruments(kite):
+def fetch_instruments(kite, force=False):
     """
-    Downloads the master instrument list, optimizes dates, and builds fast lookup maps.
-    Prioritizes specific exchanges (NFO > MCX > NSE) to handle duplicate symbols.
+    Makes sure the current trading day's instrument list is loaded.
+    A list from an earlier trading day is replaced (restart on the same day: on-disk
+    cache, else download); force=True always downloads a fresh list.
+    The new set is built in full and then published with one reference swap.
+    On failure the previous set stays in place.
     """
-    global instrument_dump, symbol_map, criteria_map
-    
-    # If already loaded and maps exist, skip to save bandwidth
-    if instrument_dump is not None and not instrument_dump.empty and symbol_map: 
-        return
+    global instruments, last_refresh
+    day = instrument_cache.trading_day()
+    current = instruments
+    if not force and current is not None and current.day == day:
+        return current
+
+    with _refresh_lock:
+        # Another thread may have loaded the same day while we waited
+        current = instruments
+        if not force and current is not None and current.day == day:
+            return current
+        fresh = _load_instruments(kite, day, force)
+        if fresh is None:
+            return current
+
+        report = fresh.diff(current) if current is not None else None
+        instruments = fresh # Atomic publish
+        price_cache.forget_tokens() # Memoised tokens may belong to expired listings
+        if report:
+            last_refresh = report
+            print(f"🔁 Instruments {report['from']} -> {report['to']}: +{report['added']} added, "
+                  f"-{report['expired']} expired, {report['lot_changed']} lot size changes")
+        return fresh
+
+def _load_instruments(kite, day, force):
+    """Builds the InstrumentSet for `day` from the on-disk cache or a download; None on failure."""
+    # Mock instruments are never cached (they would shadow the real list)
+    use_disk = bool(instrument_cache_dir) and not hasattr(kite, "mock_instruments")
+    if use_disk and not force:
+        cached = instrument_cache.load(instrument_cache_dir, day)
+        if cached:
+            fresh = InstrumentSet(day, *cached)
+            print(f"⚡ Instruments loaded from cache ({day}). Count: {len(fresh)}")
+            return fresh
 
     print("📥 Downloading Instrument List...")
     try:
-        instruments = kite.instruments()
-        if not instruments:
+        raw = kite.instruments()
+        if not raw:
             print("⚠️ Warning: Kite returned empty instrument list.")
-            return
+            return None
 
-        instrument_dump = pd.DataFrame(instruments)
-        
-        # Optimize Dates
-        if 'expiry' in instrument_dump.columns:
-            instrument_dump['expiry_str'] = pd.to_datetime(instrument_dump['expiry'], errors='coerce').dt.strftime('%Y-%m-%d')
-            instrument_dump['expiry_date'] = pd.to_datetime(instrument_dump['expiry'], errors='coerce').dt.date
-        
-        print("⚡ Building Fast Lookup Cache...")
-        
-        # Create a copy to sort and deduplicate without affecting the main search dump
-        temp_df = instrument_dump.copy()
-        
-        # Prioritize exchanges: NFO > MCX > CDS > NSE > BSE
-        exchange_priority = {'NFO': 0, 'MCX': 1, 'CDS': 2, 'NSE': 3, 'BSE': 4, 'BFO': 5}
-        temp_df['priority'] = temp_df['exchange'].map(exchange_priority).fillna(99)
+        # Compact: used columns only, categorical codes, float32 strikes, datetime64 expiry
+        dump = compact_instruments(raw)
+        del raw
         
-        # Sort by priority so the "best" exchange comes first
-        temp_df.sort_values('priority', inplace=True)
+        print("⚡ Building Fast Lookup Index...")
         
-        # Drop duplicates on tradingsymbol
-        unique_symbols = temp_df.drop_duplicates(subset=['tradingsymbol'])
+        # Vectorized: one row per tradingsymbol (best exchange first), integer-coded
+        # criteria keys for O(1) get_exact_symbol(NIFTY, 2024-01-25, 21500, CE)
+        fresh = InstrumentSet(day, dump)
         
-        # 1. Build Symbol Map (Existing)
-        symbol_map = unique_symbols.set_index('tradingsymbol').to_dict('index')
-        
-        # 2. Build Criteria Map (NEW OPTIMIZATION)
-        # This enables O(1) lookup for: get_exact_symbol(NIFTY, 2024-01-25, 21500, CE)
-        criteria_map = {}
-        # Filter for relevant rows to speed up iteration (Options/Futures have expiry)
-        subset = unique_symbols.dropna(subset=['name', 'expiry_str', 'instrument_type'])
-        
-        for _, row in subset.iterrows():
-            try:
-                # Key: (NAME, EXPIRY, TYPE, STRIKE)
-                # Strike is stored as float to handle mismatches (21500 vs 21500.0)
-                s_val = float(row['strike']) if row['strike'] else 0.0
-                key = (row['name'], row['expiry_str'], row['instrument_type'], s_val)
-                criteria_map[key] = row['tradingsymbol']
-            except: continue
-        
-        print(f"✅ Instruments Downloaded & Indexed. Count: {len(instrument_dump)}")
+        print(f"✅ Instruments Downloaded & Indexed. Count: {len(fresh)}")
+        if use_disk:
+            instrument_cache.save(instrument_cache_dir, day, fresh.dump, fresh.index)
+            # Switch to the memory-mapped copy: its pages are shared with the other workers
+            cached = instrument_cache.load(instrument_cache_dir, day)
+            if cached:
+                fresh.dump = cached[0]
+        return fresh
         
     except Exception as e:
         print(f"❌ Failed to fetch instruments: {e}")
-        # Do not reset to None here if partial data exists
-        if instrument_dump is None:
-             instrument_dump = pd.DataFrame()
-        symbol_map = {}
-        criteria_map = {}
+        return None
+
+def refresh_due(now=None):
+    """True once a day at refresh_time when the loaded list is from an earlier trading day."""
+    if refresh_time is None or instruments is None or _refresh_lock.locked() or time.time() < _next_attempt:
+        return False
+    now = now or datetime.now(IST)
+    return (now.hour, now.minute) >= refresh_time and instruments.day != instrument_cache.trading_day(now)
+
+def start_scheduled_refresh(kite):
+    """Runs the pre-open refresh on a background thread (lookups keep using the old set meanwhile)."""
+    def run():
+        global _next_attempt
+        fresh = fetch_instruments(kite)
+        if fresh is None or fresh.day != instrument_cache.trading_day():
+            _next_attempt = time.time() + 60 # Not published yet / download failed: retry in a minute
+    threading.Thread(target=run, daemon=True).start()
+
+def instrument_memory():
+    """Size of the instrument frame and how much of it is memory-mapped (shared read-only)."""
+    inst = instruments
+    if inst is None:
+        return {"day": None, "rows": 0, "bytes": 0, "mapped_bytes": 0}
+    return dict(frame_memory(inst.dump), day=inst.day)
 
 def get_exchange_name(symbol):
     """
     Determines the exchange (NSE, NFO, MCX) for a given symbol.
     """
-    global symbol_map, instrument_dump
-    
     # 1. Check if symbol already has exchange prefix (e.g. "NSE:RELIANCE")
     if ":" in symbol:
         return symbol.split(":")[0]
 
-    # 2. Fast Lookup via Map
-    if symbol_map and symbol in symbol_map:
-        return symbol_map[symbol]['exchange']
+    # 2. Fast Lookup via Index
+    inst = instruments
+    row = inst.index.row(symbol) if inst is not None else None
+    if row is not None:
+        return inst.index.exchange(row)
         
     # 3. Fallback Heuristics (if map not ready)
     if "NIFTY" in symbol or "BANKNIFTY" in symbol:
@@ -103,36 +141,27 @@ def get_exchange_name(symbol):
 def get_ltp(kite, symbol):
     """
     Fetches the Last Traded Price (LTP) with automatic exchange detection.
+    Served from the tick-fed price cache; cold symbols fall back to a REST quote.
     """
     try:
-        # 1. If symbol already has exchange (e.g., NSE:RELIANCE), try directly
+        # 1. If symbol already has exchange (e.g., NSE:RELIANCE), use it directly
         if ":" in symbol:
-            quote = kite.quote(symbol)
-            if quote and symbol in quote:
-                return quote[symbol]['last_price']
+            return price_cache.get(kite, symbol)
 
         # 2. Determine Exchange
         exch = get_exchange_name(symbol)
-        
-        # 3. Fetch Quote with constructed format
-        full_sym = f"{exch}:{symbol}"
-        quote = kite.quote(full_sym)
-        
-        if quote and full_sym in quote:
-            return quote[full_sym]['last_price']
-            
-        return 0
+        return price_cache.get(kite, f"{exch}:{symbol}")
     except Exception as e:
         print(f"⚠️ Error fetching LTP for {symbol}: {e}")
         return 0
 
 def get_indices_ltp(kite):
     try:
-        q = kite.quote(["NSE:NIFTY 50", "NSE:NIFTY BANK", "BSE:SENSEX"])
+        q = price_cache.get_many(kite, ["NSE:NIFTY 50", "NSE:NIFTY BANK", "BSE:SENSEX"])
         return {
-            "NIFTY": q.get("NSE:NIFTY 50", {}).get('last_price', 0),
-            "BANKNIFTY": q.get("NSE:NIFTY BANK", {}).get('last_price', 0),
-            "SENSEX": q.get("BSE:SENSEX", {}).get('last_price', 0)
+            "NIFTY": q["NSE:NIFTY 50"],
+            "BANKNIFTY": q["NSE:NIFTY BANK"],
+            "SENSEX": q["BSE:SENSEX"]
         }
     except:
         return {"NIFTY":0, "BANKNIFTY":0, "SENSEX":0}
@@ -149,80 +178,46 @@ def get_zerodha_symbol(common_name):
     return u
 
 def get_lot_size(tradingsymbol):
-    global symbol_map
-    if not symbol_map: return 1
+    inst = instruments
+    if inst is None: return 1
     
     # Fast Lookup
-    data = symbol_map.get(tradingsymbol)
-    if data:
-        return int(data.get('lot_size', 1))
+    row = inst.index.row(tradingsymbol)
+    if row is not None:
+        return inst.index.lot_size(row)
     return 1
 
 def get_display_name(tradingsymbol):
-    global symbol_map
-    # Attempt to load if missing
-    if not symbol_map:
+    inst = instruments
+    if inst is None:
         return tradingsymbol
         
     try:
         # Fast Lookup
-        data = symbol_map.get(tradingsymbol)
-        if data:
-            name = data['name']
-            inst_type = data['instrument_type']
-            
-            # Handle expiry safely
-            expiry_str = ""
-            if 'expiry_date' in data:
-                ed = data['expiry_date']
-                if pd.notnull(ed):
-                    if hasattr(ed, 'strftime'): expiry_str = ed.strftime('%d %b').upper()
-                    else: expiry_str = str(ed)
-
-            if inst_type in ["CE", "PE"]:
-                strike = int(data['strike'])
-                return f"{name} {strike} {inst_type} {expiry_str}"
-            elif inst_type == "FUT":
-                 return f"{name} FUT {expiry_str}"
-            else:
-                 return f"{name} {inst_type}"
+        row = inst.index.row(tradingsymbol)
+        if row is not None:
+            return inst.index.display_name(row)
         return tradingsymbol
     except:
         return tradingsymbol
 
 def search_symbols(kite, keyword, allowed_exchanges=None):
-    global instrument_dump
-    
-    if instrument_dump is None or instrument_dump.empty: 
-        fetch_instruments(kite)
-        if instrument_dump is None or instrument_dump.empty: return []
+    inst = instruments or fetch_instruments(kite)
+    if inst is None: return []
 
-    k = keyword.upper()
     if not allowed_exchanges: 
         allowed_exchanges = ['NSE', 'NFO', 'MCX', 'CDS', 'BSE', 'BFO']
     
     try:
-        # Filter Logic
-        mask = (instrument_dump['exchange'].isin(allowed_exchanges)) & (instrument_dump['name'].str.startswith(k, na=False))
-        matches = instrument_dump[mask]
-        
-        if matches.empty: return []
-            
-        unique_matches = matches.drop_duplicates(subset=['name', 'exchange']).head(10)
-        items_to_quote = [f"{row['exchange']}:{row['tradingsymbol']}" for _, row in unique_matches.iterrows()]
-        
-        quotes = {}
-        try:
-            if items_to_quote: quotes = kite.quote(items_to_quote)
-        except: pass
+        # Prefix lookup on the prebuilt index (substring / fuzzy fallback inside)
+        matches = inst.search.search(keyword, allowed_exchanges, limit=10)
+        if not matches: return []
+
+        # LTPs for all results in one batched quote
+        items_to_quote = [f"{exch}:{ts}" for _, exch, ts in matches]
+        quotes = price_cache.get_many(kite, items_to_quote, watch=False)
         
-        results = []
-        for _, row in unique_matches.iterrows():
-            key = f"{row['exchange']}:{row['tradingsymbol']}"
-            ltp = quotes.get(key, {}).get('last_price', 0)
-            results.append(f"{row['name']} ({row['exchange']}) : {ltp}")
-            
-        return results
+        return [f"{name} ({exch}) : {quotes.get(f'{exch}:{ts}', 0)}" for name, exch, ts in matches]
     except Exception as e:
         print(f"Search Logic Error: {e}")
         return []
@@ -235,9 +230,8 @@ def adjust_cds_lot_size(symbol, lot_size):
     return lot_size
 
 def get_symbol_details(kite, symbol, preferred_exchange=None):
-    global instrument_dump
-    if instrument_dump is None or instrument_dump.empty: fetch_instruments(kite)
-    if instrument_dump is None or instrument_dump.empty: return {}
+    inst = instruments or fetch_instruments(kite)
+    if inst is None: return {}
     
     if "(" in symbol and ")" in symbol:
         try:
@@ -246,12 +240,12 @@ def get_symbol_details(kite, symbol, preferred_exchange=None):
         except: pass
 
     clean = get_zerodha_symbol(symbol)
-    today = datetime.now(IST).date()
+    today = datetime.now(IST).date().isoformat()
     
-    rows = instrument_dump[instrument_dump['name'] == clean]
-    if rows.empty: return {}
+    u = inst.chain.underlying(clean)
+    if u is None: return {}
 
-    exchanges = rows['exchange'].unique().tolist()
+    exchanges = u.exchanges
     exchange_to_use = "NSE"
     
     if preferred_exchange and preferred_exchange in exchanges:
@@ -267,53 +261,45 @@ def get_symbol_details(kite, symbol, preferred_exchange=None):
     if clean == "BANKNIFTY": quote_sym = "NSE:NIFTY BANK"
     if clean == "SENSEX": quote_sym = "BSE:SENSEX"
     
+    # Near-month future: the fallback price for symbols without a spot quote (e.g. MCX)
+    fut_sym = None
+    fut_exch = 'NFO' if exchange_to_use == 'NSE' else ('BFO' if exchange_to_use == 'BSE' else exchange_to_use)
+    if fut_exch in u.futures:
+        expiries, symbols = u.futures[fut_exch]
+        i = bisect_left(expiries, today)
+        if i < len(expiries):
+            fut_sym = f"{fut_exch}:{symbols[i]}"
+
+    # Spot and future in one quote round trip
     ltp = 0
     try:
-        q = kite.quote(quote_sym)
-        if quote_sym in q: ltp = q[quote_sym]['last_price']
+        q = price_cache.get_many(kite, [quote_sym] + ([fut_sym] if fut_sym else []), watch=False)
+        ltp = q[quote_sym] or (q[fut_sym] if fut_sym else 0)
     except: pass
-        
-    if ltp == 0:
-        try:
-            fut_exch = 'NFO' if exchange_to_use == 'NSE' else ('BFO' if exchange_to_use == 'BSE' else exchange_to_use)
-            if 'expiry_date' in rows.columns:
-                futs_all = rows[(rows['instrument_type'] == 'FUT') & (rows['expiry_date'] >= today) & (rows['exchange'] == fut_exch)]
-                if not futs_all.empty:
-                    near_fut = futs_all.sort_values('expiry_date').iloc[0]
-                    fut_sym = f"{near_fut['exchange']}:{near_fut['tradingsymbol']}"
-                    ltp = kite.quote(fut_sym)[fut_sym]['last_price']
-        except: pass
 
     lot = 1
     for ex in ['MCX', 'CDS', 'BFO', 'NFO']:
-        futs = rows[(rows['exchange'] == ex) & (rows['instrument_type'] == 'FUT')]
-        if not futs.empty:
-            lot = int(futs.iloc[0]['lot_size'])
+        if ex in u.fut_lots:
+            lot = u.fut_lots[ex]
             if ex == 'CDS': lot = adjust_cds_lot_size(clean, lot)
             break
             
-    f_exp = []
-    o_exp = []
-    
-    if 'expiry_str' in rows.columns and 'expiry_date' in rows.columns:
-        f_exp = sorted(rows[(rows['instrument_type'] == 'FUT') & (rows['expiry_date'] >= today)]['expiry_str'].unique().tolist())
-        o_exp = sorted(rows[(rows['instrument_type'].isin(['CE', 'PE'])) & (rows['expiry_date'] >= today)]['expiry_str'].unique().tolist())
+    # Pre-sorted per underlying: just drop the expired ones
+    f_exp = ChainIndex.from_date(u.fut_expiries, today)
+    o_exp = ChainIndex.from_date(u.opt_expiries, today)
     
     return {"symbol": clean, "ltp": ltp, "lot_size": lot, "fut_expiries": f_exp, "opt_expiries": o_exp}
 
 def get_chain_data(symbol, expiry_date, option_type, ltp):
-    global instrument_dump
-    if instrument_dump is None or instrument_dump.empty: return []
+    inst = instruments
+    if inst is None: return []
     clean = get_zerodha_symbol(symbol)
     
-    if 'expiry_str' not in instrument_dump.columns: return []
+    chain = inst.chain.chain(clean, expiry_date, option_type)
+    if chain is None or not chain.strike_list: return []
     
-    c = instrument_dump[(instrument_dump['name'] == clean) & (instrument_dump['expiry_str'] == expiry_date) & (instrument_dump['instrument_type'] == option_type)]
-    if c.empty: return []
-    
-    strikes = sorted(c['strike'].unique().tolist())
-    if not strikes: return []
-    atm = min(strikes, key=lambda x: abs(x - ltp))
+    strikes = chain.strike_list
+    atm = strikes[chain.atm_index(ltp)]
     
     res = []
     for s in strikes:
@@ -328,63 +314,60 @@ def get_exact_symbol(symbol, expiry, strike, option_type):
     """
     Finds the exact tradingsymbol (e.g. NIFTY24JAN21500CE) using optimized lookup.
     """
-    global instrument_dump, criteria_map
-    
-    if instrument_dump is None or instrument_dump.empty: return None
+    inst = instruments
+    if inst is None or inst.dump.empty: return None
     if option_type == "EQ": return symbol
     clean = get_zerodha_symbol(symbol)
     
-    # --- NEW: FAST LOOKUP CACHE (O(1)) ---
+    # --- FAST LOOKUP INDEX (dict of packed keys) ---
     # This prevents scanning 194k rows every time the user selects a strike
-    if criteria_map:
-        try:
-            s_val = float(strike) if strike else 0.0
-            # Key must match the tuple structure created in fetch_instruments
-            key = (clean, expiry, option_type, s_val)
-            if key in criteria_map:
-                return criteria_map[key]
-        except: pass
+    try:
+        ts = inst.index.find(clean, expiry, option_type, strike)
+        if ts: return ts
+    except: pass
     # -------------------------------------
 
     # Fallback to DataFrame Filter (Slower, but safe if cache misses)
-    if 'expiry_str' not in instrument_dump.columns: return None
+    dump = inst.dump
+    if 'expiry_str' not in dump.columns: return None
 
     if option_type == "FUT":
-        mask = (instrument_dump['name'] == clean) & (instrument_dump['expiry_str'] == expiry) & (instrument_dump['instrument_type'] == "FUT")
+        mask = (dump['name'] == clean) & (dump['expiry_str'] == expiry) & (dump['instrument_type'] == "FUT")
     else:
         try: strike_price = float(strike)
         except: return None
-        mask = (instrument_dump['name'] == clean) & (instrument_dump['expiry_str'] == expiry) & (instrument_dump['strike'] == strike_price) & (instrument_dump['instrument_type'] == option_type)
+        strikes = dump['strike'].astype('float64').round(4) # float32 column
+        mask = (dump['name'] == clean) & (dump['expiry_str'] == expiry) & (strikes == round(strike_price, 4)) & (dump['instrument_type'] == option_type)
         
     if not mask.any(): return None
-    return instrument_dump[mask].iloc[0]['tradingsymbol']
+    return dump[mask].iloc[0]['tradingsymbol']
 
 def get_specific_ltp(kite, symbol, expiry, strike, inst_type):
     ts = get_exact_symbol(symbol, expiry, strike, inst_type)
     if not ts: return 0
     try:
-        global instrument_dump, symbol_map
         exch = "NFO"
         
-        # Optimized lookup using map first
-        if symbol_map and ts in symbol_map:
-            exch = symbol_map[ts]['exchange']
-        elif instrument_dump is not None and not instrument_dump.empty:
-             row = instrument_dump[instrument_dump['tradingsymbol'] == ts]
-             if not row.empty: exch = row.iloc[0]['exchange']
+        # Index lookup (covers every tradingsymbol in the dump)
+        inst = instruments
+        row = inst.index.row(ts) if inst is not None else None
+        if row is not None:
+            exch = inst.index.exchange(row)
              
-        return kite.quote(f"{exch}:{ts}")[f"{exch}:{ts}"]['last_price']
+        return price_cache.get(kite, f"{exch}:{ts}")
     except: return 0
 
 def get_instrument_token(tradingsymbol, exchange):
-    global instrument_dump
-    if instrument_dump is None or instrument_dump.empty: return None
-    try:
-        row = instrument_dump[(instrument_dump['tradingsymbol'] == tradingsymbol) & (instrument_dump['exchange'] == exchange)]
-        if not row.empty:
-            return int(row.iloc[0]['instrument_token'])
-    except: pass
-    return None
+    inst = instruments
+    if inst is None: return None
+    return inst.index.token_of(tradingsymbol, exchange)
+
+def get_instrument_by_token(token):
+    """Instrument record for a tick's token (symbol, exchange, name, type, strike, expiry, lot) or None."""
+    inst = instruments
+    if inst is None: return None
+    try: return inst.index.instrument(int(token))
+    except (TypeError, ValueError): return None
 
 def fetch_historical_data(kite, token, from_date, to_date, interval='minute'):
     try:
@@ -413,34 +413,25 @@ async function runBatchSimulation() {
     $('#simResultModal').modal('show');
 }
 
-// --- Real-Time Listener for Closed Trades ---
-// Wrapped in document.ready to ensure DOM elements exist
-$(document).ready(function() {
-    // Check if 'socket' is available from main.js
-    if (typeof socket !== 'undefined') {
-        console.log("✅ History.js: Listening for Closed Trade Updates...");
-        
-        socket.on('closed_trade_update', function(updates) {
-            updates.forEach(t => {
-                // 1. Update Global Cache
-                let existing = allClosedTrades.find(x => x.id == t.id);
-                if(existing) {
-                    existing.current_ltp = t.current_ltp;
-                    existing.made_high = t.made_high; 
-                }
-
-                // 2. Direct DOM Update for Live LTP
-                let el = $(`#ltp-${t.id}`);
-                if(el.length) {
-                    el.text(t.current_ltp.toFixed(2));
-                    
-                    // Flash effect
-                    el.removeClass('text-success text-danger');
-                    el.addClass(t.current_ltp >= t.entry_price ? 'text-success' : 'text-danger');
-                }
-            });
-        });
-    } else {
-        console.warn("⚠️ History.js: 'socket' is undefined. Make sure main.js is loaded BEFORE history.js in dashboard.html");
-    }
-});
+// --- Real-Time Updates for Closed Trades ---
+// Called with the 'closed' part of socket snapshot/patch messages: [{id, current_ltp, made_high, virtual_sl_hit}]
+function applyClosedPatches(updates) {
+    updates.forEach(t => {
+        // 1. Update Global Cache
+        let existing = allClosedTrades.find(x => x.id == t.id);
+        if(!existing) return;
+        existing.current_ltp = t.current_ltp;
+        existing.made_high = t.made_high; 
+        if(t.virtual_sl_hit) existing.virtual_sl_hit = true;
+
+        // 2. Direct DOM Update for Live LTP
+        let el = $(`#ltp-${t.id}`);
+        if(el.length) {
+            el.text(t.current_ltp.toFixed(2));
+            
+            // Flash effect
+            el.removeClass('text-success text-danger');
+            el.addClass(t.current_ltp >= existing.entry_price ? 'text-success' : 'text-danger');
+        }
+    });
+}
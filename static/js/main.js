@@ -22,11 +22,17 @@ $(document).ready(function() {
     });
 
     // Listen for Real-Time Trade Updates from Risk Engine
-    socket.on('trade_update', function(data) {
-        // 'data' is the fresh list of active trades from Python
-        if(typeof renderActivePositions === 'function') {
-            renderActivePositions(data);
+    // Full snapshot on connect / resync, then throttled field patches (ack'd so the server never floods us)
+    socket.on('trade_snapshot', function(msg, ack) {
+        if(typeof applySocketSnapshot === 'function') applySocketSnapshot(msg);
+        if(ack) ack();
+    });
+
+    socket.on('trade_patch', function(msg, ack) {
+        if(typeof applySocketPatch === 'function' && !applySocketPatch(msg)) {
+            socket.emit('resync'); // Missed a message: ask for a fresh snapshot
         }
+        if(ack) ack();
     });
     // ---------------------------------
 
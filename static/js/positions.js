@@ -1,11 +1,73 @@
 var activeTradesList = [];
 
+// --- DELTA SYNC STATE ---
+// The server only returns trades changed since the revision we last applied.
+var syncState = {
+    epoch: null,        // Server process id (a restart forces a full resync)
+    rev: 0,             // Last applied revision for positions
+    closedRev: 0,       // Last applied revision for closed trades (tab may be hidden)
+    etag: null,
+    positions: {},      // id -> trade
+    closed: {}          // id -> trade
+};
+
+// Applies a {mode, added, changed, removed} stream to an id -> trade map
+function applySyncStream(map, stream) {
+    if (stream.mode === 'full') {
+        for (let k in map) delete map[k];
+    }
+    stream.added.concat(stream.changed).forEach(t => { map[t.id] = t; });
+    stream.removed.forEach(id => { delete map[id]; });
+    return stream.mode === 'full' || stream.added.length > 0 || stream.changed.length > 0 || stream.removed.length > 0;
+}
+
+function syncMapToList(map, newestFirst) {
+    let list = Object.values(map);
+    list.sort((a, b) => newestFirst ? b.id - a.id : a.id - b.id);
+    return list;
+}
+
+// --- SOCKET PATCHES ---
+var socketSeq = 0;
+
+function applySocketSnapshot(msg) {
+    socketSeq = msg.seq;
+    syncState.positions = {};
+    msg.trades.forEach(t => { syncState.positions[t.id] = t; });
+    renderActivePositions(syncMapToList(syncState.positions, false));
+    if(msg.closed && typeof applyClosedPatches === 'function') applyClosedPatches(msg.closed);
+}
+
+// Returns false if the message does not follow the last one (caller asks for a resync)
+function applySocketPatch(msg) {
+    if (msg.seq !== socketSeq + 1) return false;
+    socketSeq = msg.seq;
+
+    let known = true;
+    msg.upserts.forEach(t => { syncState.positions[t.id] = t; });
+    msg.patches.forEach(p => {
+        let t = syncState.positions[p.id];
+        if (t) Object.assign(t, p); else known = false;
+    });
+    msg.removed.forEach(id => { delete syncState.positions[id]; });
+
+    if (msg.upserts.length || msg.patches.length || msg.removed.length) {
+        renderActivePositions(syncMapToList(syncState.positions, false));
+    }
+    if(msg.closed.length && typeof applyClosedPatches === 'function') applyClosedPatches(msg.closed);
+    return known;
+}
+
 // 1. Main Sync Loop
 // Fetches Indices, System Status, and specific LTP for Forms
 function updateData() {
     // A. Prepare Request
+    let includeClosed = $('#closed').is(':visible'); // Save bandwidth: only fetch closed if tab is open
     let payload = {
-        include_closed: $('#closed').is(':visible'), // Save bandwidth: only fetch closed if tab is open
+        include_closed: includeClosed,
+        epoch: syncState.epoch,
+        rev: syncState.rev,
+        closed_rev: syncState.closedRev,
         ltp_req: null
     };
 
@@ -42,8 +104,12 @@ function updateData() {
         url: '/api/sync',
         data: JSON.stringify(payload),
         contentType: "application/json",
-        success: function(d) {
-            
+        headers: syncState.etag ? {'If-None-Match': syncState.etag} : {},
+        success: function(d, textStatus, xhr) {
+            // 0. Nothing changed since the last poll
+            if (xhr.status === 304 || !d) return;
+            syncState.etag = xhr.getResponseHeader('ETag');
+
             // 1. Update Status Badge & Login Button
             let status = d.status || {};
             if (status.state === 'FAILED') {
@@ -93,14 +159,22 @@ function updateData() {
             }
 
             // 4. Update Active Positions (Fallback for Socket)
-            // Only update if socket is not firing (or to ensure sync)
+            // Only re-render when the server reported changes
+            let sync = d.sync || {};
+            if (sync.epoch !== syncState.epoch) { syncState.epoch = sync.epoch; syncState.closedRev = 0; }
             if(d.positions) {
-                renderActivePositions(d.positions);
+                if (applySyncStream(syncState.positions, d.positions)) {
+                    renderActivePositions(syncMapToList(syncState.positions, false));
+                }
+                syncState.rev = sync.rev;
             }
 
             // 5. Update Closed Trades (if requested)
-            if (d.closed_trades && d.closed_trades.length > 0) {
-                if(typeof renderClosedTrades === 'function') renderClosedTrades(d.closed_trades);
+            if (d.closed_trades) {
+                if (applySyncStream(syncState.closed, d.closed_trades)) {
+                    if(typeof renderClosedTrades === 'function') renderClosedTrades(syncMapToList(syncState.closed, true));
+                }
+                syncState.closedRev = sync.rev;
             }
         },
         error: function(err) {